@@ -0,0 +1,90 @@
+"""
+Compression benchmark: bytes sent on the wire against the CPU time spent to
+compress them, for a log-like text file and an incompressible (random) one.
+
+    python -m benchmarks.bench_compression --size 64
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+
+import aiofiles
+
+from src.compressors import CompressingReader
+from src.utils import CompressionEnum
+
+LEVELS = {CompressionEnum.gzip: [1, 6, 9], CompressionEnum.zstd: [1, 3, 19]}
+
+
+def make_text(filename, size):
+    levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
+    with open(filename, "w") as f:
+        i = 0
+        while f.tell() < size:
+            f.write(
+                f"2022-10-19 12:{i // 60 % 60:02}:{i % 60:02} {levels[i % 4]} "
+                f"worker-{i % 8} processed request {i} in {i % 997} ms\n"
+            )
+            i += 1
+
+
+def make_random(filename, size):
+    with open(filename, "wb") as f:
+        f.write(random.randbytes(size))
+
+
+async def measure(filename, algorithm=None, level=None):
+    start, cpu = time.perf_counter(), time.process_time()
+    wire = 0
+    async with aiofiles.open(filename, "rb") as f:
+        if algorithm is None:
+            while chunk := await f.read(64 * 1024):
+                wire += len(chunk)
+        else:
+            async for chunk in CompressingReader(f, algorithm, level):
+                wire += len(chunk)
+    return dict(
+        algorithm=algorithm and algorithm.value,
+        level=level,
+        wire=wire,
+        ratio=round(wire / os.path.getsize(filename), 4),
+        cpu=round(time.process_time() - cpu, 4),
+        elapsed=round(time.perf_counter() - start, 4),
+    )
+
+
+async def run(filename):
+    results = [await measure(filename)]
+    for algorithm, levels in LEVELS.items():
+        if algorithm == CompressionEnum.zstd and not importlib.util.find_spec(
+            "zstandard"
+        ):
+            continue
+        for level in levels:
+            results.append(await measure(filename, algorithm, level))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=64, help="file size in MiB")
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, make in [("text", make_text), ("random", make_random)]:
+            filename = os.path.join(tmp, name)
+            make(filename, size)
+            results[name] = asyncio.run(run(filename))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Event loop benchmark: the notifier throughput and the webapp API latency on
+the default asyncio loop and on uvloop (when it is installed).
+
+Each loop runs in its own process, the policy is set before the loop exists
+as `--loop` does. The notifier posts logs to the webapp (which inserts them
+in SQLite), and a client measures the latency of GET /api/v1/logs.
+
+    python -m benchmarks.bench_loops --notifications 2000 --requests 500
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+from src.api.server import make_app
+from src.notifiers import Notifier
+from src.utils import LoopEnum, StatusEnum, get_payload, use_event_loop
+
+
+async def serve(db: Path) -> tuple[web.AppRunner, str]:
+    app = make_app(db=db)
+    await app["dao"].create_table()
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def notify(url: str, notifications: int, concurrency: int) -> dict:
+    notifier = Notifier(url)
+    payload = await get_payload(
+        "/data/logs/app.log", "/backup/logs", StatusEnum.SUCCEEDED, "file"
+    )
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with slots:
+            await notifier.notify(dict(payload))
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[one() for _ in range(notifications)])
+    finally:
+        await notifier.stop()
+    elapsed = time.perf_counter() - start
+    return dict(
+        notifications=notifications,
+        elapsed=round(elapsed, 3),
+        per_s=round(notifications / elapsed, 1),
+    )
+
+
+async def query(url: str, requests: int) -> dict:
+    latencies = []
+    async with ClientSession() as session:
+        for _ in range(requests):
+            start = time.perf_counter()
+            async with session.get(url, params={"limit": 20}) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return dict(
+        requests=requests,
+        p50_ms=round(quantiles[49] * 1000, 2),
+        p99_ms=round(quantiles[98] * 1000, 2),
+    )
+
+
+async def run(notifications: int, requests: int, concurrency: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        runner, base_url = await serve(Path(tmp) / "db.sqlite3")
+        try:
+            return dict(
+                loop=type(asyncio.get_running_loop()).__module__,
+                notifier=await notify(
+                    f"{base_url}/api/v1/logs", notifications, concurrency
+                ),
+                api=await query(f"{base_url}/api/v1/logs", requests),
+            )
+        finally:
+            await runner.cleanup()
+
+
+def run_in_process(loop, notifications, requests, concurrency) -> dict:
+    use_event_loop(LoopEnum(loop))
+    return asyncio.run(run(notifications, requests, concurrency))
+
+
+def main():
+    available = [LoopEnum.asyncio.value]
+    if importlib.util.find_spec("uvloop"):
+        available.append(LoopEnum.uvloop.value)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--loops", nargs="+", choices=available, default=available)
+    parser.add_argument("--notifications", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for loop in args.loops:
+        with ctx.Pool(1) as pool:
+            results[loop] = pool.apply(
+                run_in_process,
+                (loop, args.notifications, args.requests, args.concurrency),
+            )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Memory benchmark: size of a backlog of queued messages, as the watcher builds
+them (a folder, a size and the detection time), with the slotted Message and
+with the former dataclass of two dicts and a uuid4().
+
+    python -m benchmarks.bench_messages --messages 1000000
+"""
+import argparse
+import dataclasses
+import gc
+import itertools
+import json
+import time
+import tracemalloc
+import uuid
+
+from src.config import FolderModel
+from src.utils import create_message
+
+DESTINATIONS = ["/backup/video", "http://localhost:8080/documents", "ftp://ftp/img"]
+
+
+@dataclasses.dataclass(frozen=True)
+class LegacyMessage:
+    # The former representation.
+    body: dict
+    headers: dict = dataclasses.field(default_factory=dict)
+    id: uuid.UUID = dataclasses.field(default_factory=uuid.uuid4)
+
+
+def legacy_message(filename, destination, folder, size):
+    msg = LegacyMessage(
+        body=dict(filename=filename, destination=destination),
+        headers=dict(folder=folder),
+    )
+    msg.headers["size"] = size
+    msg.headers.setdefault("timestamps", {})["detected"] = time.monotonic()
+    return msg
+
+
+def message(filename, destination, folder, size):
+    msg = create_message(filename, destination, folder=folder, size=size)
+    msg.mark("detected")
+    return msg
+
+
+def build_backlog(build, filenames, folders) -> list:
+    return [
+        build(name, folder.path, folder, i)
+        for i, (name, folder) in enumerate(
+            zip(filenames, itertools.islice(itertools.cycle(folders), len(filenames)))
+        )
+    ]
+
+
+def measure(build, messages: int) -> dict:
+    folders = [
+        FolderModel(path=destination, extensions=["mp4"])
+        for destination in DESTINATIONS
+    ]
+    # The filenames are allocated outside of the measure, the watcher gets
+    # them from the scan of the backlog anyway.
+    filenames = [f"/data/backlog/file-{i}.mp4" for i in range(messages)]
+    gc.collect()
+    start = time.perf_counter()
+    backlog = build_backlog(build, filenames, folders)
+    elapsed = time.perf_counter() - start
+    del backlog
+    gc.collect()
+    # Built again to measure the memory, tracing the allocations is slow.
+    tracemalloc.start()
+    backlog = build_backlog(build, filenames, folders)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del backlog
+    return dict(
+        messages=messages,
+        build_s=round(elapsed, 3),
+        mib=round(current / 2**20, 1),
+        peak_mib=round(peak / 2**20, 1),
+        bytes_per_message=round(current / messages),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    results = dict(
+        legacy=measure(legacy_message, args.messages),
+        slotted=measure(message, args.messages),
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
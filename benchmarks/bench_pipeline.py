@@ -0,0 +1,215 @@
+"""
+Pipeline benchmark: files dropped in a watched directory and dispatched by
+the whole FileWatcher pipeline to local stand-ins of the destinations (a
+directory, an aiohttp upload server, an aioftp server).
+
+Each (scenario, protocol) runs in its own process, for its peak RSS and so
+the workers of a run do not leak in the next one. It reports the
+throughput, the p50/p99 latency from the drop of a file to the end of its
+transfer, the peak RSS and the peak number of open file descriptors.
+
+    python -m benchmarks.bench_pipeline --scenarios small mixed --scale 0.1
+    python -m benchmarks.bench_pipeline --output benchmarks/results/HEAD.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.loadgen import (
+    EXTENSION,
+    SCENARIOS,
+    FtpServer,
+    UploadServer,
+    drop_files,
+    scenario_files,
+)
+from src.utils import StatusEnum
+
+PROTOCOLS = ("file", "http", "ftp")
+
+
+class Recorder:
+    """Stands for the tracer of the workers, to time the end of the transfers."""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        # Delivered (or skipped) files, failures are not part of the latency.
+        self.finished: dict[str, float] = {}
+        self.failed: set[str] = set()
+        self.done = asyncio.Event()
+
+    @property
+    def failures(self) -> int:
+        return len(self.failed)
+
+    def export(self, message, status=None):
+        filename = message.filename
+        if status == StatusEnum.FAILED:
+            self.failed.add(filename)
+        else:
+            # Delivered by a retry after a failed attempt.
+            self.failed.discard(filename)
+            self.finished[filename] = time.monotonic()
+        if len(self.finished) + len(self.failed) >= self.expected:
+            self.done.set()
+
+    def export_notification(self, message, attempt=None):
+        pass
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+async def sample_fds(peak: list[int], interval: float = 0.05):
+    while True:
+        peak[0] = max(peak[0], open_fds())
+        await asyncio.sleep(interval)
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class Directory:
+    """Stand-in of a local destination."""
+
+    def __init__(self, path: Path):
+        self.url = str(path)
+        path.mkdir()
+
+    @property
+    def files(self) -> int:
+        return len(os.listdir(self.url))
+
+    async def stop(self):
+        pass
+
+
+async def start_destination(protocol: str, tmp: Path):
+    if protocol == "file":
+        return Directory(tmp / "destination")
+    if protocol == "http":
+        server = UploadServer()
+    else:
+        (tmp / "ftp").mkdir()
+        server = FtpServer(tmp / "ftp")
+    await server.start()
+    return server
+
+
+async def run(scenario: str, protocol: str, scale: float, concurrency: int) -> dict:
+    from src.config import FolderModel, Settings, SourceModel
+    from src.exchange import FileWatcher
+
+    files = scenario_files(scenario, scale)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source, staging = tmp / "source", tmp / "staging"
+        source.mkdir()
+        staging.mkdir()
+        server = await start_destination(protocol, tmp)
+        config = Settings(
+            sources=[
+                SourceModel(
+                    path=source,
+                    folders=[FolderModel(path=server.url, extensions=[EXTENSION])],
+                )
+            ]
+        )
+        watcher = FileWatcher(config, concurrency=concurrency)
+        recorder = Recorder(len(files))
+        for p in watcher.PROCESSORS_REGISTRY.values():
+            p.tracer = recorder
+
+        peak_fds = [open_fds()]
+        sampler = asyncio.create_task(sample_fds(peak_fds))
+        await watcher.start()
+        try:
+            start = time.monotonic()
+            dropped = await drop_files(files, staging, source)
+            await recorder.done.wait()
+            elapsed = time.monotonic() - start
+        finally:
+            await watcher.stop()
+            sampler.cancel()
+            delivered = server.files
+            await server.stop()
+
+    latencies = [
+        recorder.finished[f] - t for f, t in dropped.items() if f in recorder.finished
+    ]
+    volume = sum(size for _, size in files) / 2**20
+    return dict(
+        files=len(files),
+        mib=round(volume, 1),
+        elapsed=round(elapsed, 3),
+        files_per_s=round(len(files) / elapsed, 1),
+        mib_per_s=round(volume / elapsed, 1),
+        p50_ms=round(percentile(latencies, 50) * 1000, 1),
+        p99_ms=round(percentile(latencies, 99) * 1000, 1),
+        peak_rss_mib=round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        peak_fds=peak_fds[0],
+        failures=recorder.failures,
+        delivered=delivered,
+    )
+
+
+def run_in_process(scenario, protocol, scale, concurrency) -> dict:
+    return asyncio.run(run(scenario, protocol, scale, concurrency))
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--protocols", nargs="+", choices=PROTOCOLS, default=PROTOCOLS)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiplies the number of files"
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--output", type=Path, help="JSON file of the results")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = dict(revision=git_revision(), scale=args.scale, runs={})
+    for scenario in args.scenarios:
+        for protocol in args.protocols:
+            with ctx.Pool(1) as pool:
+                results["runs"][f"{scenario}/{protocol}"] = pool.apply(
+                    run_in_process, (scenario, protocol, args.scale, args.concurrency)
+                )
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Scheduling benchmark: delivery latency of a mix of small and big files sent
+by a worker with a FIFO queue and with the lane scheduler. Transfers are
+simulated by sleeps proportional to the file sizes.
+
+    python -m benchmarks.bench_scheduling --small 500 --big 10 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from src.schedulers import LaneScheduler, MiB
+from src.utils import create_message
+
+# Simulated bandwidth, in bytes per second.
+BANDWIDTH = 10 * 1024 * MiB
+
+
+class FifoQueue(asyncio.Queue):
+    def put_nowait(self, message, size=0):
+        super().put_nowait(message)
+
+
+async def simulate(queue, files, concurrency):
+    latencies = []
+    start = time.perf_counter()
+    for name, size in files:
+        queue.put_nowait(create_message(name, "/tmp", size=size), size=size)
+
+    async def worker():
+        while not queue.empty():
+            message = queue.get_nowait()
+            await asyncio.sleep(message.size / BANDWIDTH)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    latencies.sort()
+    return dict(
+        p50=round(statistics.median(latencies), 3),
+        p99=round(latencies[int(0.99 * (len(latencies) - 1))], 3),
+        total=round(latencies[-1], 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--small", type=int, default=500)
+    parser.add_argument("--big", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    files = [(f"small-{i}.pdf", random.randint(10_000, MiB)) for i in range(args.small)]
+    files += [
+        (f"big-{i}.mp4", random.randint(1, 2) * 1024 * MiB) for i in range(args.big)
+    ]
+    random.shuffle(files)
+
+    results = dict(
+        files=len(files),
+        concurrency=args.concurrency,
+        fifo=asyncio.run(simulate(FifoQueue(), files, args.concurrency)),
+        lanes=asyncio.run(simulate(LaneScheduler(), files, args.concurrency)),
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Stage runner benchmark: throughput of the hashing and of the compression of
+the files on the event loop / in the thread pool, and in the process pool.
+
+    python -m benchmarks.bench_stages --files 8 --size 32 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import aiofiles
+
+from src.checksums import file_digest
+from src.compressors import CompressingReader
+from src.stages import StageRunner
+from src.utils import ChecksumEnum, CompressionEnum
+
+
+def make_files(directory, files, size):
+    line = b"2022-10-19 12:00:00 INFO worker processed request in 12 ms\n"
+    filenames = []
+    for i in range(files):
+        filename = os.path.join(directory, f"file-{i}.log")
+        with open(filename, "wb") as f:
+            f.write(line * (size // len(line)))
+        filenames.append(filename)
+    return filenames
+
+
+async def compress_on_loop(filename):
+    async with aiofiles.open(filename, "rb") as f:
+        return sum([len(c) async for c in CompressingReader(f, CompressionEnum.gzip)])
+
+
+async def compress_in_pool(runner, filename):
+    return sum([len(c) async for c in runner.compress(filename, CompressionEnum.gzip)])
+
+
+async def timed(coroutines, volume):
+    start = time.perf_counter()
+    await asyncio.gather(*coroutines)
+    elapsed = time.perf_counter() - start
+    return dict(elapsed=round(elapsed, 3), mib_per_s=round(volume / elapsed, 1))
+
+
+async def run(filenames, processes, volume):
+    runner = StageRunner(processes)
+    await runner.run(os.getpid)  # spawn the pool out of the measures.
+    try:
+        return dict(
+            digest_threads=await timed(
+                [asyncio.to_thread(file_digest, f) for f in filenames], volume
+            ),
+            digest_processes=await timed(
+                [runner.digest(f, ChecksumEnum.blake2b) for f in filenames], volume
+            ),
+            compress_loop=await timed([compress_on_loop(f) for f in filenames], volume),
+            compress_processes=await timed(
+                [compress_in_pool(runner, f) for f in filenames], volume
+            ),
+        )
+    finally:
+        await runner.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--size", type=int, default=32, help="file size in MiB")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = make_files(tmp, args.files, args.size * 1024 * 1024)
+        results = dict(
+            files=args.files,
+            size=args.size,
+            processes=args.processes,
+            **asyncio.run(run(filenames, args.processes, args.files * args.size)),
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
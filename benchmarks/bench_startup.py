@@ -0,0 +1,88 @@
+"""
+Startup benchmark: time spent by the FileWatcher to enumerate a large backlog
+directory, and time until the first file of the backlog can be dispatched.
+
+    python -m benchmarks.bench_startup --files 200000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from src.config import Settings
+from src.exchange import FileWatcher
+
+EXTENSIONS = [
+    "mp4", "flv", "avi", "mov", "wmv", "webm", "mkv", "mp3", "wav", "ogg",
+    "pdf", "djvu", "tex", "ps", "doc", "docx", "png", "jpg", "jpeg", "gif",
+]  # fmt: skip
+
+
+def make_backlog(directory, files):
+    for i in range(files):
+        # one file out of ten is not supported, one out of five is upper case.
+        ext = "txt" if i % 10 == 0 else EXTENSIONS[i % len(EXTENSIONS)]
+        ext = ext.upper() if i % 5 == 0 else ext
+        open(os.path.join(directory, f"file-{i}.{ext}"), "wb").close()
+
+
+def legacy_collect(source, extensions):
+    # The former implementation: one glob per extension and a list lookup.
+    collected = []
+    for ext in extensions:
+        for filename in Path(source).glob(f"*.{ext}"):
+            if filename not in collected:
+                collected.append(filename)
+    return collected
+
+
+async def collect(watcher):
+    start = time.perf_counter()
+    first, count = None, 0
+
+    async def drain():
+        nonlocal first, count
+        while True:
+            await watcher.unprocessed.get()
+            first = first or time.perf_counter() - start
+            count += 1
+            watcher.unprocessed.task_done()
+
+    consumer = asyncio.create_task(drain())
+    await watcher._collect_unprocessed()
+    await watcher.unprocessed.join()
+    consumer.cancel()
+    return dict(collected=count, first=first, scan=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument(
+        "--legacy", action="store_true", help="also time the glob based scan"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        os.mkdir(source)
+        make_backlog(source, args.files)
+        config = Settings(
+            source=source, folders=[dict(path=tmp, extensions=EXTENSIONS)]
+        )
+
+        results = dict(files=args.files, **asyncio.run(collect(FileWatcher(config))))
+
+        if args.legacy:
+            start = time.perf_counter()
+            results["legacy_collected"] = len(legacy_collect(source, EXTENSIONS))
+            results["legacy_scan"] = time.perf_counter() - start
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
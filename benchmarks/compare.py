@@ -0,0 +1,66 @@
+"""
+Compare two results of the pipeline benchmark, e.g. of two commits, and exit
+with an error when a measure regressed by more than the threshold.
+
+    python -m benchmarks.compare benchmarks/results/a1b2c3d.json benchmarks/results/e4f5a6b.json
+"""
+import argparse
+import json
+import sys
+
+# Measures compared, and whether the higher the better.
+MEASURES = {
+    "files_per_s": True,
+    "mib_per_s": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "peak_rss_mib": False,
+    "peak_fds": False,
+}
+
+
+def compare(base: dict, head: dict, threshold: float) -> tuple[list[dict], int]:
+    rows, regressions = [], 0
+    for run, measures in head["runs"].items():
+        if run not in base["runs"]:
+            continue
+        for measure, higher_is_better in MEASURES.items():
+            before, after = base["runs"][run][measure], measures[measure]
+            change = (after - before) / before if before else 0.0
+            regressed = (-change if higher_is_better else change) > threshold
+            regressions += regressed
+            rows.append(
+                dict(
+                    run=run,
+                    measure=measure,
+                    base=before,
+                    head=after,
+                    change=f"{change:+.1%}",
+                    regressed=regressed,
+                )
+            )
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base", type=argparse.FileType())
+    parser.add_argument("head", type=argparse.FileType())
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative change tolerated"
+    )
+    args = parser.parse_args()
+
+    base, head = json.load(args.base), json.load(args.head)
+    rows, regressions = compare(base, head, args.threshold)
+    print(
+        json.dumps(
+            dict(base=base.get("revision"), head=head.get("revision"), changes=rows),
+            indent=2,
+        )
+    )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
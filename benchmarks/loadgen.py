@@ -0,0 +1,110 @@
+"""
+Load generator: synthetic drop directories, and the stand-ins of the
+destinations (an aiohttp upload server, an aioftp server, a directory).
+"""
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import aioftp
+from aiohttp import web
+
+KiB = 1024
+MiB = 1024 * KiB
+
+# (number of files, size of the files) of each scenario, before scaling.
+SCENARIOS = {
+    "small": [(2000, 4 * KiB)],
+    "huge": [(3, 64 * MiB)],
+    "mixed": [(1000, 16 * KiB), (50, 1 * MiB), (2, 64 * MiB)],
+}
+
+EXTENSION = "bin"
+
+
+def scenario_files(name: str, scale: float = 1.0) -> list[tuple[str, int]]:
+    """(name, size) of the files of a scenario, `scale` multiplies their number."""
+    files = []
+    for group, (count, size) in enumerate(SCENARIOS[name]):
+        for i in range(max(1, round(count * scale))):
+            files.append((f"{name}-{group}-{i}.{EXTENSION}", size))
+    return files
+
+
+async def drop_files(
+    files: list[tuple[str, int]], staging: Path, source: Path
+) -> dict[str, float]:
+    """
+    Write the files in a staging directory then move them to the watched
+    source, as a producer would, return their drop time (time.monotonic).
+    """
+    chunk = os.urandom(MiB)
+    dropped = {}
+    for name, size in files:
+        await asyncio.to_thread(write_file, staging / name, size, chunk)
+        os.rename(staging / name, source / name)
+        dropped[str(source / name)] = time.monotonic()
+        await asyncio.sleep(0)
+    return dropped
+
+
+def write_file(path: Path, size: int, chunk: bytes) -> None:
+    with open(path, "wb") as f:
+        while size > 0:
+            f.write(chunk[: min(size, len(chunk))])
+            size -= len(chunk)
+
+
+class UploadServer:
+    """Stand-in of an HTTP destination, it counts what it receives."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self._runner = None
+        self.url = None
+
+    async def upload(self, request: web.Request) -> web.Response:
+        # A file per request, the multipart body is counted, not parsed.
+        async for chunk in request.content.iter_chunked(MiB):
+            self.bytes += len(chunk)
+        self.files += 1
+        return web.Response()
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=0)
+        app.router.add_post("/upload", self.upload)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/upload"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class FtpServer:
+    """Stand-in of an FTP destination storing the files in a directory."""
+
+    def __init__(self, home: Path, user="filedispatch", password="filedispatch"):
+        self.home = home
+        self.server = aioftp.Server(
+            [aioftp.User(user, password, base_path=home)], block_size=MiB
+        )
+        self._credentials = f"{user}:{password}"
+        self.url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        await self.server.start(host, port)
+        port = self.server.server.sockets[0].getsockname()[1]
+        self.url = f"ftp://{self._credentials}@{host}:{port}/"
+
+    async def stop(self):
+        await self.server.close()
+
+    @property
+    def files(self) -> int:
+        return sum(len(files) for _, _, files in os.walk(self.home))
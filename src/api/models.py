@@ -10,6 +10,7 @@ import aiosqlite
 from pydantic import parse_obj_as
 from pypika import CustomFunction, Order
 
+from src.metrics import DB_INSERT_SECONDS
 from src.schemas import ReadOnlyLogEntry, WriteOnlyLogEntry, QueryDict
 
 from .queries import (
@@ -20,6 +21,9 @@ from .queries import (
     DeleteLogEntryQuery,
     DropTableQuery,
     LogEntry,
+    LogEntryColumns,
+    TableInfoQuery,
+    add_column_query,
 )
 
 SQLITE_DATE_CAST = CustomFunction("strftime", ["format", "date"])
@@ -99,20 +103,35 @@ class Dao:
                     return el
 
     async def insert(self, data: WriteOnlyLogEntry) -> ReadOnlyLogEntry:
-        data_json = json.loads(data.json())
+        id_, params = self._insert_params(data)
         async with self.connector() as db:
-            query = CreateLogEntryQuery.get_sql()
-            context = data_json
-            id_ = uuid.uuid4()
-            context["id"] = id_
-            context["created"] = datetime.datetime.now().isoformat()
-            context = self.stringify(context)
-            query = query % context
-            await db.execute(query)
-            await db.commit()
+            with DB_INSERT_SECONDS.time():
+                await db.execute(CreateLogEntryQuery.get_sql(), params)
+                await db.commit()
 
         return await self.fetch_one(pk=id_)
 
+    async def insert_many(self, entries: List[WriteOnlyLogEntry]) -> None:
+        """Insert the entries in a single transaction."""
+        if not entries:
+            return
+        params = [self._insert_params(data)[1] for data in entries]
+        async with self.connector() as db:
+            with DB_INSERT_SECONDS.time():
+                await db.executemany(CreateLogEntryQuery.get_sql(), params)
+                await db.commit()
+
+    def _insert_params(self, data: WriteOnlyLogEntry) -> tuple[UUID, dict]:
+        params = json.loads(data.json())
+        id_ = uuid.uuid4()
+        # Stored as text, the way the entries are looked up by id.
+        params["id"] = str(id_)
+        params["created"] = datetime.datetime.now().isoformat()
+        if params["byte_size"] is not None:
+            # A REAL column, a whole number may not fit an sqlite INTEGER.
+            params["byte_size"] = float(params["byte_size"])
+        return id_, params
+
     async def delete(self, pk: UUID) -> None:
         async with self.connector() as db:
             query = DeleteLogEntryQuery.get_sql()
@@ -124,6 +143,12 @@ class Dao:
         async with self.connector() as db:
             query = CreateTableQuery.get_sql()
             await db.execute(query)
+            # Add the columns missing from a table created by a former version.
+            async with db.execute(TableInfoQuery) as cursor:
+                existing = {row[1] for row in await cursor.fetchall()}
+            for column in LogEntryColumns:
+                if column.name not in existing:
+                    await db.execute(add_column_query(column))
             await db.commit()
 
     async def drop_table(self):
@@ -2,7 +2,7 @@ import operator
 import uuid
 from datetime import datetime
 from pypika import SQLLiteQuery as Query, Table, Field, Column
-from pypika.terms import PyformatParameter as Parameter
+from pypika.terms import NamedParameter, PyformatParameter as Parameter
 
 # Filtres
 # --------------------------------------
@@ -22,78 +22,66 @@ from pypika.terms import PyformatParameter as Parameter
 
 LogEntry = Table("log_entries")
 
+LogEntryColumns = [
+    Column("id", "BLOB", nullable=False),
+    Column("filename", "VARCHAR(255)", nullable=False),
+    Column("source", "VARCHAR(255)", nullable=False),
+    Column("destination", "VARCHAR(255)", nullable=False),
+    Column("extension", "VARCHAR(20)", nullable=False),
+    Column("worker", "VARCHAR(255)", nullable=False),
+    Column("protocol", "VARCHAR(255)", nullable=False),
+    Column("status", "VARCHAR(20)", nullable=False),
+    Column("size", "VARCHAR(255)", nullable=True),
+    Column("byte_size", "REAL", nullable=True),
+    Column("reason", "TEXT", nullable=True, default=None),
+    Column("created", "DATETIME", nullable=False),
+    # Columns added after the first release, they must be nullable to be
+    # added to the existing tables (see Dao.create_table).
+    Column("checksum", "VARCHAR(128)", nullable=True, default=None),
+    Column("attempt", "INTEGER", nullable=True, default=None),
+    Column("queue_time", "REAL", nullable=True, default=None),
+    Column("wait_time", "REAL", nullable=True, default=None),
+    Column("transfer_time", "REAL", nullable=True, default=None),
+    Column("notify_time", "REAL", nullable=True, default=None),
+]
+
 CreateTableQuery = (
     Query.create_table(LogEntry)
-    .columns(
-        Column("id", "BLOB", nullable=False),
-        Column("filename", "VARCHAR(255)", nullable=False),
-        Column("source", "VARCHAR(255)", nullable=False),
-        Column("destination", "VARCHAR(255)", nullable=False),
-        Column("extension", "VARCHAR(20)", nullable=False),
-        Column("worker", "VARCHAR(255)", nullable=False),
-        Column("protocol", "VARCHAR(255)", nullable=False),
-        Column("status", "VARCHAR(20)", nullable=False),
-        Column("size", "VARCHAR(255)", nullable=True),
-        Column("byte_size", "REAL", nullable=True),
-        Column("reason", "TEXT", nullable=True, default=None),
-        Column("created", "DATETIME", nullable=False),
-    )
+    .columns(*LogEntryColumns)
     .if_not_exists()
     .primary_key("id")
 )
 
 # https://pypika.readthedocs.io/en/latest/2_tutorial.html#parametrized-queries
 
-CreateLogEntryQuery = Query.into(LogEntry).insert(
-    Parameter("id"),
-    Parameter("filename"),
-    Parameter("source"),
-    Parameter("destination"),
-    Parameter("extension"),
-    Parameter("worker"),
-    Parameter("protocol"),
-    Parameter("status"),
-    Parameter("size"),
-    Parameter("byte_size"),
-    Parameter("reason"),
-    Parameter("created"),
+# The values of a log are bound by sqlite: the filenames and the reasons of
+# the failures are free text, quotes included.
+CreateLogEntryQuery = (
+    Query.into(LogEntry)
+    .columns(*[c.name for c in LogEntryColumns])
+    .insert(*[NamedParameter(c.name) for c in LogEntryColumns])
 )
 
 
 ListLogEntriesQuery = Query.from_(LogEntry).select(
-    LogEntry.id,
-    LogEntry.filename,
-    LogEntry.source,
-    LogEntry.destination,
-    LogEntry.extension,
-    LogEntry.worker,
-    LogEntry.protocol,
-    LogEntry.status,
-    LogEntry.size,
-    LogEntry.byte_size,
-    LogEntry.reason,
-    LogEntry.created,
+    *[LogEntry.field(c.name) for c in LogEntryColumns]
 )
 
 RetrieveLogEntryQuery = (
     Query.from_(LogEntry)
-    .select(
-        LogEntry.id,
-        LogEntry.filename,
-        LogEntry.source,
-        LogEntry.destination,
-        LogEntry.extension,
-        LogEntry.worker,
-        LogEntry.protocol,
-        LogEntry.status,
-        LogEntry.size,
-        LogEntry.byte_size,
-        LogEntry.reason,
-        LogEntry.created,
-    )
+    .select(*[LogEntry.field(c.name) for c in LogEntryColumns])
     .where(LogEntry.id == Parameter("id"))
 )
 
+TableInfoQuery = f"PRAGMA table_info({LogEntry.get_table_name()})"
+
+
+def add_column_query(column: Column) -> str:
+    table = LogEntry.get_sql(quote_char='"')
+    definition = column.get_sql(quote_char='"')
+    return f"ALTER TABLE {table} ADD COLUMN {definition}"
+
+
 DeleteLogEntryQuery = (
     Query.from_(LogEntry).delete().where(LogEntry.id == Parameter("id"))
 )
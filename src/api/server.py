@@ -20,6 +20,7 @@
 # - By file name
 # - By used protocol
 from functools import cached_property, partial
+from typing import Any, Callable
 import asyncio
 
 import aiosqlite
@@ -27,6 +28,7 @@ import mode
 from aiohttp import web
 from aiohttp_pydantic import oas
 
+from src.profilers import SamplingProfiler
 from src.utils import PATH, BASE_DIR
 from .views import routes
 from .models import Dao
@@ -34,7 +36,7 @@ from .models import Dao
 __version__ = "0.1.0"
 
 
-def make_app(db: PATH):
+def make_app(db: PATH, stats: dict[str, Callable[[], Any]] | None = None):
     app = web.Application()
     app.add_routes(routes)
     # setup open api documentation as stated here (
@@ -46,15 +48,20 @@ def make_app(db: PATH):
         version_spec=__version__,
     )
     app["dao"] = Dao(connector=partial(aiosqlite.connect, db))
+    # name -> callable returning the JSON serializable statistics of a service.
+    app["stats"] = stats or {}
+    # Idle until a profile is requested, safe to leave in production.
+    app["profiler"] = SamplingProfiler()
     return app
 
 
 class WebServer(mode.Service):
-    def __init__(self, host, port, db, **kwargs):
+    def __init__(self, host, port, db, stats=None, **kwargs):
         super().__init__(**kwargs)
         self.host = host
         self.port = port
         self._db = db
+        self._stats = stats
 
     async def on_started(self) -> None:
         await self.runner.app["dao"].create_table()
@@ -69,9 +76,13 @@ class WebServer(mode.Service):
     async def _serve(self):
         await self.run_app()
 
+    @property
+    def dao(self) -> Dao:
+        return self.runner.app["dao"]
+
     @cached_property
     def runner(self):
-        app = make_app(self._db)
+        app = make_app(self._db, stats=self._stats)
         runner = web.AppRunner(app, logger=self.logger, access_log=self.logger)
         return runner
 
@@ -1,14 +1,27 @@
 import json
+import time
 from uuid import UUID
 from typing import List, Union, Any
 
 from pydantic import Field
 
 from aiohttp import web
-from aiohttp.web_exceptions import HTTPNotFound, HTTPNoContent
+from aiohttp.web_exceptions import (
+    HTTPBadRequest,
+    HTTPConflict,
+    HTTPNotFound,
+    HTTPNoContent,
+)
 from aiohttp_pydantic import PydanticView
 from aiohttp_pydantic.oas.typing import r200, r201, r204, r404
 
+from src.metrics import metrics_view
+from src.profilers import (
+    ProfilerBusyError,
+    dump_tasks,
+    format_collapsed,
+    loop_lag,
+)
 from src.schemas import ReadOnlyLogEntry, WriteOnlyLogEntry, QueryDict, Error
 from src.utils import move_dict_key_to_top, JSON_CONTENT_TYPE
 
@@ -58,3 +71,53 @@ class DetailView(BasicView):
         dao = self.request.app["dao"]
         await dao.delete(pk=id)
         raise HTTPNoContent(content_type=JSON_CONTENT_TYPE)
+
+
+@routes.get(r"/api/v1/stats/{name}", name="stats_detail")
+async def stats_detail(request: web.Request) -> web.Response:
+    """Runtime statistics registered by the services of the dispatcher."""
+    provider = request.app["stats"].get(request.match_info["name"])
+    if provider is None:
+        raise HTTPNotFound(content_type=JSON_CONTENT_TYPE)
+    return web.json_response(provider(), status=200, content_type=JSON_CONTENT_TYPE)
+
+
+@routes.get(r"/api/v1/admin/profile", name="admin_profile")
+async def admin_profile(request: web.Request) -> web.Response:
+    """
+    Sample the event loop for `seconds` (10 by default, 60 at most) and return
+    the stacks in the collapsed format of flamegraph.pl and speedscope.
+    """
+    try:
+        seconds = float(request.query.get("seconds", 10))
+    except ValueError:
+        raise HTTPBadRequest(text="seconds must be a number.")
+    if seconds <= 0:
+        raise HTTPBadRequest(text="seconds must be positive.")
+    try:
+        stacks = await request.app["profiler"].profile(seconds)
+    except ProfilerBusyError as exp:
+        raise HTTPConflict(text=str(exp))
+    filename = f"filedispatch-{int(time.time())}.folded"
+    return web.Response(
+        text=format_collapsed(stacks),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@routes.get(r"/api/v1/admin/tasks", name="admin_tasks")
+async def admin_tasks(request: web.Request) -> web.Response:
+    """The pending asyncio tasks, grouped by coroutine."""
+    return web.json_response(dump_tasks(), status=200, content_type=JSON_CONTENT_TYPE)
+
+
+@routes.get(r"/api/v1/admin/loop", name="admin_loop")
+async def admin_loop(request: web.Request) -> web.Response:
+    """How late the event loop runs its callbacks, in seconds."""
+    return web.json_response(
+        dict(lag=await loop_lag()), status=200, content_type=JSON_CONTENT_TYPE
+    )
+
+
+# Prometheus scrape endpoint.
+routes.get("/metrics", name="metrics")(metrics_view)
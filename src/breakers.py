@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+import mode
+
+from .utils import BreakerStateEnum, Message
+
+# Consecutive failed transfers opening the circuit of an endpoint.
+FAILURE_THRESHOLD = 5
+# Seconds an open circuit waits before probing the endpoint again.
+RESET_TIMEOUT = 30.0
+# Consecutive successful probes closing the circuit.
+SUCCESS_THRESHOLD = 2
+# Deferred files released per second once the circuit is closed again.
+TRICKLE = 5
+
+
+def endpoint_of(destination: str) -> str:
+    """The server of a destination, without the path nor the credentials."""
+    parts = urlsplit(str(destination))
+    if not parts.hostname:
+        return str(destination)
+    port = f":{parts.port}" if parts.port else ""
+    return f"{parts.scheme}://{parts.hostname}{port}"
+
+
+class CircuitBreaker:
+    """
+    Circuit of an endpoint: closed while the transfers succeed, open after
+    `failure_threshold` consecutive failures, nothing is sent then. After
+    `reset_timeout` seconds it is half-open, one transfer at a time probes the
+    endpoint, `success_threshold` successes close it and a failure opens it
+    again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+        success_threshold: int = SUCCESS_THRESHOLD,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.success_threshold = success_threshold
+        self.state = BreakerStateEnum.CLOSED
+        self.failures = 0
+        self.successes = 0
+        self.opened_at: float | None = None
+        # Key of the transfer probing the endpoint when half-open.
+        self.probe = None
+
+    def allow(self, key=True) -> bool:
+        """Whether a transfer (identified by `key`) can be sent now."""
+        if self.state == BreakerStateEnum.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = BreakerStateEnum.HALF_OPEN
+            self.successes = 0
+        if self.state == BreakerStateEnum.HALF_OPEN:
+            if self.probe is not None:
+                return False
+            self.probe = key
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state == BreakerStateEnum.HALF_OPEN:
+            self.probe = None
+            self.successes += 1
+            if self.successes >= self.success_threshold:
+                self.state = BreakerStateEnum.CLOSED
+                self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if (
+            self.state == BreakerStateEnum.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            self.state = BreakerStateEnum.OPEN
+            self.opened_at = time.monotonic()
+            self.probe = None
+
+    def done(self, key) -> None:
+        """The transfer ended without telling whether the endpoint is up."""
+        if self.probe == key:
+            self.probe = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether a deferred transfer would be let through."""
+        if self.state == BreakerStateEnum.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not (self.state == BreakerStateEnum.HALF_OPEN and self.probe is not None)
+
+
+class Breakers(mode.Service):
+    """
+    Circuit breakers of the endpoints the workers send the files to.
+
+    The files of an endpoint whose circuit is open are parked instead of
+    being sent (and failing after timeouts and retries). When the circuit is
+    half-open they are released one at a time as probes, then in a trickle of
+    `trickle` files per second once it is closed again, so the endpoint is
+    not flooded as soon as it is back.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+        success_threshold: int = SUCCESS_THRESHOLD,
+        trickle: int = TRICKLE,
+        **kwargs,
+    ):
+        self._options = dict(
+            failure_threshold=failure_threshold,
+            reset_timeout=reset_timeout,
+            success_threshold=success_threshold,
+        )
+        self.trickle = trickle
+        self._breakers: dict[str, CircuitBreaker] = {}
+        # (message, callback queuing it again) by endpoint.
+        self._deferred: dict[str, collections.deque] = collections.defaultdict(
+            collections.deque
+        )
+        super().__init__(**kwargs)
+
+    def get(self, destination: str) -> CircuitBreaker:
+        endpoint = endpoint_of(destination)
+        if endpoint not in self._breakers:
+            self._breakers[endpoint] = CircuitBreaker(**self._options)
+        return self._breakers[endpoint]
+
+    def allow(self, message: Message) -> bool:
+        """Whether the file can be sent now, it must be deferred otherwise."""
+        endpoint = endpoint_of(message.destination)
+        released, message.released = message.released, False
+        if released or endpoint not in self._breakers:
+            return True
+        # The files parked first go first, a new one waits behind them.
+        if self._deferred[endpoint] and self._breakers[endpoint].ready:
+            return False
+        return self._breakers[endpoint].allow(message.id)
+
+    def done(self, message: Message) -> None:
+        endpoint = endpoint_of(message.destination)
+        if endpoint in self._breakers:
+            self._breakers[endpoint].done(message.id)
+
+    def record_success(self, destination: str) -> None:
+        self.get(destination).record_success()
+
+    def record_failure(self, destination: str) -> None:
+        breaker = self.get(destination)
+        opened = breaker.state
+        breaker.record_failure()
+        if opened != BreakerStateEnum.OPEN and breaker.state == BreakerStateEnum.OPEN:
+            self.logger.warning(
+                f"{endpoint_of(destination)} is failing, its files are deferred "
+                f"for {breaker.reset_timeout}s."
+            )
+
+    def defer(self, message: Message, requeue: Callable[[Message], None]) -> None:
+        endpoint = endpoint_of(message.destination)
+        self._deferred[endpoint].append((message, requeue))
+
+    def deferred(self, destination: str) -> int:
+        return len(self._deferred.get(endpoint_of(destination), ()))
+
+    def release(self) -> int:
+        """Queue again the deferred files the circuits let through."""
+        released = 0
+        for endpoint, deferred in self._deferred.items():
+            breaker = self._breakers[endpoint]
+            count = self.trickle if breaker.state == BreakerStateEnum.CLOSED else 1
+            while deferred and count and breaker.allow(deferred[0][0].id):
+                message, requeue = deferred.popleft()
+                # The circuit let it through already.
+                message.released = True
+                requeue(message)
+                released += 1
+                count -= 1
+        return released
+
+    @mode.Service.task
+    async def _release(self):
+        while not self.should_stop:
+            self.release()
+            await asyncio.sleep(1.0)
+
+    def metrics(self) -> dict:
+        return {
+            endpoint: dict(
+                state=breaker.state.value,
+                failures=breaker.failures,
+                deferred=len(self._deferred.get(endpoint, ())),
+            )
+            for endpoint, breaker in self._breakers.items()
+        }
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import hashlib
+
+from .utils import PATH, ChecksumEnum
+
+CHUNK_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+HEAD_SIZE = 64 * 1024
+
+# Names of the algorithms for the FTP HASH command (draft-bryan-ftpext-hash).
+FTP_HASH_NAMES = {ChecksumEnum.sha256: "SHA-256"}
+
+
+def new_hasher(algorithm: str = ChecksumEnum.blake2b):
+    if algorithm == ChecksumEnum.xxhash:
+        import xxhash  # optional dependency, checked when the config is parsed.
+
+        return xxhash.xxh3_64()
+    return hashlib.new(ChecksumEnum(algorithm).value)
+
+
+def file_digest(
+    filename: PATH, algorithm: str = ChecksumEnum.blake2b, chunk_size: int = CHUNK_SIZE
+) -> str:
+    """Hash a file chunk by chunk, whatever its size the memory used is bounded."""
+    hasher = new_hasher(algorithm)
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def head_digest(filename: PATH, size: int = HEAD_SIZE) -> str:
+    """Cheap digest of the first bytes of a file."""
+    with open(filename, "rb") as f:
+        return hashlib.blake2b(f.read(size), digest_size=16).hexdigest()
+
+
+def copy_with_digest(
+    source: PATH, destination: PATH, algorithm: str, chunk_size: int = CHUNK_SIZE
+) -> str:
+    """Copy a file and hash the chunks read for the copy, the file is read once."""
+    hasher = new_hasher(algorithm)
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        while chunk := src.read(chunk_size):
+            hasher.update(chunk)
+            dst.write(chunk)
+    return hasher.hexdigest()
+
+
+async def iter_chunks(source, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Chunks of an opened (aiofiles) file, or of an async iterable of chunks."""
+    if hasattr(source, "read"):
+        while chunk := await source.read(chunk_size):
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+class HashingReader:
+    """
+    Async iterable over the chunks of an opened (aiofiles) file, or of
+    another reader, the chunks are hashed as they are read to be sent.
+    """
+
+    def __init__(self, file, algorithm: str, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._hasher = new_hasher(algorithm)
+
+    async def __aiter__(self):
+        async for chunk in iter_chunks(self.file, self.chunk_size):
+            self._hasher.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
@@ -5,6 +5,8 @@ It listens to a configured source folder for new files and copy or move them to
 
 from __future__ import annotations
 import argparse
+import asyncio
+import importlib.util
 import functools
 import os.path
 import logging
@@ -16,7 +18,7 @@ import socket as sock
 from datetime import datetime
 
 import pydantic
-from pydantic import HttpUrl, FilePath
+from pydantic import HttpUrl, FilePath, ByteSize
 from pydantic import (
     BaseModel,
     Field,
@@ -30,8 +32,8 @@ from daemons import daemonizer
 
 from . import __version__
 from .config import Config, parse_logger_config
-from .exchange import FileWatcher
-from .utils import BASE_DIR, isfile, has_permission
+from .utils import BASE_DIR, LoopEnum, isfile, has_permission, use_event_loop
+from .schedulers import DEFAULT_CONCURRENCY
 
 logger = logging.getLogger(__name__)
 
@@ -115,6 +117,61 @@ class Arguments(BaseModel):
         description="webapp host url",
         cli=("--server-url",),
     )
+    journal: pathlib.Path | None = Field(
+        None,
+        description="journal file path, to resume the unfinished transfers on restart",
+        cli=("--journal",),
+    )
+    dedup_index: pathlib.Path | None = Field(
+        None,
+        description="deduplication index file path, to skip the files whose content is already delivered",
+        cli=("--dedup-index",),
+    )
+    processes: int = Field(
+        0,
+        description="number of processes for the hashing and compression of the files (0 to use threads)",
+        cli=("--processes",),
+    )
+    workers: int = Field(
+        0,
+        description="number of processes sending the files, sharded by destination (0 to send them from the watcher process)",
+        cli=("--workers",),
+    )
+    concurrency: int = Field(
+        DEFAULT_CONCURRENCY,
+        description="number of files sent at the same time by each worker",
+        cli=("--concurrency",),
+    )
+    bandwidth: ByteSize | None = Field(
+        None,
+        description="maximum bytes per second sent by all the workers, e.g. 10MB",
+        cli=("--bandwidth",),
+    )
+    metrics_port: int | None = Field(
+        None,
+        description="port of the /metrics endpoint when the webapp is not launched (no endpoint if not set)",
+        cli=("--metrics-port",),
+    )
+    metrics_host: str = Field(
+        "127.0.0.1",
+        description="address of the /metrics endpoint when the webapp is not launched",
+        cli=("--metrics-host",),
+    )
+    trace_file: pathlib.Path | None = Field(
+        None,
+        description="file the spans of the transfers are written to (OTLP/JSON lines), no tracing if not set",
+        cli=("--trace-file",),
+    )
+    loop: LoopEnum = Field(
+        LoopEnum.asyncio,
+        description="event loop implementation, uvloop requires the uvloop package",
+        cli=("--loop",),
+    )
+    slow_callback: float = Field(
+        0.1,
+        description="seconds a callback can block the event loop before its stack is logged",
+        cli=("--slow-callback",),
+    )
     endpoint: pathlib.Path | None = Field(
         "api/v1/logs",
         description="webapp endpoint to post log to.",
@@ -142,6 +199,32 @@ class Arguments(BaseModel):
                 raise ValueError(f"The config file [{value}] is not readable.")
         return value
 
+    @validator("processes", "workers")
+    def validate_processes(cls, value):
+        if value < 0:
+            raise ValueError("The number of processes must be positive.")
+        return value
+
+    @validator("loop")
+    def validate_loop(cls, value):
+        if value == LoopEnum.uvloop and not importlib.util.find_spec("uvloop"):
+            raise ValueError(
+                "The uvloop package is required for the uvloop event loop."
+            )
+        return value
+
+    @validator("slow_callback")
+    def validate_slow_callback(cls, value):
+        if value <= 0:
+            raise ValueError("The slow callback threshold must be positive.")
+        return value
+
+    @validator("concurrency")
+    def validate_concurrency(cls, value):
+        if value < 1:
+            raise ValueError("The concurrency must be at least 1.")
+        return value
+
     @root_validator()
     def validate_arguments(cls, values):
         server_url = values.get("server_url")
@@ -171,6 +254,12 @@ class Arguments(BaseModel):
         if pid_file:
             cls._validate_file(pid_file)
 
+        if values.get("journal"):
+            cls._validate_file(values["journal"])
+
+        if values.get("dedup_index"):
+            cls._validate_file(values["dedup_index"])
+
         if pid_file and not values.get("log_file"):
             log_file = pid_file.parent / "filedipatch.log"
             cls._validate_file(log_file)
@@ -216,6 +305,19 @@ class Arguments(BaseModel):
 
 
 def run(args: Arguments):
+    if args.exit:
+        # Stopping the daemon only takes its pid file, nothing to build.
+        daemonizer.run(pidfile=str(args.pid_file))(sys.exit).stop()
+        sys.exit(0)
+
+    # Imported here, the dispatcher and its dependencies are the slowest part
+    # of the startup and --help, --version and --exit don't need them.
+    from .exchange import FileWatcher
+
+    # The services get their loop when they are built, the policy goes first.
+    use_event_loop(args.loop)
+    # and they get it with get_event_loop(), which uvloop doesn't create.
+    asyncio.set_event_loop(asyncio.new_event_loop())
     config = Config(args.config)()
 
     dispatcher = FileWatcher(
@@ -227,14 +329,21 @@ def run(args: Arguments):
         log_level=args.log_level.value,
         with_webapp=args.with_webapp,
         delete=args.move,
+        journal=args.journal,
+        dedup_index=args.dedup_index,
+        processes=args.processes,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        bandwidth=args.bandwidth,
+        metrics_host=args.metrics_host,
+        metrics_port=args.metrics_port,
+        trace_file=args.trace_file,
+        slow_callback=args.slow_callback,
+        event_loop=args.loop,
     )
 
-    if args.pid_file or args.exit:
-        demonic = daemonizer.run(pidfile=str(args.pid_file))(dispatcher.run)
-        if args.exit:
-            demonic.stop()
-            sys.exit(0)
-        demonic()
+    if args.pid_file:
+        daemonizer.run(pidfile=str(args.pid_file))(dispatcher.run)()
     else:
         dispatcher.run()
 
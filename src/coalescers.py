@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+from collections import Counter
+from typing import Awaitable, Callable, Iterable
+
+import mode
+from watchfiles import Change
+
+from .config import DEFAULT_IGNORE_PATTERNS
+from .metrics import WATCHER_EVENTS
+from .timers import TimerWheel
+
+ADDED, MODIFIED, DELETED = 1, 2, 4
+
+
+def compile_patterns(patterns: Iterable[str]) -> re.Pattern | None:
+    patterns = list(patterns)
+    if not patterns:
+        return
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+class Coalescer(mode.Service):
+    """
+    Merge the filesystem events of a path into a single final event.
+
+    The events of a path are accumulated until no new event was reported
+    for `window` seconds (a window of 0 only merges the events of a same
+    batch), then one event is passed on:
+
+    - `added` if the path has been added at least once, whatever happened
+      next. The consumer checks the file still exists, so a temporary file
+      added then deleted is dropped, and a file replaced by a rename is
+      dispatched once.
+    - `modified` if the path has only been modified.
+    - `deleted` if the path has only been deleted.
+
+    Paths matching one of the ignored patterns are dropped before anything.
+    """
+
+    def __init__(
+        self,
+        on_change: Callable[[Change, str], Awaitable],
+        *,
+        window: float = 0,
+        ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS,
+        tick: float | None = None,
+        **kwargs,
+    ):
+        self.window = window
+        self._on_change = on_change
+        self._ignored = compile_patterns(ignore_patterns)
+        self._wheel = TimerWheel(tick=tick or max(window / 10, 0.02))
+        self._pending: dict[str, int] = {}
+        self.stats = Counter(received=0, ignored=0, collapsed=0, emitted=0)
+        self._events = {
+            outcome: WATCHER_EVENTS.labels(outcome) for outcome in self.stats
+        }
+        super().__init__(**kwargs)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def is_ignored(self, filename: str) -> bool:
+        if self._ignored is None:
+            return False
+        return self._ignored.match(os.path.basename(filename)) is not None
+
+    async def feed(self, changes: Iterable[tuple[Change, str]]) -> None:
+        batch = []
+        for change, filename in changes:
+            self._count("received")
+
+            if self.is_ignored(filename):
+                self._count("ignored")
+                continue
+
+            if filename in self._pending:
+                self._count("collapsed")
+            else:
+                self._pending[filename] = 0
+                batch.append(filename)
+
+            self._pending[filename] |= self._flag(change)
+            if self.window:
+                # Every new event of the path restarts its window.
+                self._wheel.schedule(filename, self.window)
+
+        if not self.window:
+            await self._flush(batch)
+
+    @mode.Service.task
+    async def _tick(self):
+        while not self.should_stop:
+            await self.sleep(self._wheel.tick)
+            expired = self._wheel.advance()
+            if expired:
+                await self._flush([filename for filename, _ in expired])
+
+    async def _flush(self, filenames: list[str]) -> None:
+        for filename in filenames:
+            flags = self._pending.pop(filename, 0)
+            if flags & ADDED:
+                change = Change.added
+            elif flags & MODIFIED:
+                change = Change.modified
+            elif flags & DELETED:
+                change = Change.deleted
+            else:
+                continue
+            self._count("emitted")
+            await self._on_change(change, filename)
+
+    def _count(self, outcome: str) -> None:
+        self.stats[outcome] += 1
+        self._events[outcome].inc()
+
+    @staticmethod
+    def _flag(change: Change) -> int:
+        if change == Change.added:
+            return ADDED
+        if change == Change.modified:
+            return MODIFIED
+        return DELETED
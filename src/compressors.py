@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import os
+import zlib
+
+from .checksums import STREAM_CHUNK_SIZE, iter_chunks
+from .utils import CompressionEnum
+
+SUFFIXES = {CompressionEnum.gzip: ".gz", CompressionEnum.zstd: ".zst"}
+
+
+def new_compressor(algorithm: str, level: int | None = None):
+    """Streaming compressor, exposing `compress(chunk)` and `flush()`."""
+    if algorithm == CompressionEnum.zstd:
+        import zstandard  # optional dependency, checked when the config is parsed.
+
+        return zstandard.ZstdCompressor(level=level or 3).compressobj()
+    # wbits = 16 + MAX_WBITS writes a gzip container instead of a raw zlib one.
+    level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def get_compression(filename: str, folder) -> CompressionEnum | None:
+    """Compression of the file sent to the folder, None to send it as it is."""
+    compression = getattr(folder, "compression", None)
+    if not compression:
+        return
+    ext = os.path.splitext(filename)[-1].removeprefix(".").lower()
+    skipped = getattr(folder, "compressed_extensions", ())
+    if ext in {e.lower() for e in skipped}:
+        return
+    return compression
+
+
+class CompressingReader:
+    """
+    Async iterable over the compressed chunks of an opened (aiofiles) file,
+    or of another reader. Chunks are compressed as they are read, only the
+    compressor window and the current chunk are held in memory.
+    """
+
+    def __init__(
+        self,
+        file,
+        algorithm: str,
+        level: int | None = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ):
+        self.file = file
+        self.algorithm = CompressionEnum(algorithm)
+        self.chunk_size = chunk_size
+        self.size = 0  # bytes read
+        self.compressed_size = 0  # bytes produced
+        self._compressor = new_compressor(algorithm, level)
+
+    @property
+    def suffix(self) -> str:
+        return SUFFIXES[self.algorithm]
+
+    async def __aiter__(self):
+        async for chunk in iter_chunks(self.file, self.chunk_size):
+            self.size += len(chunk)
+            if compressed := self._compressor.compress(chunk):
+                self.compressed_size += len(compressed)
+                yield compressed
+        if compressed := self._compressor.flush():
+            self.compressed_size += len(compressed)
+            yield compressed
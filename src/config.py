@@ -1,28 +1,125 @@
+import importlib.util
 import logging
 import yaml
-from typing import List, Union
+from typing import List, Union, Optional
 from pathlib import Path
-from pydantic import BaseModel, BaseSettings, DirectoryPath, constr, HttpUrl
+from pydantic import (
+    BaseModel,
+    BaseSettings,
+    DirectoryPath,
+    constr,
+    confloat,
+    conint,
+    ByteSize,
+    HttpUrl,
+    root_validator,
+    validator,
+)
 from pydantic_yaml import YamlModelMixin
 from pydantic.error_wrappers import ValidationError
 
-from .utils import FtpUrl
+from .utils import FtpUrl, ChecksumEnum, CompressionEnum
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Files written by editors, browsers and download managers before being
+# renamed to their final name.
+DEFAULT_IGNORE_PATTERNS = ["*.part", "*.crdownload", "*.tmp", "*~", "*.swp", ".#*"]
+
+# Formats already compressed, compressing them again only burns CPU.
+COMPRESSED_EXTENSIONS = [
+    "mp4", "mkv", "webm", "avi", "mov", "flv", "wmv", "mp3", "ogg", "aac", "flac",
+    "jpg", "jpeg", "png", "gif", "webp", "zip", "gz", "tgz", "bz2", "xz", "zst",
+    "7z", "rar", "docx", "xlsx", "pptx", "odt", "epub", "pdf",
+]  # fmt: skip
+
 
 class FolderModel(BaseModel):
     path: Union[str, HttpUrl, FtpUrl, Path]
     # https://en.wikipedia.org/wiki/List_of_filename_extensions
     extensions: List[constr(max_length=10)]
+    # The files of the folders with the highest priority are sent first.
+    priority: int = 0
+    # Requests per second and bytes per second (e.g. "10MB") sent to the folder.
+    rate_limit: Optional[confloat(gt=0)] = None
+    bandwidth: Optional[ByteSize] = None
+    # Transfers of a file (the first one included) before it is given up.
+    max_attempts: conint(ge=1) = 3
+    # Digest computed over the bytes sent, logged with each transfer.
+    checksum: Optional[ChecksumEnum] = None
+    # Compare the digest with the one computed by the destination: the
+    # `checksum_header` response header for HTTP, the HASH command for FTP.
+    verify: bool = False
+    checksum_header: str = "X-Checksum"
+    # Compress the files sent to HTTP and FTP destinations on the fly, except
+    # the ones having one of the `compressed_extensions`.
+    compression: Optional[CompressionEnum] = None
+    compression_level: Optional[int] = None
+    compressed_extensions: List[constr(max_length=10)] = COMPRESSED_EXTENSIONS
 
+    @validator("checksum")
+    def validate_checksum(cls, value):
+        if value == ChecksumEnum.xxhash and not importlib.util.find_spec("xxhash"):
+            raise ValueError("The xxhash package is required for xxhash checksums.")
+        return value
 
-class Settings(YamlModelMixin, BaseSettings):
-    source: DirectoryPath
+    @validator("compression")
+    def validate_compression(cls, value):
+        if value == CompressionEnum.zstd and not importlib.util.find_spec("zstandard"):
+            raise ValueError("The zstandard package is required for zstd compression.")
+        return value
+
+
+class SourceModel(BaseModel):
+    path: DirectoryPath
     folders: List[FolderModel]
 
 
+class Settings(YamlModelMixin, BaseSettings):
+    # The single `source`/`folders` pair is kept for backward compatibility,
+    # it is folded into `sources` at validation time.
+    source: Optional[DirectoryPath] = None
+    folders: List[FolderModel] = []
+    sources: List[SourceModel] = []
+    # Seconds a new file must stay unchanged before being dispatched,
+    # 0 dispatches the files as soon as they are created.
+    quiet_period: confloat(ge=0) = 0
+    # Seconds during which the events of a same file are merged into one,
+    # 0 only merges the events reported together by the watcher.
+    coalesce_window: confloat(ge=0) = 0
+    # Glob patterns of the (temporary) files to never dispatch.
+    ignore_patterns: List[str] = DEFAULT_IGNORE_PATTERNS
+    # Seconds before the first retry of a failed transfer, doubled by attempt
+    # up to `max_retry_delay`.
+    retry_delay: confloat(gt=0) = 5
+    max_retry_delay: confloat(gt=0) = 300
+    # Directory the files given up are moved to, they stay in place if None.
+    dead_letter: Optional[Path] = None
+
+    @root_validator(skip_on_failure=True)
+    def validate_sources(cls, values):
+        source = values.get("source")
+        folders = values.get("folders")
+        sources = list(values.get("sources") or [])
+
+        if source and not folders:
+            raise ValueError("The folders are required along with the source.")
+
+        if source:
+            sources.insert(0, SourceModel(path=source, folders=folders))
+
+        if not sources:
+            raise ValueError("At least one source directory must be configured.")
+
+        paths = [s.path.resolve() for s in sources]
+        if len(set(paths)) != len(paths):
+            raise ValueError("A source directory can not be configured twice.")
+
+        values["sources"] = sources
+        return values
+
+
 class Config:
     def __init__(self, config: Union[str, Path]):
         self.config = config
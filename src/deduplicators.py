@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+
+import mode
+
+from .checksums import file_digest, head_digest
+from .utils import PATH, ChecksumEnum
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    destination TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    head TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (destination, size, head, digest)
+);
+"""
+
+
+class Deduplicator(mode.Service):
+    """
+    On-disk index of the content already delivered to each destination.
+
+    A file is looked up by increasing cost: its size first (kept in memory,
+    no I/O), then a digest of its first bytes, and only when both match a
+    delivered file is the whole file hashed. The delivered files are hashed
+    when they are recorded, the index holds the digest of the bytes sent
+    whatever happens to the file afterwards. Hashing streams the file chunk
+    by chunk in the I/O thread pool.
+    """
+
+    def __init__(self, path: PATH, *, stages=None, **kwargs):
+        self.path = path
+        # Process pool hashing the files, the thread pool if None.
+        self.stages = stages
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._sizes: set[tuple[str, int]] = set()
+        super().__init__(**kwargs)
+
+    async def on_start(self) -> None:
+        await self.open()
+        await super().on_start()
+
+    async def on_stop(self) -> None:
+        if self._connection is not None:
+            async with self._lock:
+                await asyncio.to_thread(self._connection.close)
+            self._connection = None
+        await super().on_stop()
+
+    async def open(self) -> None:
+        async with self._lock:
+            if self._connection is not None:
+                return
+            self._connection, sizes = await asyncio.to_thread(self._connect, self.path)
+            self._sizes = set(sizes)
+
+    @staticmethod
+    def _connect(path: PATH) -> tuple[sqlite3.Connection, list[tuple[str, int]]]:
+        # The connection is used from the worker threads, one at a time.
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        sizes = connection.execute("SELECT DISTINCT destination, size FROM deliveries")
+        return connection, sizes.fetchall()
+
+    async def _execute(self, query: str, args: tuple) -> list[tuple]:
+        def _execute():
+            with self._connection:
+                return self._connection.execute(query, args).fetchall()
+
+        async with self._lock:
+            return await asyncio.to_thread(_execute)
+
+    async def lookup(self, filename: PATH, destination: PATH) -> str | None:
+        """Return the name of a delivered file with the same content, if any."""
+        await self.open()
+        destination = str(destination)
+        try:
+            size = (await asyncio.to_thread(os.stat, filename)).st_size
+            if (destination, size) not in self._sizes:
+                return
+
+            head = await asyncio.to_thread(head_digest, filename)
+            rows = await self._execute(
+                "SELECT digest, filename FROM deliveries "
+                "WHERE destination = ? AND size = ? AND head = ?",
+                (destination, size, head),
+            )
+            if not rows:
+                return
+
+            digest = await self._digest(filename)
+        except OSError as exp:
+            self.logger.debug(exp)
+            return
+
+        for delivered_digest, delivered in rows:
+            if delivered_digest == digest:
+                return delivered
+
+    async def _digest(self, filename: PATH) -> str:
+        if self.stages is not None:
+            return await self.stages.digest(filename, ChecksumEnum.blake2b)
+        return await asyncio.to_thread(file_digest, filename)
+
+    async def record(
+        self, filename: PATH, destination: PATH, digest: str | None = None
+    ) -> None:
+        """Remember the content of a file delivered to the destination."""
+        await self.open()
+        destination = str(destination)
+        try:
+            size = (await asyncio.to_thread(os.stat, filename)).st_size
+            head = await asyncio.to_thread(head_digest, filename)
+            # Hashed now, the file may be changed, moved or removed later:
+            # by the producer, or right after the record with --move.
+            digest = digest or await self._digest(filename)
+        except OSError as exp:
+            self.logger.debug(exp)
+            return
+
+        await self._execute(
+            "INSERT OR REPLACE INTO deliveries "
+            "(destination, size, head, digest, filename) VALUES (?, ?, ?, ?, ?)",
+            (destination, size, head, digest, str(filename)),
+        )
+        self._sizes.add((destination, size))
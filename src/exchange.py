@@ -1,7 +1,12 @@
+from __future__ import annotations
+
 import os
+import asyncio
 import logging
 import functools
-from pathlib import Path
+import itertools
+import time
+from typing import TYPE_CHECKING, Callable
 from asyncio import Queue
 
 import mode
@@ -9,16 +14,40 @@ import pydantic
 from watchfiles import awatch, Change
 import aiofiles
 
-from src.api.server import WebServer
+from .schedulers import DEFAULT_CONCURRENCY, MAX_PENDING
 from .workers import FileWorker, FtpWorker, HttpWorker
-from .notifiers import Notifier
-from .utils import PATH, Message, create_message
-from .routers import Router, DefaultRouter
-from .config import Settings
+from .stabilizers import Stabilizer
+from .coalescers import Coalescer
+from .journals import Journal
+from .deduplicators import Deduplicator
+from .stages import StageRunner
+from .limiters import RateLimits
+from .breakers import Breakers
+from .retries import RetryScheduler
+from .tracing import FileSpanExporter
+from .monitors import LoopMonitor, SLOW_CALLBACK
+from .metrics import MetricsServer, QUEUE_DEPTH, ROUTING_SECONDS
+from .utils import PATH, LoopEnum, Message, create_message
+from .routers import Router, DefaultRouter, ShardedRouter
+from .shards import ShardPool
+from .config import Settings, FolderModel
+
+if TYPE_CHECKING:
+    from .notifiers import Notifier
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+SCAN_BATCH_SIZE = 1000
+
+# Milliseconds the watcher groups the file system events for.
+WATCH_DEBOUNCE = 1600
+
+
+def lookup_folder(basename: str, mapping: dict[str, FolderModel]) -> FolderModel | None:
+    _, ext = os.path.splitext(basename)
+    return mapping.get(ext.lower().removeprefix("."))
+
 
 class BaseWatcher(mode.Service):
     def __init_subclass__(cls, **kwargs):
@@ -47,132 +76,464 @@ class FileWatcher(BaseWatcher):
         with_webapp: bool = False,
         delete: bool = False,
         db: str = None,
+        max_pending: int = MAX_PENDING,
+        journal: PATH = None,
+        dedup_index: PATH = None,
+        processes: int = 0,
+        workers: int = 0,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        bandwidth: int | None = None,
+        metrics_host: str = "127.0.0.1",
+        metrics_port: int | None = None,
+        trace_file: PATH = None,
+        slow_callback: float = SLOW_CALLBACK,
+        event_loop: LoopEnum = LoopEnum.asyncio,
         **kwargs,
     ):
         self._config = config
+        self._routes = self._build_routes(config)
         self._server_url = server_url
         self._endpoint = endpoint
         self._with_webapp = with_webapp
         self._log_file = log_file
         self._log_level = log_level
-        self.unprocessed: Queue[Message] = Queue()
+        self.unprocessed: Queue[Message] = Queue(maxsize=max_pending)
+        self._max_pending = max_pending
+        self._seen: set[str] | None = None
+        self._stabilizer: Stabilizer | None = None
+        self._journal_path = journal
+        self._journal: Journal | None = None
+        self._dedup_index = dedup_index
+        self._dedup: Deduplicator | None = None
+        self._processes = processes
+        self._stages: StageRunner | None = None
+        self._workers = workers
+        self._concurrency = concurrency
+        self._bandwidth = bandwidth
+        self._metrics_host = metrics_host
+        self._metrics_port = metrics_port
+        self._trace_file = trace_file
+        self._slow_callback = slow_callback
+        # The shard processes create their loop with the same policy.
+        self._event_loop = event_loop
+        self._loop_monitor: LoopMonitor | None = None
+        self._tracer: FileSpanExporter | None = None
+        self._limits: RateLimits | None = None
+        self._breakers: Breakers | None = None
+        self._retries: RetryScheduler | None = None
+        self._shards: ShardPool | None = None
+        self._notifier: Notifier | None = None
         self._router = router or DefaultRouter(workers=self.PROCESSORS_REGISTRY)
         self._delete = delete
         self._db = db
         super().__init__(**kwargs)
 
     def __post_init__(self) -> None:
-        self._init_workers()
+        self._loop_monitor = LoopMonitor(threshold=self._slow_callback, loop=self.loop)
+        self.add_dependency(self._loop_monitor)
+        if self._journal_path:
+            self._journal = Journal(self._journal_path, loop=self.loop)
+            self.add_dependency(self._journal)
+        if self._trace_file:
+            self._tracer = FileSpanExporter(self._trace_file, loop=self.loop)
+            self.add_dependency(self._tracer)
+        if self._server_url:
+            self._init_notifier()
+        if self._workers:
+            # The shards have their own process pool and deduplicator.
+            self._init_shards()
+        else:
+            if self._processes:
+                self._stages = StageRunner(self._processes, loop=self.loop)
+                self.add_dependency(self._stages)
+            if self._dedup_index:
+                self._dedup = Deduplicator(
+                    self._dedup_index, stages=self._stages, loop=self.loop
+                )
+                self.add_dependency(self._dedup)
+            self._breakers = Breakers(loop=self.loop)
+            self.add_dependency(self._breakers)
+            self._retries = RetryScheduler(**self._retry_options, loop=self.loop)
+            self.add_dependency(self._retries)
+            self._init_workers()
+        self._coalescer = Coalescer(
+            self._on_change,
+            window=self._config.coalesce_window,
+            ignore_patterns=self._config.ignore_patterns,
+            loop=self.loop,
+        )
+        self.add_dependency(self._coalescer)
+        if self._config.quiet_period:
+            self._stabilizer = Stabilizer(
+                self._config.quiet_period, self._on_stable, loop=self.loop
+            )
+            self.add_dependency(self._stabilizer)
         if self._with_webapp:
+            # The webapp serves the metrics too.
             self.add_dependency(self.server)
             self.logger.info("The webapp is launched.")
+        elif self._metrics_port:
+            self.add_dependency(
+                MetricsServer(self._metrics_host, self._metrics_port, loop=self.loop)
+            )
+        self._init_metrics()
 
     def on_init_dependencies(self):
         dependencies = super().on_init_dependencies()
-        dependencies += self.PROCESSORS_REGISTRY.values()
+        if self._shards is None:
+            dependencies += self.PROCESSORS_REGISTRY.values()
         return dependencies
 
+    def _init_notifier(self) -> Notifier:
+        from .notifiers import Notifier
+
+        if self._with_webapp:
+            # Inserted by the webapp of the process, no HTTP round trip.
+            self._notifier = Notifier(
+                dao=self.server.dao,
+                journal=self._journal,
+                tracer=self._tracer,
+                loop=self.loop,
+            )
+        else:
+            url = f"{self._server_url.removesuffix('/')}/{self._endpoint}"
+            self._notifier = Notifier(
+                url, journal=self._journal, tracer=self._tracer, loop=self.loop
+            )
+        # A single one for all the workers, the shards send theirs to it too.
+        self.add_dependency(self._notifier)
+        return self._notifier
+
+    def _init_shards(self) -> ShardPool:
+        # The workers run in the shard processes, the messages are sent there.
+        self._shards = ShardPool(
+            self._workers,
+            journal=self._journal,
+            notifier=self._notifier,
+            delete=self._delete,
+            dedup_index=self._dedup_index,
+            processes=self._processes,
+            concurrency=self._concurrency,
+            bandwidth=self._bandwidth,
+            retries=self._retry_options,
+            tracer=self._tracer,
+            folders=[f for source in self._config.sources for f in source.folders],
+            event_loop=self._event_loop,
+            loop=self.loop,
+        )
+        self._router = ShardedRouter(self._shards)
+        self.add_dependency(self._shards)
+        return self._shards
+
     def _init_workers(self) -> list[mode.ServiceT]:
+        # The limits are shared by all the workers (for the global bandwidth).
+        self._limits = RateLimits(bandwidth=self._bandwidth)
         workers = []
         for p in self.PROCESSORS_REGISTRY.values():
-            if self._server_url:
-                # FIXME: Isn't better to share the Notifier between all workers ?
-                url = f"{self._server_url.removesuffix('/')}/{self._endpoint}"
-                p.notifier = Notifier(loop=self.loop, url=url)
+            p.notifier = self._notifier
             # Share the same event loop between all dependencies to prevent weired errors.
             p.loop = self.loop
             p._delete = self._delete
+            p.journal = self._journal
+            p.dedup = self._dedup
+            p.stages = self._stages
+            p.concurrency = self._concurrency
+            # The routing waits for a worker that is behind.
+            p.unprocessed.maxsize = self._max_pending
+            p.limits = self._limits
+            p.breakers = self._breakers
+            p.retries = self._retries
+            p.tracer = self._tracer
             workers.append(p)
 
         return workers
 
+    def _init_metrics(self) -> None:
+        # The queue sizes are sampled when the metrics are scraped.
+        QUEUE_DEPTH.labels("watcher").set_function(self.unprocessed.qsize)
+        for name, p in self.PROCESSORS_REGISTRY.items():
+            if self._shards is None:
+                QUEUE_DEPTH.labels(name).set_function(p.unprocessed.qsize)
+            else:
+                # Idle here, the workers run in the shard processes.
+                QUEUE_DEPTH.remove(name)
+        QUEUE_DEPTH.labels("notifier").set_function(self._notifications_depth)
+
+    def _notifications_depth(self) -> int:
+        if self._notifier is None:
+            return 0
+        return self._notifier.unprocessed.qsize()
+
     async def on_started(self) -> None:
         if self._with_webapp:
             await self.server.maybe_start()
-        await self._collect_unprocessed(config=self._config)
+        # The backlog is fed to the queue while the watcher and the workers
+        # are already running, so the first files are dispatched right away.
+        self.add_future(self._collect_unprocessed(config=self._config))
         await super().on_started()
 
     async def _collect_unprocessed(self, config=None):
         config = config or self._config
-        supported = {e: f.path for f in config.folders for e in f.extensions}
-        collected = []
-        for ext in supported:
-            # glob doesn't support multiple extension globing
-            for filename in Path(self._config.source).glob(f"*.{ext}"):
-                destination = self._search_destination(filename, config, supported)
+        routes = self._get_routes(config)
+        # Files created while scanning are reported by both the scan and the
+        # watcher, remember what is enqueued until the watcher caught up.
+        self._seen = seen = set()
+        try:
+            if self._journal is not None:
+                await self._resume()
+            for source in config.sources:
+                directory = os.path.abspath(source.path)
+                await self._collect_directory(directory, routes[directory])
+        finally:
+            self.loop.call_later(self._catch_up_delay(config), self._forget, seen)
+
+    def _forget(self, seen: set[str]) -> None:
+        if self._seen is seen:
+            self._seen = None
+
+    @staticmethod
+    def _catch_up_delay(config: Settings) -> float:
+        """
+        Seconds the event of a file may take to reach _enqueue: debounced by
+        the watcher, merged by the coalescer and held by the stabilizer. Twice
+        that, for the ticks of their timers and a busy loop.
+        """
+        delay = WATCH_DEBOUNCE / 1000 + config.coalesce_window
+        return 2 * (delay + config.quiet_period)
+
+    async def _resume(self):
+        """Enqueue again the work left unfinished by the previous run."""
+        messages, notifications = await self._journal.load()
+
+        for filename, destination in messages:
+            # The configuration may have changed since.
+            folder = self._search_folder(filename)
+            if folder is None or str(folder.path) != destination:
+                continue
+            if not await aiofiles.os.path.isfile(filename):
+                continue
+            await self._enqueue(filename, folder)
+
+        for journal_id, payload in notifications:
+            if self._notifier is None:
+                break
+            self._notifier.acquire(payload, journal_id=journal_id)
 
-                if not destination or filename in collected:
-                    continue
+        self.logger.info(
+            f"{len(messages)} transfers and {len(notifications)} notifications resumed."
+        )
+
+    async def _collect_directory(self, directory: str, mapping: dict[str, FolderModel]):
+        count = 0
+        quiet_period = self._stabilizer and self._stabilizer.quiet_period
+        delivered = self._journal and self._journal.is_delivered
+        with os.scandir(directory) as entries:
+            done = False
+            while not done and not self.should_stop:
+                # A single directory listing per source, read batch by batch
+                # off the event loop.
+                found, done = await asyncio.to_thread(
+                    self._scan,
+                    entries,
+                    mapping,
+                    with_mtime=bool(quiet_period),
+                    delivered=delivered,
+                )
+                now = time.time()
+                for filename, folder, mtime in found:
+                    if mtime is not None and now - mtime < quiet_period:
+                        # The file may still be written by its producer.
+                        self._stabilizer.observe(filename, folder)
+                        continue
+                    count += await self._enqueue(filename, folder)
+        self.logger.debug(f"{count} files of {directory} are appended to be processed")
+
+    @staticmethod
+    def _scan(
+        entries,
+        mapping: dict[str, FolderModel],
+        size: int = SCAN_BATCH_SIZE,
+        with_mtime: bool = False,
+        delivered: Callable[[os.DirEntry, PATH], bool] | None = None,
+    ) -> tuple[list[tuple[str, FolderModel, float | None]], bool]:
+        found = []
+        read = 0
+        for entry in itertools.islice(entries, size):
+            read += 1
+            folder = lookup_folder(entry.name, mapping)
+            if folder is None:
+                continue
+            # Ignore directories and symlinks, the entry type is cached
+            # by scandir so it doesn't cost an extra system call.
+            if entry.is_symlink() or not entry.is_file():
+                continue
+            # Skip what was already delivered by a previous run.
+            if delivered is not None and delivered(entry, folder.path):
+                continue
+            mtime = entry.stat().st_mtime if with_mtime else None
+            found.append((entry.path, folder, mtime))
+        return found, read < size
 
-                collected.append(filename)
-                msg = self.create_message(filename, destination)
-                await self.unprocessed.put(msg)
-                self.logger.debug(f"File {filename} is appended to be processed")
+    async def _enqueue(self, filename: str, folder: FolderModel) -> bool:
+        # The journal and the scan know a file by its absolute path, whatever
+        # reported it (a scan, the watcher or the journal itself).
+        filename = os.path.abspath(filename)
+        if self._seen is not None:
+            if filename in self._seen:
+                return False
+            self._seen.add(filename)
+        msg = self.create_message(filename, folder)
+        if self._journal is not None:
+            self._journal.enqueued(msg)
+        # The queue is bounded, a full queue slows down the producers.
+        await self.unprocessed.put(msg)
+        return True
 
     @functools.cached_property
     def server(self):
+        # The webapp, and the API stack with it, is imported when it is launched.
+        from src.api.server import WebServer
+
         url = pydantic.parse_obj_as(pydantic.HttpUrl, self._server_url)
         return WebServer(
             loop=self.loop,
             host=url.host,
             port=int(url.port),
             db=self._db,
+            stats=self.stats,
+        )
+
+    @property
+    def stats(self) -> dict[str, Callable[[], dict]]:
+        """Statistics exposed by the webapp under /api/v1/stats/<name>."""
+        return dict(
+            scheduler=self._scheduler_stats,
+            watcher=self._watcher_stats,
+            breakers=self._breakers_stats,
+            retries=self._retries_stats,
+            loop=self._loop_monitor.metrics,
+        )
+
+    def _scheduler_stats(self) -> dict:
+        if self._shards is not None:
+            return {}
+        return {
+            name: p.unprocessed.metrics()
+            for name, p in self.PROCESSORS_REGISTRY.items()
+        }
+
+    def _watcher_stats(self) -> dict:
+        """The events of the watcher, by what the coalescer did with them."""
+        return dict(self._coalescer.stats)
+
+    def _breakers_stats(self) -> dict:
+        return self._breakers.metrics() if self._breakers is not None else {}
+
+    def _retries_stats(self) -> dict:
+        return self._retries.metrics() if self._retries is not None else {}
+
+    @property
+    def _retry_options(self) -> dict:
+        return dict(
+            base=self._config.retry_delay,
+            cap=self._config.max_retry_delay,
+            dead_letter=self._config.dead_letter,
         )
 
     @mode.Service.task
     async def _watch(self, config=None):
         config = config or self._config
-        async for changes in awatch(config.source):
-            for change in changes:
-                # consider only adds, ignore all other changes.
-                if Change.added not in change:
-                    continue
+        # A single watcher is shared between all the sources.
+        paths = [s.path for s in config.sources]
+        async for changes in awatch(*paths, debounce=WATCH_DEBOUNCE):
+            await self._coalescer.feed(changes)
 
-                filename = change[1]
-                # Ignore files added in the source subdirectories since watchfiles do recursive watch
-                # An issue is opened to fix that here https://github.com/samuelcolvin/watchfiles/issues/178
-                if os.path.basename(os.path.dirname(filename)) != os.path.basename(
-                    config.source
-                ):
-                    continue
+    async def _on_change(self, change: Change, filename: str) -> None:
+        # Keyed as the scanned files, the events may report relative paths.
+        filename = os.path.abspath(filename)
+        if self._stabilizer is not None and change == Change.modified:
+            self._stabilizer.touch(filename)
+            return
 
-                # Ignore directories and symlinks
-                if not await aiofiles.os.path.isfile(filename):
-                    continue
+        if self._stabilizer is not None and change == Change.deleted:
+            self._stabilizer.discard(filename)
+            return
 
-                destination = self._search_destination(filename, config=config)
+        # consider only adds, ignore all other changes.
+        if change != Change.added:
+            return
 
-                if not destination:
-                    continue
+        # Ignore files added in the source subdirectories since watchfiles do recursive watch
+        # An issue is opened to fix that here https://github.com/samuelcolvin/watchfiles/issues/178
+        if os.path.dirname(filename) not in self._routes:
+            return
 
-                msg = self.create_message(filename, destination)
-                await self.unprocessed.put(msg)
-                self.logger.info(f"The file {filename} is received.")
+        # Ignore directories and symlinks
+        if not await aiofiles.os.path.isfile(filename):
+            return
+
+        folder = self._search_folder(filename)
+
+        if not folder:
+            return
+
+        if self._stabilizer is not None:
+            # Wait for the producer to finish writing the file.
+            self._stabilizer.observe(filename, folder)
+            return
+
+        if await self._enqueue(filename, folder):
+            self.logger.info(f"The file {filename} is received.")
+
+    async def _on_stable(self, filename: str, folder: FolderModel) -> None:
+        if await self._enqueue(filename, folder):
+            self.logger.info(f"The file {filename} is received.")
 
     @mode.Service.task
     async def _provide(self):
+        routing_time = ROUTING_SECONDS.time()
         while not self.should_stop:
             message = await self.unprocessed.get()
-            await self._router.route(message)
+            with routing_time:
+                await self._router.route(message)
             self.unprocessed.task_done()
-            await self.sleep(1.0)
 
     @staticmethod
-    def create_message(filename, destination):
-        return create_message(filename, destination)
+    def create_message(filename, folder: FolderModel):
+        # The folder travels with the message for the per-destination options.
+        msg = create_message(filename, folder.path, folder=folder)
+        msg.mark("detected")
+        return msg
 
-    def _search_destination(self, filename: PATH, config=None, mapping=None) -> PATH:
-        mapping = mapping or {}
-        config = config or self._config
-        _, ext = os.path.splitext(filename)
-        ext = ext.lower().removeprefix(".")
+    def _get_routes(self, config=None) -> dict[str, dict[str, FolderModel]]:
+        if config is None or config is self._config:
+            return self._routes
+        return self._build_routes(config)
 
-        if path := mapping.get(ext):
-            return path
+    @staticmethod
+    def _build_routes(config: Settings) -> dict[str, dict[str, FolderModel]]:
+        """
+        Index the destinations by source directory and by extension, so that
+        finding the destination of a file is a couple of dict lookups whatever
+        the number of configured sources and folders.
+        """
+        routes = {}
+        for source in config.sources:
+            mapping = {}
+            for folder in source.folders:
+                for ext in folder.extensions:
+                    # The first folder declaring an extension wins.
+                    mapping.setdefault(ext.lower(), folder)
+            # Events may be reported with the path as configured or with the
+            # real path of the directory, so register both.
+            routes[os.path.abspath(source.path)] = mapping
+            routes[os.path.realpath(source.path)] = mapping
+        return routes
 
-        for folder in config.folders:
-            if ext in folder.extensions:
-                return folder.path
+    def _search_folder(self, filename: PATH, routes=None) -> FolderModel | None:
+        routes = routes or self._routes
+        directory, basename = os.path.split(os.path.abspath(filename))
+        return lookup_folder(basename, routes.get(directory, {}))
 
     def run(self):
         log_level = getattr(logging, self._log_level or "", logging.INFO)
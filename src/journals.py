@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+import mode
+
+from .utils import PATH, Message, StatusEnum
+
+ENQUEUED = "enqueued"
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    filename TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    state TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (filename, destination)
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL
+);
+"""
+
+UPSERT_STATE = """
+INSERT INTO messages (filename, destination, state, updated) VALUES (?, ?, ?, ?)
+ON CONFLICT (filename, destination) DO UPDATE SET state = excluded.state, updated = excluded.updated
+"""
+
+UPSERT_COMPLETED = """
+INSERT INTO messages (filename, destination, state, size, mtime, updated) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (filename, destination) DO UPDATE SET
+    state = excluded.state, size = excluded.size, mtime = excluded.mtime, updated = excluded.updated
+"""
+
+
+def message_key(message: Message) -> tuple[str, str]:
+    return str(message.filename), str(message.destination)
+
+
+class Journal(mode.Service):
+    """
+    Durable journal of the dispatched messages and of the pending notifications.
+
+    Recording a transition only appends it to an in-memory buffer, the buffer
+    is written to the SQLite database by a background task in a single
+    transaction (hence a single fsync) every `flush_interval` seconds, or as
+    soon as it holds `flush_size` records. On restart the journal tells what
+    was not delivered yet, and what was already delivered and did not change
+    since.
+    """
+
+    def __init__(
+        self,
+        path: PATH,
+        *,
+        flush_interval: float = 0.5,
+        flush_size: int = 1000,
+        **kwargs,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._connection: sqlite3.Connection | None = None
+        self._buffer: list[tuple] = []
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._ids = itertools.count()
+        # (filename, destination) -> (size, mtime) of the delivered files.
+        self.completed: dict[tuple[str, str], tuple[int, float]] = {}
+        super().__init__(**kwargs)
+
+    async def on_start(self) -> None:
+        await self.open()
+        await super().on_start()
+
+    async def on_stop(self) -> None:
+        await self.flush()
+        if self._connection is not None:
+            await asyncio.to_thread(self._connection.close)
+            self._connection = None
+        await super().on_stop()
+
+    async def open(self) -> None:
+        if self._connection is not None:
+            return
+        self._connection = await asyncio.to_thread(self._connect, self.path)
+        last = self._connection.execute("SELECT MAX(id) FROM notifications").fetchone()
+        self._ids = itertools.count((last[0] or 0) + 1)
+
+    @staticmethod
+    def _connect(path: PATH) -> sqlite3.Connection:
+        # The connection is used from the worker threads, one at a time.
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _record(self, *operation) -> None:
+        self._buffer.append(operation)
+        if len(self._buffer) >= self.flush_size:
+            self._full.set()
+
+    def enqueued(self, message: Message) -> None:
+        self._record(UPSERT_STATE, *message_key(message), ENQUEUED)
+
+    def in_flight(self, message: Message) -> None:
+        self._record(UPSERT_STATE, *message_key(message), IN_FLIGHT)
+
+    def finished(self, message: Message, status: StatusEnum, removed=False) -> None:
+        key = message_key(message)
+        if status == StatusEnum.FAILED:
+            self._record(UPSERT_STATE, *key, FAILED)
+        elif removed:
+            # Nothing left to resume or to skip once the file is moved.
+            self._record("DELETE", *key)
+        else:
+            self._record(UPSERT_COMPLETED, *key, COMPLETED)
+
+    def notification(self, payload: dict) -> int:
+        id_ = next(self._ids)
+        self._record("NOTIFICATION", id_, json.dumps(payload))
+        return id_
+
+    def notified(self, id_: int) -> None:
+        self._record("NOTIFIED", id_)
+
+    @mode.Service.task
+    async def _flush_periodically(self):
+        while not self.should_stop:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._full.clear()
+            if not self._buffer or self._connection is None:
+                return
+            buffer, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, self._connection, buffer)
+
+    @staticmethod
+    def _write(connection: sqlite3.Connection, buffer: list[tuple]) -> None:
+        now = time.time()
+        with connection:  # a single transaction for the whole buffer.
+            for query, *args in buffer:
+                if query == "NOTIFICATION":
+                    connection.execute(
+                        "INSERT OR REPLACE INTO notifications (id, payload) VALUES (?, ?)",
+                        args,
+                    )
+                elif query == "NOTIFIED":
+                    connection.execute("DELETE FROM notifications WHERE id = ?", args)
+                elif query == "DELETE":
+                    connection.execute(
+                        "DELETE FROM messages WHERE filename = ? AND destination = ?",
+                        args,
+                    )
+                elif query == UPSERT_COMPLETED:
+                    try:
+                        st = os.stat(args[0])
+                        stat = (st.st_size, st.st_mtime)
+                    except OSError:
+                        stat = (None, None)
+                    connection.execute(query, (*args, *stat, now))
+                else:
+                    connection.execute(query, (*args, now))
+
+    async def load(self) -> tuple[list[tuple[str, str]], list[tuple[int, dict]]]:
+        """
+        Return the messages and the notifications left unfinished by the
+        previous run, and cache what was already delivered.
+        """
+        await self.open()
+        await self.flush()
+        messages, notifications, completed = await asyncio.to_thread(
+            self._read, self._connection
+        )
+        self.completed = completed
+        return messages, notifications
+
+    @staticmethod
+    def _read(connection: sqlite3.Connection):
+        messages, completed = [], {}
+        rows = connection.execute(
+            "SELECT filename, destination, state, size, mtime FROM messages"
+        )
+        for filename, destination, state, size, mtime in rows:
+            if state == COMPLETED:
+                completed[filename, destination] = (size, mtime)
+            else:
+                messages.append((filename, destination))
+
+        notifications = [
+            (id_, json.loads(payload))
+            for id_, payload in connection.execute(
+                "SELECT id, payload FROM notifications ORDER BY id"
+            )
+        ]
+        return messages, notifications, completed
+
+    def is_delivered(self, entry: os.DirEntry, destination: PATH) -> bool:
+        """Whether the file was delivered to the destination and did not change since."""
+        delivered = self.completed.get((entry.path, str(destination)))
+        if delivered is None:
+            return False
+        stat = entry.stat()
+        return delivered == (stat.st_size, stat.st_mtime)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import time
+from datetime import datetime, timezone
+
+from .checksums import STREAM_CHUNK_SIZE, iter_chunks
+
+# Seconds a destination is paused when it throttles without Retry-After.
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delay-seconds or HTTP-date)."""
+    if not value:
+        return
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with `rate` tokens per second, up to `capacity`
+    (one second worth of tokens by default), or unlimited if `rate` is None.
+
+    Taking more tokens than available puts the bucket in debt, the caller
+    waits until the debt is paid back, so the long-term rate is respected
+    whatever the size of the requests (e.g. the chunks of a file).
+    """
+
+    def __init__(self, rate: float | None, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity or 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def delay(self, tokens: float = 1) -> float:
+        """Take the tokens, return the seconds to wait before using them."""
+        now = time.monotonic()
+        debt = 0.0
+        if self.rate:
+            self._refill(now)
+            self._tokens -= tokens
+            debt = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(debt, self._paused_until - now)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        delay = self.delay(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Nothing is taken before `seconds` (e.g. after a Retry-After)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def paused(self) -> float:
+        """Seconds left before the end of the pause, 0 if not paused."""
+        return max(self._paused_until - time.monotonic(), 0.0)
+
+
+class Limits:
+    """The buckets a transfer to a destination goes through."""
+
+    def __init__(self, requests: TokenBucket, buckets: list[TokenBucket]):
+        self.requests = requests
+        self.buckets = buckets  # bytes per second
+
+    @property
+    def throttled(self) -> bool:
+        return bool(self.buckets)
+
+    def reserve(self) -> float:
+        """Take a request token, return the seconds to wait before sending."""
+        return self.requests.delay()
+
+    def pause(self, seconds: float) -> None:
+        self.requests.pause(seconds)
+
+    def paused(self) -> float:
+        return self.requests.paused()
+
+    def reader(self, source, chunk_size: int = STREAM_CHUNK_SIZE):
+        return ThrottledReader(source, self.buckets, chunk_size)
+
+
+class RateLimits:
+    """
+    Rate limits of the transfers, by destination: requests per second
+    (`rate_limit`) and bytes per second (`bandwidth`) from the folder
+    configuration, and a global bandwidth shared by all the destinations.
+    """
+
+    def __init__(self, bandwidth: float | None = None):
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self._requests: dict[str, TokenBucket] = {}
+        self._bandwidths: dict[str, TokenBucket] = {}
+
+    def get(self, destination: str, folder=None) -> Limits:
+        destination = str(destination)
+        rate_limit = getattr(folder, "rate_limit", None)
+        bandwidth = getattr(folder, "bandwidth", None)
+
+        if destination not in self._requests:
+            # An unlimited bucket still tracks the Retry-After pauses.
+            self._requests[destination] = TokenBucket(rate_limit)
+        if bandwidth and destination not in self._bandwidths:
+            self._bandwidths[destination] = TokenBucket(bandwidth)
+
+        buckets = [self._bandwidths.get(destination), self.bandwidth]
+        return Limits(self._requests[destination], [b for b in buckets if b])
+
+
+class ThrottledReader:
+    """
+    Async iterable over the chunks of an opened (aiofiles) file, or of
+    another reader, no faster than the buckets allow.
+    """
+
+    def __init__(
+        self, file, buckets: list[TokenBucket], chunk_size: int = STREAM_CHUNK_SIZE
+    ):
+        self.file = file
+        self.buckets = buckets
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        async for chunk in iter_chunks(self.file, self.chunk_size):
+            for bucket in self.buckets:
+                await bucket.acquire(len(chunk))
+            yield chunk
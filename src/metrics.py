@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import bisect
+import math
+import time
+from functools import cached_property
+from typing import TYPE_CHECKING, Callable, Iterable
+from urllib.parse import urlsplit, urlunsplit
+
+import mode
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (in seconds) of the latency histograms buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def destination_label(destination) -> str:
+    """The destination without its credentials, they must not be exposed."""
+    parts = urlsplit(str(destination))
+    if not parts.password and not parts.username:
+        return str(destination)
+    netloc = parts.hostname + (f":{parts.port}" if parts.port else "")
+    return urlunsplit(parts._replace(netloc=netloc))
+
+
+class Metric:
+    """
+    Base of the metrics, a family of children by label values.
+
+    The children are plain objects updated in place: the dispatcher runs on a
+    single event loop, so no lock is needed and updating a metric is an
+    attribute increment. The hot paths keep a reference to their child
+    instead of looking it up by labels every time.
+    """
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects the labels {self.labelnames}.")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values) -> None:
+        """Drop the child of the label values, if any."""
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def __getattr__(self, name):
+        # The metrics without labels act as their single child.
+        if name.startswith("_") or self.labelnames:
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        """(name suffix, labels, value) of the samples of the metric."""
+        for values, child in list(self._children.items()):
+            labels = format_labels(self.labelnames, values)
+            yield "", labels, child.get()
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Sample the value at scrape time (e.g. a queue size), nothing to update."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: tuple):
+        self.upper_bounds = upper_bounds
+        # preallocated, an observation increments a single slot.
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (math.inf,), child.counts):
+                cumulative += count
+                le = format_labels(
+                    self.labelnames + ("le",), values + (format_value(bound),)
+                )
+                yield "_bucket", le, cumulative
+            labels = format_labels(self.labelnames, values)
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"The metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def expose(self) -> str:
+        """The metrics in the Prometheus text format."""
+        return "\n".join(m.expose() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# The metrics of the dispatcher.
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "filedispatch_queue_depth", "Messages waiting in a queue.", ("queue",)
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "filedispatch_transfers_in_flight", "Transfers in progress.", ("protocol",)
+)
+TRANSFERS = REGISTRY.counter(
+    "filedispatch_transfers_total",
+    "Transfers done with, by status.",
+    ("protocol", "status"),
+)
+TRANSFER_SECONDS = REGISTRY.histogram(
+    "filedispatch_transfer_duration_seconds",
+    "Duration of the transfers.",
+    ("protocol", "destination"),
+)
+TRANSFERRED_BYTES = REGISTRY.counter(
+    "filedispatch_transferred_bytes_total",
+    "Size of the files sent.",
+    ("protocol", "destination"),
+)
+WATCHER_EVENTS = REGISTRY.counter(
+    "filedispatch_watcher_events_total",
+    "File system events, by what the coalescer did with them.",
+    ("outcome",),
+)
+ROUTING_SECONDS = REGISTRY.histogram(
+    "filedispatch_routing_duration_seconds",
+    "Time to hand a message to its worker.",
+)
+NOTIFICATION_LAG = REGISTRY.histogram(
+    "filedispatch_notification_lag_seconds",
+    "Time from the end of a transfer to its log reaching the webapp.",
+)
+DB_INSERT_SECONDS = REGISTRY.histogram(
+    "filedispatch_db_insert_duration_seconds",
+    "Duration of the insertion of a log entry, or of a batch of them, in SQLite.",
+)
+LOOP_LAG = REGISTRY.histogram(
+    "filedispatch_event_loop_lag_seconds",
+    "Delay of the event loop in running a timer.",
+)
+SLOW_CALLBACKS = REGISTRY.counter(
+    "filedispatch_slow_callbacks_total",
+    "Callbacks blocking the event loop longer than the threshold.",
+)
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    from aiohttp import web
+
+    registry = request.app.get("metrics", REGISTRY)
+    return web.Response(
+        body=registry.expose().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+class MetricsServer(mode.Service):
+    """Serve /metrics alone, when the webapp is not launched."""
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY, **kwargs):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        super().__init__(**kwargs)
+
+    @cached_property
+    def runner(self) -> web.AppRunner:
+        from aiohttp import web
+
+        app = web.Application()
+        app["metrics"] = self.registry
+        app.router.add_get("/metrics", metrics_view)
+        return web.AppRunner(app, access_log=None)
+
+    async def on_start(self) -> None:
+        from aiohttp import web
+
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.logger.info(f"Metrics served on http://{self.host}:{self.port}/metrics")
+
+    async def on_stop(self) -> None:
+        await self.runner.cleanup()
+        await super().on_stop()
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import mode
+
+from .metrics import LOOP_LAG, SLOW_CALLBACKS
+
+# Seconds between two samples of the event loop lag.
+SAMPLE_INTERVAL = 0.1
+# A callback running longer than this (in seconds) blocks the loop.
+SLOW_CALLBACK = 0.1
+
+
+class LoopMonitor(mode.Service):
+    """
+    Watch the event loop shared by the watcher, the workers and the webapp.
+
+    A task sleeps `interval` seconds again and again, how late it wakes up
+    is the lag of the loop, observed in a histogram. A watchdog thread checks
+    that it woke up in time: when the loop is blocked for more than
+    `threshold` seconds, the stack of the loop thread, i.e. the callback
+    blocking it, is logged while it still runs.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval: float = SAMPLE_INTERVAL,
+        threshold: float = SLOW_CALLBACK,
+        **kwargs,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.slow_callbacks = 0
+        # time.monotonic() the sampling task is expected to wake up at.
+        self._deadline = time.monotonic() + interval
+        self._stalled = False
+        self._thread_id: int | None = None
+        self._running_loop: asyncio.AbstractEventLoop | None = None
+        self._watchdog: threading.Thread | None = None
+        self._halted = threading.Event()
+        super().__init__(**kwargs)
+
+    async def on_start(self) -> None:
+        await super().on_start()
+        self._thread_id = threading.get_ident()
+        self._running_loop = asyncio.get_running_loop()
+        self._deadline = time.monotonic() + self.interval
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def on_stop(self) -> None:
+        self._halted.set()
+        await super().on_stop()
+
+    @mode.Service.task
+    async def _sample(self):
+        while not self.should_stop:
+            self._deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, time.monotonic() - self._deadline))
+
+    def observe(self, lag: float) -> None:
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        LOOP_LAG.observe(lag)
+        if self._stalled:
+            self._stalled = False
+            self.logger.warning(f"The event loop was blocked for {lag:.3f}s.")
+
+    def _watch(self) -> None:
+        while not self._halted.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._deadline
+            if blocked > self.threshold and not self._stalled:
+                # Reported once per stall, the sampling task ends it.
+                self._stalled = True
+                self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        self.slow_callbacks += 1
+        SLOW_CALLBACKS.inc()
+        frame = sys._current_frames().get(self._thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        task = asyncio.current_task(self._running_loop)
+        self.logger.warning(
+            f"The event loop is blocked for {blocked:.3f}s "
+            f"by {task.get_coro() if task is not None else 'a callback'}:\n{stack}"
+        )
+
+    def metrics(self) -> dict:
+        return dict(
+            lag=round(self.lag, 6),
+            max_lag=round(self.max_lag, 6),
+            slow_callbacks=self.slow_callbacks,
+        )
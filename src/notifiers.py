@@ -1,52 +1,186 @@
 # Sender Notification to the API
 
 # This must be a service, notify method put payload in a queue, and a background task send informations to the API.
+from __future__ import annotations
+
 import asyncio
+import collections
 import json
-from asyncio import Queue
+import sqlite3
+import time
 
 import mode
 from aiohttp import ClientError
 from aiohttp_retry import RetryClient
 
+from .metrics import NOTIFICATION_LAG
+
+# Most notifications sent at once, posted together or inserted in a single
+# transaction.
+BATCH_SIZE = 100
+
+
+class FairQueue:
+    """
+    Notifications waiting to be sent, taken from each worker in turn: a
+    worker logging many small files doesn't hold back the logs of the others.
+    """
+
+    def __init__(self):
+        # (payload, journal id, monotonic time it was acquired at, message)
+        # by worker, the workers having some in the order they are served.
+        self._lanes: dict[str, collections.deque[tuple]] = {}
+        self._turns: collections.deque[str] = collections.deque()
+        self._not_empty = asyncio.Event()
+
+    def qsize(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def empty(self) -> bool:
+        return not self._turns
+
+    def put_nowait(self, item: tuple) -> None:
+        key = item[0].get("worker") or ""
+        lane = self._lanes.setdefault(key, collections.deque())
+        if not lane:
+            self._turns.append(key)
+        lane.append(item)
+        self._not_empty.set()
+
+    async def get_batch(self, size: int = BATCH_SIZE) -> list[tuple]:
+        """Wait for a notification, and take up to `size` of them."""
+        while self.empty():
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        batch = []
+        while self._turns and len(batch) < size:
+            key = self._turns.popleft()
+            lane = self._lanes[key]
+            batch.append(lane.popleft())
+            if lane:
+                self._turns.append(key)
+        return batch
+
 
 class Notifier(mode.Service):
+    """
+    The notifier shared by all the workers: the logs of the transfers are
+    queued, and sent in batches to the webapp.
+
+    They are posted to `url` through a single session, or inserted with the
+    `dao` of the webapp when it runs in the same process.
+    """
+
     def __init__(
         self,
-        url,
+        url=None,
         *args,
+        dao=None,
+        journal=None,
+        tracer=None,
+        batch_size: int = BATCH_SIZE,
         **kwargs,
     ):
         self.url = url
-        self.unprocessed: Queue[dict] = Queue()
+        self.dao = dao
+        self.journal = journal
+        self.tracer = tracer
+        self.batch_size = batch_size
+        self.unprocessed = FairQueue()
+        self._client: RetryClient | None = None
         super().__init__(*args, **kwargs)
 
-    def acquire(self, payload, **kwargs):
-        asyncio.create_task(self.unprocessed.put(payload))
+    @property
+    def client(self) -> RetryClient:
+        if self._client is None:
+            self._client = RetryClient()
+        return self._client
+
+    async def on_stop(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        await super().on_stop()
+
+    def acquire(self, payload, journal_id=None, message=None, **kwargs):
+        # Pending notifications are journaled so that they survive a restart.
+        if self.journal is not None and journal_id is None:
+            journal_id = self.journal.notification(payload)
+        self.unprocessed.put_nowait((payload, journal_id, time.monotonic(), message))
 
     @mode.Service.task
-    async def _notify(self, **kwargs):
+    async def _notify(self):
         while not self.should_stop:
-            payload = await self.unprocessed.get()
-            asyncio.create_task(self.notify(payload, **kwargs))
-            await self.sleep(1.0)
+            batch = await self.unprocessed.get_batch(self.batch_size)
+            await self.notify_batch(batch)
 
-    async def notify(self, payload, **kwargs):
-        async with RetryClient() as client:
-            try:
-                await self._handle_notification(client, payload)
-            except ClientError as exp:
-                self.logger.error(exp)
-                self.logger.debug(exp, stack_info=True)
-                return
+    async def notify(
+        self, payload, journal_id=None, acquired=None, message=None, **kwargs
+    ):
+        await self.notify_batch([(payload, journal_id, acquired, message)])
+
+    async def notify_batch(self, batch: list[tuple]) -> None:
+        for payload, _, _, message in batch:
+            if message is not None:
+                # The log leaves the dispatcher, the time it waited is logged too.
+                message.mark("notified")
+                payload["notify_time"] = message.durations().get("notify_time")
+                if self.tracer is not None:
+                    self.tracer.export_notification(message, payload.get("attempt"))
+
+        payloads = [payload for payload, *_ in batch]
+        if self.dao is not None:
+            delivered = await self._insert(payloads)
+        else:
+            delivered = await asyncio.gather(*map(self._post, payloads))
+
+        for (_, journal_id, acquired, _), ok in zip(batch, delivered):
+            if ok and acquired is not None:
+                NOTIFICATION_LAG.observe(time.monotonic() - acquired)
+            if ok and self.journal is not None and journal_id is not None:
+                self.journal.notified(journal_id)
+
+    async def _post(self, payload) -> bool:
+        try:
+            return await self._handle_notification(self.client, payload)
+        except (ClientError, asyncio.TimeoutError) as exp:
+            self.logger.error(exp)
+            self.logger.debug(exp, stack_info=True)
+            return False
+        except Exception as exp:
+            # The notifier is shared, a log that can't be sent must not stop
+            # the others: it stays journaled and is sent again on restart.
+            self.logger.exception(f"Log of {payload.get('filename')} not sent: {exp!r}")
+            return False
 
     async def _handle_notification(self, client, payload):
         async with client.post(self.url, json=payload) as response:
             self.logger.debug(f"\n{json.dumps(payload, indent=2)}")
             if not response.ok:
                 await self._handle_failure(response)
+            return response.ok
 
     async def _handle_failure(self, response):
         reason = await response.text()
         reason = f"{response.status} {response.reason}\n\n{reason}"
         self.logger.debug(reason)
+
+    async def _insert(self, payloads: list[dict]) -> list[bool]:
+        # Validated as the API does, the logs don't go through it.
+        from pydantic import ValidationError
+        from src.schemas import WriteOnlyLogEntry
+
+        entries, delivered = [], []
+        for payload in payloads:
+            try:
+                entries.append(WriteOnlyLogEntry.parse_obj(payload))
+                delivered.append(True)
+            except ValidationError as exp:
+                self.logger.error(f"Invalid log entry {payload}: {exp}")
+                delivered.append(False)
+        try:
+            await self.dao.insert_many(entries)
+        except sqlite3.Error as exp:
+            self.logger.error(f"{len(entries)} log entries not inserted: {exp!r}")
+            return [False] * len(payloads)
+        return delivered
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+
+# Longest profile, the request waits for it.
+MAX_DURATION = 60.0
+# Seconds between two samples of the stack (200 Hz).
+SAMPLE_INTERVAL = 0.005
+
+
+class ProfilerBusyError(RuntimeError):
+    """A profile is already running, a single one at a time."""
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse(frame) -> str:
+    """The stack of a frame, root first, in the collapsed (folded) format."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def format_collapsed(stacks: collections.Counter) -> str:
+    """One `frame;frame;frame count` line per stack, as flamegraph.pl reads."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of the event loop thread from another thread, for a
+    while, so production can be profiled without restarting it.
+
+    Nothing runs between the profiles, and a single profile runs at a time:
+    the profiler is left enabled at no cost. While it runs, the sampling
+    thread only reads the current frame of the loop thread, the loop itself
+    is not slowed down by a tracing hook.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, duration: float) -> collections.Counter:
+        """Sample the thread of the running loop for `duration` seconds."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running.")
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        stop = threading.Event()
+
+        def sample(thread_id):
+            try:
+                stacks = self._sample(thread_id, min(duration, MAX_DURATION), stop)
+            finally:
+                # Released first, the next profile may be asked right away.
+                self._lock.release()
+            loop.call_soon_threadsafe(_set_result, done, stacks)
+
+        threading.Thread(
+            target=sample, args=(threading.get_ident(),), daemon=True
+        ).start()
+        try:
+            return await done
+        finally:
+            # The client may be gone, the sampling stops with the request.
+            stop.set()
+
+    def _sample(self, thread_id: int, duration: float, stop: threading.Event):
+        stacks = collections.Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline and not stop.is_set():
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[collapse(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+
+def _set_result(future: asyncio.Future, result) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def dump_tasks() -> list[dict]:
+    """The pending tasks of the running loop, grouped by coroutine."""
+    groups: dict[str, dict] = {}
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        group = groups.setdefault(
+            name, dict(coroutine=name, count=0, awaiting=collections.Counter())
+        )
+        group["count"] += 1
+        # The innermost frame is where the task is suspended.
+        stack = task.get_stack()
+        if stack:
+            group["awaiting"][frame_label(stack[-1])] += 1
+    return [
+        dict(group, awaiting=dict(group["awaiting"].most_common()))
+        for group in sorted(groups.values(), key=lambda g: -g["count"])
+    ]
+
+
+async def loop_lag(samples: int = 10, interval: float = 0.01) -> dict:
+    """How late the loop runs timers, sampled for `samples * interval` seconds."""
+    loop = asyncio.get_running_loop()
+    lags = []
+    for _ in range(samples):
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - start - interval))
+    return dict(
+        samples=samples,
+        mean=round(sum(lags) / samples, 6),
+        max=round(max(lags), 6),
+    )
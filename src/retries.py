@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import shutil
+from pathlib import Path
+from typing import Callable
+
+import mode
+
+from .timers import TimerWheel
+from .utils import PATH, Message
+
+# Transfers of a file before it is given up, unless its folder sets it.
+MAX_ATTEMPTS = 3
+# Delay (in seconds) before the first retry, doubled by attempt up to MAX_DELAY.
+BASE_DELAY = 5.0
+MAX_DELAY = 300.0
+
+
+def backoff(attempt: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """
+    Seconds to wait before the retry following the `attempt`-th transfer:
+    exponential, with a random half so the retries of the files failed
+    together are spread instead of hitting the destination at once.
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def dead_letter_path(filename: PATH, directory: PATH, message: Message) -> Path:
+    target = Path(directory) / os.path.basename(filename)
+    if target.exists():
+        # Same name failed from another source directory.
+        # The prefix of the process and the count of the message in it.
+        suffix = message.hex[:4] + message.hex[-4:]
+        target = target.with_name(f"{target.stem}-{suffix}{target.suffix}")
+    return target
+
+
+class RetryScheduler(mode.Service):
+    """
+    Delay queue of the failed transfers.
+
+    A failed message is queued again to its worker after an exponential
+    backoff, until its folder `max_attempts` is reached. The file is then
+    moved to the `dead_letter` directory, if any, so it is not dispatched
+    again on restart. The pending retries are timers of a timer wheel, cheap
+    to schedule whatever their number, driven by a single task.
+    """
+
+    def __init__(
+        self,
+        *,
+        base: float = BASE_DELAY,
+        cap: float = MAX_DELAY,
+        dead_letter: PATH = None,
+        tick: float = 0.5,
+        **kwargs,
+    ):
+        self.base = base
+        self.cap = cap
+        self.dead_letter = dead_letter
+        self._wheel = TimerWheel(tick=tick)
+        self.buried = 0
+        super().__init__(**kwargs)
+
+    def __len__(self) -> int:
+        return len(self._wheel)
+
+    def retry(self, message: Message, requeue: Callable[[Message], None]) -> bool:
+        """Schedule the next attempt, return False when there is none left."""
+        folder = message.folder
+        max_attempts = getattr(folder, "max_attempts", MAX_ATTEMPTS)
+        attempt = message.attempt
+        if attempt >= max_attempts:
+            return False
+        message.attempt = attempt + 1
+        delay = backoff(attempt, self.base, self.cap)
+        self._wheel.schedule(message.id, delay, (message, requeue))
+        self.logger.info(
+            f"File {message.filename} sent again in {delay:.1f}s "
+            f"(attempt {attempt + 1}/{max_attempts})."
+        )
+        return True
+
+    async def bury(self, message: Message) -> Path | None:
+        """Move the file of a message given up to the dead letter directory."""
+        if self.dead_letter is None:
+            return
+        filename = message.filename
+        try:
+            target = await asyncio.to_thread(self._move, filename, message)
+        except OSError as exp:
+            self.logger.warning(f"File {filename} not moved to the dead letters: {exp}")
+            return
+        self.buried += 1
+        self.logger.warning(f"File {filename} given up, moved to {target}.")
+        return target
+
+    def _move(self, filename: PATH, message: Message) -> Path:
+        os.makedirs(self.dead_letter, exist_ok=True)
+        target = dead_letter_path(filename, self.dead_letter, message)
+        shutil.move(filename, target)
+        return target
+
+    @mode.Service.task
+    async def _tick(self):
+        while not self.should_stop:
+            await self.sleep(self._wheel.tick)
+            for _, (message, requeue) in self._wheel.advance():
+                requeue(message)
+
+    def metrics(self) -> dict:
+        return dict(pending=len(self), dead_letters=self.buried)
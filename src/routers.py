@@ -1,10 +1,14 @@
 from __future__ import annotations
 import logging
+from typing import TYPE_CHECKING
 
 
 from .utils import Message, get_protocol
 from .workers import BaseWorker
 
+if TYPE_CHECKING:
+    from .shards import ShardPool
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,16 +21,39 @@ class Router:
 
 
 class DefaultRouter(Router):
+    def __init__(self, workers: dict[str, BaseWorker] | None = None):
+        super().__init__(workers)
+        # Protocol of the destinations already routed, a few configured ones.
+        self._protocols: dict[str, str] = {}
+
     async def route(self, msg: Message):
         worker = self._get_worker(msg)
         if not worker:
             return
         await worker.maybe_start()
-        worker.acquire(msg)
+        msg.mark("routed")
+        # Waits while the worker is behind, the watcher queue fills up then.
+        await worker.put(msg)
 
     def _get_worker(self, msg: Message) -> BaseWorker | None:
-        destination = msg.body.get("destination")
+        destination = msg.destination
         if not destination:
             return
-        key = get_protocol(destination)
+        key = self._protocols.get(destination)
+        if key is None:
+            key = self._protocols[destination] = get_protocol(destination)
         return self._workers.get(key)
+
+
+class ShardedRouter(Router):
+    """Hand the messages to the shard process of their destination."""
+
+    def __init__(self, pool: ShardPool):
+        super().__init__()
+        self._pool = pool
+
+    async def route(self, msg: Message):
+        if not msg.destination:
+            return
+        msg.mark("routed")
+        await self._pool.send(msg)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import collections
+import heapq
+import itertools
+import math
+import time
+
+import aiofiles.os as aiofiles_os
+
+from .utils import Message
+
+MiB = 1024 * 1024
+
+# Number of files sent at the same time by a worker.
+DEFAULT_CONCURRENCY = 8
+
+# Number of new messages queued, by the watcher and by each worker, before
+# the one putting more waits.
+MAX_PENDING = 10_000
+
+# Upper bound (in bytes) of the size class of each lane.
+SIZE_LANES = (1 * MiB, 64 * MiB, math.inf)
+LANE_NAMES = ("small", "medium", "large")
+
+# Seconds of waiting worth one lane (or one priority level).
+AGING = 10.0
+
+# Number of wait times kept by lane for the percentiles.
+WAIT_SAMPLES = 1000
+
+
+def percentile(values, q: float) -> float | None:
+    if not values:
+        return
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LaneScheduler:
+    """
+    Queue of the messages of a worker, served by size class and priority
+    instead of in arrival order.
+
+    The messages are put in a lane according to the size of their file (small
+    files first, as in shortest-job-first). Each lane and each priority level
+    is worth `aging` seconds of waiting: within a lane the messages are
+    ordered by deadline (queued at, minus `aging` seconds by priority level),
+    and the next message is the best head of the lanes. A file waiting long
+    enough overtakes the bigger or more urgent ones, so nothing starves.
+
+    It has the same interface as the `asyncio.Queue` it replaces: `put`
+    waits while `maxsize` messages are queued (0 for no bound), so the
+    watcher routing the files is slowed down to the pace of the worker.
+    """
+
+    def __init__(
+        self,
+        lanes=SIZE_LANES,
+        *,
+        names=LANE_NAMES,
+        aging: float = AGING,
+        maxsize: int = 0,
+    ):
+        self.maxsize = maxsize
+        self.lanes = list(lanes)
+        self.names = list(names)
+        self.aging = aging
+        # (deadline, sequence, enqueued at, message) by lane.
+        self._heaps: list[list[tuple]] = [[] for _ in self.lanes]
+        self._sequence = itertools.count()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._waits = [collections.deque(maxlen=WAIT_SAMPLES) for _ in self.lanes]
+        self._served = [0 for _ in self.lanes]
+
+    def qsize(self) -> int:
+        return sum(len(heap) for heap in self._heaps)
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.qsize()
+
+    def lane_of(self, size: int) -> int:
+        return bisect.bisect_left(self.lanes, size)
+
+    async def put(self, message: Message, wait: bool = True) -> None:
+        """
+        Queue a message, waiting for room unless `wait` is False: the
+        messages queued again (retries, throttled) were already let in.
+        """
+        while wait and self.full():
+            self._not_full.clear()
+            await self._not_full.wait()
+        size = message.size
+        if size is None:
+            try:
+                size = (await aiofiles_os.stat(message.filename)).st_size
+            except (OSError, TypeError, ValueError):
+                size = 0
+            # Kept for the next queues (retries) and the metrics.
+            message.size = size
+        self.put_nowait(message, size=size)
+
+    def put_nowait(self, message: Message, size: int = 0) -> None:
+        folder = message.folder
+        priority = getattr(folder, "priority", 0) or 0
+        lane = self.lane_of(size)
+        now = time.monotonic()
+        # Ordered the same way whenever it's compared, the wait of all the
+        # queued messages grows at the same pace.
+        deadline = now - priority * self.aging
+        entry = (deadline, next(self._sequence), now, message)
+        heapq.heappush(self._heaps[lane], entry)
+        self._not_empty.set()
+
+    async def get(self) -> Message:
+        while self.empty():
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._pop()
+
+    def get_nowait(self) -> Message:
+        if self.empty():
+            raise asyncio.QueueEmpty
+        return self._pop()
+
+    def _pop(self) -> Message:
+        now = time.monotonic()
+        best, best_score = None, math.inf
+        for lane, heap in enumerate(self._heaps):
+            if not heap:
+                continue
+            deadline = heap[0][0]
+            score = lane + (deadline - now) / self.aging
+            if score < best_score:
+                best, best_score = lane, score
+
+        _, _, enqueued, message = heapq.heappop(self._heaps[best])
+        self._not_full.set()
+        self._waits[best].append(now - enqueued)
+        self._served[best] += 1
+        return message
+
+    def metrics(self) -> dict:
+        """Depth and wait times (in seconds) by lane."""
+        return {
+            name: dict(
+                depth=len(heap),
+                served=served,
+                wait_p50=percentile(waits, 0.5),
+                wait_p99=percentile(waits, 0.99),
+                wait_max=max(waits, default=None),
+            )
+            for name, heap, served, waits in zip(
+                self.names, self._heaps, self._served, self._waits
+            )
+        }
@@ -4,7 +4,7 @@ from pathlib import Path
 from typing import Optional, Any, Union
 from uuid import UUID
 
-from pydantic import BaseModel, Field, constr, HttpUrl
+from pydantic import BaseModel, Field, constr, conint, HttpUrl
 from aiohttp_pydantic.injectors import Group
 
 from src.utils import ProtocolEnum, StatusEnum, OrderingEnum, FtpUrl
@@ -23,6 +23,15 @@ class WriteOnlyLogEntry(BaseModel):
     )
     byte_size: Optional[Decimal] = None
     reason: Optional[str] = None
+    checksum: Optional[constr(max_length=128)] = None
+    # Number of the transfer attempt, 1 for the first one.
+    attempt: Optional[conint(ge=1)] = None
+    # Seconds spent in the watcher queue (and routing), in the worker queue,
+    # transferring the file and before the log is sent.
+    queue_time: Optional[float] = None
+    wait_time: Optional[float] = None
+    transfer_time: Optional[float] = None
+    notify_time: Optional[float] = None
 
 
 class ReadOnlyLogEntry(WriteOnlyLogEntry):
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import multiprocessing
+import queue
+import signal
+import zlib
+from collections import Counter
+
+import mode
+
+from .breakers import Breakers
+from .deduplicators import Deduplicator
+from .retries import RetryScheduler
+from .monitors import LoopMonitor
+from .routers import DefaultRouter
+from .limiters import RateLimits
+from .stages import StageRunner
+from .utils import PATH, LoopEnum, Message, StatusEnum, use_event_loop
+from .schedulers import DEFAULT_CONCURRENCY, MAX_PENDING
+from .workers import FileWorker, FtpWorker, HttpWorker
+
+# The events sent back by the shards to the supervisor.
+IN_FLIGHT = "in_flight"
+FINISHED = "finished"
+NOTIFICATION = "notification"
+
+# Seconds a shard is given to drain its workers on stop before being killed.
+STOP_TIMEOUT = 10.0
+
+
+def shard_of(destination: str, shards: int) -> int:
+    # crc32 is stable across processes and runs, unlike hash().
+    return zlib.crc32(str(destination).encode()) % shards
+
+
+class FolderTable:
+    """
+    The folders of the configuration, handed once to each shard: a message
+    crosses the process boundary with the number of its folder instead of a
+    copy of it, and shares the folder of the process it lands in.
+    """
+
+    def __init__(self, folders=()):
+        self.folders = list(folders)
+        self._numbers = {id(folder): number for number, folder in enumerate(folders)}
+
+    def __reduce__(self):
+        # The numbers are by object identity, rebuilt in each process.
+        return FolderTable, (self.folders,)
+
+    def pack(self, message: Message) -> Message:
+        number = self._numbers.get(id(message.folder))
+        if number is None:
+            # Not in the table (e.g. from a reloaded configuration), sent along.
+            return message
+        return dataclasses.replace(message, folder=number)
+
+    def unpack(self, message: Message) -> Message:
+        if isinstance(message.folder, int):
+            message.folder = self.folders[message.folder]
+        return message
+
+
+class ShardOutbox(mode.Service):
+    """
+    Stand-in for the journal and the notifier in a shard: what the workers
+    record is sent back to the supervisor, which owns the real ones.
+    """
+
+    def __init__(
+        self,
+        outbox: multiprocessing.Queue,
+        *,
+        notify: bool = True,
+        folders: FolderTable | None = None,
+        **kwargs,
+    ):
+        self.outbox = outbox
+        self.notify = notify
+        self.folders = folders or FolderTable()
+        # number of messages done with, the workers journal every one of them
+        # once (the retried attempts stay in flight).
+        self.done = 0
+        super().__init__(**kwargs)
+
+    def in_flight(self, message: Message) -> None:
+        self.outbox.put((IN_FLIGHT, self.folders.pack(message)))
+
+    def finished(self, message: Message, status: StatusEnum, removed=False) -> None:
+        self.done += 1
+        self.outbox.put((FINISHED, self.folders.pack(message), status, removed))
+
+    def acquire(self, payload: dict, message: Message | None = None, **kwargs) -> None:
+        if self.notify:
+            if message is not None:
+                message = self.folders.pack(message)
+            self.outbox.put((NOTIFICATION, payload, message))
+
+
+class Shard(mode.Service):
+    """
+    The worker set of a child process: it receives the messages of its
+    destinations from the supervisor and has its own connection pools.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        inbox: multiprocessing.Queue,
+        outbox: multiprocessing.Queue,
+        *,
+        delete: bool = False,
+        notify: bool = True,
+        dedup_index: PATH = None,
+        processes: int = 0,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        bandwidth: float | None = None,
+        retries: dict | None = None,
+        folders: FolderTable | None = None,
+        **kwargs,
+    ):
+        self.index = index
+        self._folders = folders or FolderTable()
+        self._retry_options = retries or {}
+        self._concurrency = concurrency
+        self._bandwidth = bandwidth
+        self.inbox = inbox
+        self._outbox = outbox
+        self._delete = delete
+        self._notify = notify
+        self._dedup_index = dedup_index
+        self._processes = processes
+        self.workers = dict(file=FileWorker(), ftp=FtpWorker(), http=HttpWorker())
+        self._router = DefaultRouter(workers=self.workers)
+        self._received = 0
+        self.drained = asyncio.Event()
+        super().__init__(**kwargs)
+
+    def __post_init__(self) -> None:
+        self._reporter = reporter = ShardOutbox(
+            self._outbox, notify=self._notify, folders=self._folders, loop=self.loop
+        )
+        stages = dedup = None
+        limits = RateLimits(bandwidth=self._bandwidth)
+        breakers = Breakers(loop=self.loop)
+        self.add_dependency(breakers)
+        retries = RetryScheduler(**self._retry_options, loop=self.loop)
+        self.add_dependency(retries)
+        # Each shard runs its own event loop, blocked on its own.
+        self.add_dependency(LoopMonitor(loop=self.loop))
+        if self._processes:
+            stages = StageRunner(self._processes, loop=self.loop)
+            self.add_dependency(stages)
+        if self._dedup_index:
+            # SQLite serializes the writes of the shards sharing the index.
+            dedup = Deduplicator(self._dedup_index, stages=stages, loop=self.loop)
+            self.add_dependency(dedup)
+        for p in self.workers.values():
+            p.loop = self.loop
+            p._delete = self._delete
+            p.notifier = reporter
+            p.journal = reporter
+            p.dedup = dedup
+            p.stages = stages
+            p.concurrency = self._concurrency
+            p.limits = limits
+            p.breakers = breakers
+            p.retries = retries
+
+    def on_init_dependencies(self):
+        dependencies = super().on_init_dependencies()
+        dependencies += self.workers.values()
+        return dependencies
+
+    @mode.Service.task
+    async def _receive(self):
+        while not self.should_stop:
+            message = await asyncio.to_thread(self.inbox.get)
+            if message is None:  # sent by the supervisor on stop.
+                break
+            self._received += 1
+            await self._router.route(self._folders.unpack(message))
+        await self._drain()
+        self.drained.set()
+
+    async def _drain(self):
+        # Let the messages already received be processed before exiting.
+        try:
+            await asyncio.wait_for(self._wait_done(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            pending = self._received - self._reporter.done
+            self.logger.warning(f"Shard {self.index} stopped with {pending} messages.")
+
+    async def _wait_done(self):
+        while self._reporter.done < self._received:
+            await asyncio.sleep(0.05)
+
+
+def run_shard(
+    index: int, inbox, outbox, options: dict, event_loop=LoopEnum.asyncio
+) -> None:
+    """Entry point of the child processes."""
+    # The supervisor stops the shards, not the terminal.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    use_event_loop(event_loop)
+
+    async def main():
+        shard = Shard(index, inbox, outbox, **options)
+        await shard.start()
+        await shard.drained.wait()
+        await shard.stop()
+
+    asyncio.run(main())
+
+
+class ShardPool(mode.Service):
+    """
+    Supervisor of the child processes the messages are dispatched to.
+
+    The messages are sharded by destination, so the files of a destination
+    are always sent by the same process, in order and through the same
+    connection pool. What the shards record is sent back and handed to the
+    journal and the notifier of the supervisor, so the logs still reach the
+    webapp.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        *,
+        journal=None,
+        notifier=None,
+        delete: bool = False,
+        dedup_index: PATH = None,
+        processes: int = 0,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        bandwidth: int | None = None,
+        retries: dict | None = None,
+        tracer=None,
+        folders=(),
+        event_loop: LoopEnum = LoopEnum.asyncio,
+        **kwargs,
+    ):
+        self.workers = workers
+        self.journal = journal
+        self.notifier = notifier
+        # The spans of the shards transfers are exported by the supervisor.
+        self.tracer = tracer
+        # Sent once to each shard, the messages carry the folder numbers.
+        self._folders = FolderTable(folders)
+        self._options = dict(
+            delete=delete,
+            notify=notifier is not None,
+            dedup_index=dedup_index,
+            processes=processes,
+            concurrency=concurrency,
+            # Each shard gets an equal share of the global bandwidth.
+            bandwidth=bandwidth and bandwidth / workers,
+            retries=retries,
+            folders=self._folders,
+        )
+        self._event_loop = event_loop
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes: list[multiprocessing.Queue] = []
+        self._outbox: multiprocessing.Queue | None = None
+        self._processes: list[multiprocessing.Process] = []
+        self.stats = Counter()
+        super().__init__(**kwargs)
+
+    async def on_start(self) -> None:
+        if self.notifier is not None:
+            self.add_dependency(self.notifier)
+        self._outbox = self._context.Queue()
+        for index in range(self.workers):
+            # Bounded, the watcher waits for a shard that is behind.
+            inbox = self._context.Queue(MAX_PENDING)
+            process = self._context.Process(
+                target=run_shard,
+                args=(index, inbox, self._outbox, self._options, self._event_loop),
+                # not a daemon, a shard may have its own pool of processes.
+                name=f"filedispatch-shard-{index}",
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self.logger.info(f"{self.workers} shard processes started.")
+        await super().on_start()
+
+    async def on_stop(self) -> None:
+        for inbox in self._inboxes:
+            try:
+                await asyncio.to_thread(inbox.put, None, True, STOP_TIMEOUT)
+            except queue.Full:
+                pass  # the shard is stuck, it is killed below.
+        for process in self._processes:
+            await asyncio.to_thread(process.join, STOP_TIMEOUT)
+            if process.is_alive():
+                self.logger.warning(f"{process.name} did not stop, killing it.")
+                process.kill()
+        self._inboxes, self._processes = [], []
+        await super().on_stop()
+
+    async def send(self, message: Message) -> None:
+        index = shard_of(message.destination, self.workers)
+        self.stats[index] += 1
+        inbox = self._inboxes[index]
+        message = self._folders.pack(message)
+        try:
+            inbox.put_nowait(message)
+        except queue.Full:
+            # The shard is behind, wait for room off the event loop.
+            await asyncio.to_thread(inbox.put, message)
+
+    @mode.Service.task
+    async def _collect(self):
+        # The events are still read while the shards drain on stop, a child
+        # can't exit before what it sent is read.
+        while not self.should_stop or self._processes:
+            try:
+                event = await asyncio.to_thread(self._outbox.get, timeout=0.5)
+            except queue.Empty:
+                continue
+            await self._dispatch(*event)
+
+    async def _dispatch(self, kind, *args) -> None:
+        if kind == NOTIFICATION:
+            payload, message = args
+            if message is not None:
+                message = self._folders.unpack(message)
+            await self.notifier.maybe_start()
+            self.notifier.acquire(payload, message=message)
+        elif kind == IN_FLIGHT and self.journal is not None:
+            self.journal.in_flight(self._folders.unpack(*args))
+        elif kind == FINISHED:
+            message, status, removed = args
+            message = self._folders.unpack(message)
+            if self.tracer is not None:
+                self.tracer.export(message, status)
+            if self.journal is not None:
+                self.journal.finished(message, status, removed=removed)
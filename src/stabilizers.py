@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+import mode
+
+from .timers import TimerWheel
+from .utils import PATH
+
+
+class Stabilizer(mode.Service):
+    """
+    Hold the new files back until they stop changing.
+
+    A file is dispatched once its size and modification time did not change
+    for `quiet_period` seconds, so files still being written by a slow
+    producer are not sent half-written. Every modification event of a pending
+    file pushes its deadline back. All the pending files share the same timer
+    wheel and their metadata are fetched in batch off the event loop.
+    """
+
+    def __init__(
+        self,
+        quiet_period: float,
+        on_stable: Callable[[str, PATH], Awaitable],
+        *,
+        tick: float | None = None,
+        **kwargs,
+    ):
+        self.quiet_period = quiet_period
+        self._on_stable = on_stable
+        self._wheel = TimerWheel(tick=tick or max(quiet_period / 10, 0.05))
+        # last (size, mtime) seen by pending file.
+        self._snapshots: dict[str, tuple[int, float] | None] = {}
+        super().__init__(**kwargs)
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._snapshots
+
+    def observe(self, filename: str, destination: PATH) -> None:
+        """Register a new file, it will be dispatched when it is stable."""
+        if filename in self._snapshots:
+            return self.touch(filename)
+        self._snapshots[filename] = None
+        self._wheel.schedule(filename, self.quiet_period, destination)
+
+    def touch(self, filename: str) -> None:
+        """The file has been modified, push its deadline back."""
+        if filename not in self._snapshots:
+            return
+        destination = self._wheel.cancel(filename)
+        self._wheel.schedule(filename, self.quiet_period, destination)
+
+    def discard(self, filename: str) -> None:
+        self._snapshots.pop(filename, None)
+        self._wheel.cancel(filename)
+
+    @mode.Service.task
+    async def _tick(self):
+        while not self.should_stop:
+            await self.sleep(self._wheel.tick)
+            expired = self._wheel.advance()
+            if expired:
+                await self._check(expired)
+
+    async def _check(self, expired: list[tuple[str, PATH]]) -> None:
+        filenames = [filename for filename, _ in expired]
+        stats = await asyncio.to_thread(self._stat_many, filenames)
+        now = time.time()
+
+        for (filename, destination), stat in zip(expired, stats):
+            if filename not in self._snapshots:
+                continue  # discarded meanwhile
+
+            if stat is None:
+                # The file is gone (moved or deleted by its producer).
+                self.discard(filename)
+                continue
+
+            previous = self._snapshots[filename]
+            quiet = now - stat[1]
+            if quiet >= self.quiet_period and previous in (None, stat):
+                self.discard(filename)
+                await self._on_stable(filename, destination)
+                continue
+
+            self._snapshots[filename] = stat
+            delay = min(self.quiet_period - quiet, self.quiet_period)
+            self._wheel.schedule(filename, max(delay, self._wheel.tick), destination)
+
+    @staticmethod
+    def _stat_many(filenames: list[str]) -> list[tuple[int, float] | None]:
+        stats = []
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+                stats.append((st.st_size, st.st_mtime))
+            except OSError:
+                stats.append(None)
+        return stats
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable
+
+import mode
+
+from .checksums import new_hasher
+from .compressors import new_compressor
+from .utils import PATH
+
+# Size of the file segments handed to the processes, a multiple of the mmap
+# allocation granularity (4 KiB or 64 KiB).
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+def segments(size: int, segment_size: int = SEGMENT_SIZE) -> list[tuple[int, int]]:
+    """(offset, length) of the segments of a file of `size` bytes."""
+    return [
+        (offset, min(segment_size, size - offset))
+        for offset in range(0, size, segment_size)
+    ] or [(0, 0)]
+
+
+@contextlib.contextmanager
+def map_segment(filename: PATH, offset: int, length: int):
+    """Memory map a segment of the file, nothing is copied nor pickled."""
+    if not length:
+        yield b""
+        return
+    with open(filename, "rb") as f, mmap.mmap(
+        f.fileno(), length, offset=offset, access=mmap.ACCESS_READ
+    ) as segment:
+        yield segment
+
+
+# The stage functions below run in the pool processes. They take the path of
+# the file (and a segment of it), never its content, and return small values.
+
+
+def digest_file(filename: PATH, algorithm: str, chunk_size: int = SEGMENT_SIZE) -> str:
+    hasher = new_hasher(algorithm)
+    size = os.path.getsize(filename)
+    for offset, length in segments(size, chunk_size):
+        with map_segment(filename, offset, length) as segment:
+            hasher.update(segment)
+    return hasher.hexdigest()
+
+
+def compress_segment(
+    filename: PATH, offset: int, length: int, algorithm: str, level: int | None = None
+) -> bytes:
+    """
+    Compress a segment of the file into a standalone gzip member or zstd frame,
+    the compressed segments concatenated make a valid compressed file.
+    """
+    compressor = new_compressor(algorithm, level)
+    with map_segment(filename, offset, length) as segment:
+        return compressor.compress(segment) + compressor.flush()
+
+
+class StageRunner(mode.Service):
+    """
+    Pool of processes for the CPU bound stages of the transfers (hashing,
+    compression, ...), so they run on all the cores instead of contending for
+    the GIL with the event loop. The files are passed by path and read by
+    the processes through memory mapped segments.
+    """
+
+    def __init__(self, processes: int | None = None, **kwargs):
+        self.processes = processes or os.cpu_count()
+        self._executor: ProcessPoolExecutor | None = None
+        super().__init__(**kwargs)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned, not forked from a process running an event loop and
+            # threads: a lock held by one of them would be held forever.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def on_stop(self) -> None:
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, cancel_futures=True)
+            self._executor = None
+        await super().on_stop()
+
+    async def run(self, func: Callable, *args):
+        """Run a (picklable) function in the pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def digest(self, filename: PATH, algorithm: str) -> str:
+        return await self.run(digest_file, filename, algorithm)
+
+    async def compress(
+        self,
+        filename: PATH,
+        algorithm: str,
+        level: int | None = None,
+        segment_size: int = SEGMENT_SIZE,
+    ) -> AsyncIterator[bytes]:
+        """
+        Compressed chunks of the file, its segments are compressed in
+        parallel and yielded in order. The number of segments in flight is
+        bounded by the number of processes.
+        """
+        size = await asyncio.to_thread(os.path.getsize, filename)
+        pending = asyncio.Queue(maxsize=self.processes)
+
+        async def submit():
+            for offset, length in segments(size, segment_size):
+                future = asyncio.ensure_future(
+                    self.run(
+                        compress_segment, filename, offset, length, algorithm, level
+                    )
+                )
+                await pending.put(future)
+            await pending.put(None)
+
+        submitter = asyncio.ensure_future(submit())
+        try:
+            while (future := await pending.get()) is not None:
+                yield await future
+        finally:
+            submitter.cancel()
+            while not pending.empty():
+                future = pending.get_nowait()
+                future and future.cancel()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Hashable
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel.
+
+    Scheduling and cancelling a timer are O(1), whatever the number of pending
+    timers, and a single ticking task is enough to drive all of them instead
+    of a sleeping task per timer. A timer is fired with a precision of one
+    tick.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 512):
+        self.tick = tick
+        self._slots: list[dict[Hashable, list]] = [{} for _ in range(slots)]
+        self._index: dict[Hashable, int] = {}
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def schedule(self, key: Hashable, delay: float, value: Any = None) -> None:
+        """(Re)schedule the timer identified by `key` to fire after `delay` seconds."""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        rounds, offset = divmod(ticks, len(self._slots))
+        slot = (self._cursor + offset) % len(self._slots)
+        if offset == 0:
+            # The slot of the cursor is only visited again after a full round.
+            rounds -= 1
+        self._slots[slot][key] = [rounds, value]
+        self._index[key] = slot
+
+    def cancel(self, key: Hashable) -> Any:
+        slot = self._index.pop(key, None)
+        if slot is None:
+            return
+        return self._slots[slot].pop(key)[1]
+
+    def advance(self) -> list[tuple[Hashable, Any]]:
+        """Move the wheel one tick forward and return the expired timers."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        expired = []
+        for key, timer in bucket.items():
+            if timer[0] <= 0:
+                expired.append((key, timer[1]))
+            else:
+                timer[0] -= 1
+        for key, _ in expired:
+            del bucket[key]
+            del self._index[key]
+        return expired
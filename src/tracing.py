@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+import mode
+
+from .metrics import destination_label
+from .utils import PATH, Message, StatusEnum, STAGE_DURATIONS
+
+SERVICE_NAME = "filedispatch"
+
+# https://opentelemetry.io/docs/specs/otel/trace/api/#spankind
+SPAN_KIND_INTERNAL = 1
+# https://opentelemetry.io/docs/specs/otel/trace/api/#set-status
+STATUS_OK, STATUS_ERROR = 1, 2
+
+# Span of the time spent between two stages of a message.
+STAGE_SPANS = {
+    "queue_time": "queue",
+    "wait_time": "wait",
+    "transfer_time": "transfer",
+    "notify_time": "notify",
+}
+
+
+def attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def root_span_id(message: Message, attempt: int | None = None) -> str:
+    # The spans of an attempt, exported at different times, share its root.
+    attempt = attempt or message.attempt
+    # The high half of the id is the same for all the messages of a process.
+    return f"{message.hex[-12:]}{attempt % 0x10000:04x}"
+
+
+class FileSpanExporter(mode.Service):
+    """
+    Write the spans of the messages to a local file, in the OTLP/JSON
+    format (one `resourceSpans` batch per line, as the file exporter of the
+    OpenTelemetry collector does), to be loaded in any OpenTelemetry
+    compatible tool.
+
+    The trace of a message is a `dispatch` root span with a child span by
+    stage: queue (watcher queue and routing), wait (worker queue), transfer
+    and notify. The spans are buffered and written off the event loop every
+    `flush_interval` seconds.
+    """
+
+    def __init__(self, path: PATH, *, flush_interval: float = 1.0, **kwargs):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._buffer: list[dict] = []
+        super().__init__(**kwargs)
+
+    def export(self, message: Message, status: StatusEnum | None = None) -> None:
+        """The spans of a transfer done with (the root and its stages)."""
+        timestamps = message.timestamps
+        start = timestamps.get("detected", timestamps.get("started"))
+        end = timestamps.get("finished")
+        if start is None or end is None:
+            return
+        error = status == StatusEnum.FAILED
+        attributes = [
+            attribute("file.name", message.filename),
+            attribute("destination", destination_label(message.destination)),
+            attribute("attempt", message.attempt),
+        ]
+        if status is not None:
+            attributes.append(attribute("status", status.value))
+        self._buffer.append(
+            self._span(message, "dispatch", start, end, None, attributes, error)
+        )
+        for column in ("queue_time", "wait_time", "transfer_time"):
+            self._export_stage(message, column)
+
+    def export_notification(self, message: Message, attempt: int | None = None) -> None:
+        self._export_stage(message, "notify_time", attempt)
+
+    def _export_stage(self, message: Message, column: str, attempt=None) -> None:
+        timestamps = message.timestamps
+        start, end = (timestamps.get(stage) for stage in STAGE_DURATIONS[column])
+        if start is None or end is None:
+            return
+        name = STAGE_SPANS[column]
+        self._buffer.append(
+            self._span(message, name, start, end, root_span_id(message, attempt), [])
+        )
+
+    @staticmethod
+    def _span(message, name, start, end, parent, attributes, error=False) -> dict:
+        # The timestamps are monotonic, the spans need the wall clock time.
+        offset = time.time_ns() - time.monotonic_ns()
+        span = {
+            "traceId": message.hex,
+            "spanId": root_span_id(message) if parent is None else new_span_id(),
+            "name": name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(int(start * 1e9) + offset),
+            "endTimeUnixNano": str(int(end * 1e9) + offset),
+            "attributes": attributes,
+            "status": {"code": STATUS_ERROR if error else STATUS_OK},
+        }
+        if parent is not None:
+            span["parentSpanId"] = parent
+        return span
+
+    @mode.Service.task
+    async def _flush_periodically(self):
+        while not self.should_stop:
+            await self.sleep(self.flush_interval)
+            await self.flush()
+
+    async def on_stop(self) -> None:
+        await self.flush()
+        await super().on_stop()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        spans, self._buffer = self._buffer, []
+        await asyncio.to_thread(self._write, spans)
+
+    def _write(self, spans: list[dict]) -> None:
+        batch = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [attribute("service.name", SERVICE_NAME)]
+                    },
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(batch) + "\n")
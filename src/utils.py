@@ -1,10 +1,13 @@
-import json
-import math
+from __future__ import annotations
+
 import os
 import dataclasses
+import itertools
+import sys
+import time
 import uuid
 from enum import Enum
-from typing import Union
+from typing import Any, Union
 from pathlib import Path
 
 import aiofiles.os as aiofiles_os
@@ -21,21 +24,106 @@ __all__ = [
     "get_protocol",
     "get_filesize",
     "get_payload",
+    "format_size",
+    "LogRecord",
     "PATH",
     "FtpUrl",
     "StatusEnum",
     "ProtocolEnum",
     "OrderingEnum",
+    "ChecksumEnum",
+    "CompressionEnum",
+    "BreakerStateEnum",
+    "LoopEnum",
+    "use_event_loop",
     "move_dict_key_to_top",
     "Message",
 ]
 
 
-@dataclasses.dataclass(frozen=True)
+# Stages a message goes through, their monotonic timestamps are kept in the
+# `timestamps` header: detected by the watcher, routed to its worker, transfer
+# started and finished, log sent to the webapp.
+STAGES = ("detected", "routed", "started", "finished", "notified")
+
+# Log entry column of the seconds spent between two stages.
+STAGE_DURATIONS = {
+    "queue_time": ("detected", "routed"),
+    "wait_time": ("routed", "started"),
+    "transfer_time": ("started", "finished"),
+    "notify_time": ("finished", "notified"),
+}
+
+
+# Ids of the messages: a random prefix drawn once per process and a counter,
+# unique across the shards and the restarts without a uuid4() per message.
+_ids = itertools.count((uuid.uuid4().int >> 64) << 64)
+
+
+@dataclasses.dataclass(slots=True)
 class Message:
-    body: dict
-    headers: dict = dataclasses.field(default_factory=dict)
-    id: uuid.UUID = dataclasses.field(default_factory=uuid.uuid4)
+    """
+    A file to send to a destination, and what is learned about it on its way.
+
+    Slotted and flat, it is small enough for a backlog of a million queued
+    files: the destinations are interned, a folder's messages share theirs.
+    """
+
+    filename: PATH
+    destination: str | None
+    # FolderModel of the destination, for the per-destination options.
+    folder: Any = None
+    # bytes, measured when the message is queued.
+    size: int | None = None
+    # number of the transfer attempt, 1 for the first one.
+    attempt: int = 1
+    # number of times the destination asked to slow down.
+    throttled: int = 0
+    # let through by the circuit breaker it was deferred by.
+    released: bool = False
+    # holds the request token of its destination, queued again to wait for it.
+    paced: bool = False
+    # time.monotonic() of the STAGES reached, None until then.
+    detected: float | None = None
+    routed: float | None = None
+    started: float | None = None
+    finished: float | None = None
+    notified: float | None = None
+    id: int = dataclasses.field(default_factory=_ids.__next__)
+
+    def __post_init__(self) -> None:
+        if self.destination is not None:
+            self.destination = sys.intern(str(self.destination))
+
+    @property
+    def body(self) -> dict:
+        """The filename and the destination, as the messages used to carry."""
+        return dict(filename=self.filename, destination=self.destination)
+
+    @property
+    def hex(self) -> str:
+        """The id as 32 hexadecimal digits, e.g. a trace id."""
+        return f"{self.id:032x}"
+
+    def mark(self, stage: str, at: float | None = None) -> None:
+        """Record the time the message reaches a stage (time.monotonic)."""
+        setattr(self, stage, time.monotonic() if at is None else at)
+
+    @property
+    def timestamps(self) -> dict[str, float]:
+        """time.monotonic() of the stages reached, by stage."""
+        return {
+            stage: at for stage in STAGES if (at := getattr(self, stage)) is not None
+        }
+
+    def durations(self) -> dict[str, float]:
+        """Seconds between the stages reached, by log entry column."""
+        timestamps = self.timestamps
+        return {
+            column: timestamps[end] - timestamps[start]
+            for column, (start, end) in STAGE_DURATIONS.items()
+            if start in timestamps and end in timestamps
+        }
 
 
 class FtpUrl(AnyUrl):
@@ -58,6 +146,8 @@ JSON_CONTENT_TYPE = "application/json"
 class StatusEnum(str, Enum):
     SUCCEEDED = "SUCCEEDED"
     FAILED = "FAILED"
+    # The content was already delivered, nothing has been sent.
+    SKIPPED = "SKIPPED"
 
 
 class OrderingEnum(str, Enum):
@@ -67,6 +157,40 @@ class OrderingEnum(str, Enum):
     REVERSED_BYTE_SIZE = "-byte_size"
 
 
+class ChecksumEnum(str, Enum):
+    blake2b = "blake2b"
+    sha256 = "sha256"
+    # requires the optional xxhash package.
+    xxhash = "xxhash"
+
+
+class CompressionEnum(str, Enum):
+    gzip = "gzip"
+    # requires the optional zstandard package.
+    zstd = "zstd"
+
+
+class BreakerStateEnum(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    # A few transfers are let through to probe the destination.
+    HALF_OPEN = "half-open"
+
+
+class LoopEnum(str, Enum):
+    asyncio = "asyncio"
+    # requires the optional uvloop package.
+    uvloop = "uvloop"
+
+
+def use_event_loop(loop: LoopEnum) -> None:
+    """Set the event loop policy, before any loop is created."""
+    if loop == LoopEnum.uvloop:
+        import mode.loop
+
+        mode.loop.use("uvloop")
+
+
 class ProtocolEnum(str, Enum):
     file = "file"
     http = "http"
@@ -99,53 +223,109 @@ def clean_url(url: PATH) -> PATH:
     return Path(str_url) if isinstance(url, Path) else str_url
 
 
-async def get_filesize(filename):
-    suffix = ["KB", "MB", "GB", "TB"]
-    quot = byte_size = await aiofiles_os.path.getsize(filename)
-    size = None
-    idx = -2
-
-    while math.floor(quot):
-        size, quot = quot, quot / 1024
-        idx += 1
-        # stop on terabytes
-        if idx == len(suffix) - 1:
-            break
-
-    if size:
-        size = f"{size:.2f} {suffix[idx]}"
-    else:
-        size = f"{byte_size / 1024:.2f} {suffix[0]}"
-
-    return size, byte_size
+def format_size(byte_size: int) -> str:
+    """Human readable size, in KB to TB with two decimals."""
+    size = byte_size / 1024
+    for suffix in ("KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.2f} {suffix}"
+        size /= 1024
+    # stop on terabytes
+    return f"{size:.2f} TB"
 
 
-async def get_payload(filename, destination, status, processor, reason=None):
-    import src.schemas  # FIXME: Fix it just temporary solution
-
-    extension = os.path.splitext(filename)[1].removeprefix(".")
-
+async def get_filesize(filename):
+    byte_size = await aiofiles_os.path.getsize(filename)
+    return format_size(byte_size), byte_size
+
+
+@dataclasses.dataclass(slots=True)
+class LogRecord:
+    """
+    The log entry of a transfer, as posted to the webapp.
+
+    The workers build it from what they already know (the size of the file
+    measured when it was queued, the protocol of the worker), nothing is
+    validated on the way: the webapp does it once when it receives it.
+    """
+
+    filename: str
+    source: str
+    destination: str
+    extension: str
+    worker: str
+    protocol: str
+    status: str
+    size: str | None = None
+    byte_size: int | None = None
+    reason: str | None = None
+    checksum: str | None = None
+    attempt: int | None = None
+    queue_time: float | None = None
+    wait_time: float | None = None
+    transfer_time: float | None = None
+    notify_time: float | None = None
+
+    @classmethod
+    def of(
+        cls,
+        filename: PATH,
+        destination: PATH,
+        status: StatusEnum,
+        worker: str,
+        protocol: str,
+        byte_size: int | None = None,
+        durations: dict | None = None,
+        **kwargs,
+    ) -> "LogRecord":
+        source, name = os.path.split(str(filename))
+        return cls(
+            filename=name,
+            source=source or ".",
+            destination=str(destination),
+            extension=os.path.splitext(name)[1].removeprefix("."),
+            worker=worker,
+            protocol=ProtocolEnum(protocol).value,
+            status=StatusEnum(status).value,
+            size=None if byte_size is None else format_size(byte_size),
+            byte_size=byte_size,
+            **(durations or {}),
+            **kwargs,
+        )
+
+    def as_dict(self) -> dict:
+        """The JSON body of the log, journaled and posted as is."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+async def get_payload(
+    filename,
+    destination,
+    status,
+    processor,
+    reason=None,
+    checksum=None,
+    attempt=None,
+    durations=None,
+):
     try:
         # Skip file size fetching if the file is not accessible.
-        _size, _byte_size = await get_filesize(filename)
+        byte_size = await aiofiles_os.path.getsize(filename)
     except OSError:
-        _size = None
-        _byte_size = None
-
-    return json.loads(
-        src.schemas.WriteOnlyLogEntry(
-            filename=os.path.basename(filename),
-            destination=str(destination),
-            source=os.path.dirname(filename),
-            extension=extension,
-            worker=processor,
-            protocol=ProtocolEnum[get_protocol(destination)],
-            status=status,
-            size=_size,
-            byte_size=_byte_size,
-            reason=reason,
-        ).json()
-    )
+        byte_size = None
+
+    return LogRecord.of(
+        filename,
+        destination,
+        status,
+        processor,
+        get_protocol(destination),
+        byte_size=byte_size,
+        durations=durations,
+        reason=reason,
+        checksum=checksum,
+        attempt=attempt,
+    ).as_dict()
 
 
 def move_dict_key_to_top(data, key):
@@ -160,5 +340,5 @@ def has_permission(filename, mode):
     return os.access(filename, mode)
 
 
-def create_message(filename, destination):
-    return Message(body=dict(filename=filename, destination=destination))
+def create_message(filename, destination, **fields):
+    return Message(filename, destination, **fields)
@@ -1,73 +1,203 @@
+from __future__ import annotations
+
 import asyncio
-from asyncio import Queue
 import abc
 import os
 import shutil
+import time
+from pathlib import PurePosixPath
+from typing import TYPE_CHECKING
 
 from pydantic import parse_obj_as, error_wrappers
 
 import mode
-import aiohttp
-import aioftp
 import aiofiles
 import aiofiles.os as aiofiles_os
-from aiohttp_retry import RetryClient
 
-from .utils import get_payload, FtpUrl, StatusEnum, Message
+from .checksums import (
+    HashingReader,
+    copy_with_digest,
+    iter_chunks,
+    new_hasher,
+    FTP_HASH_NAMES,
+)
+from .compressors import CompressingReader, get_compression, SUFFIXES
+from .metrics import (
+    IN_FLIGHT,
+    TRANSFERS,
+    TRANSFER_SECONDS,
+    TRANSFERRED_BYTES,
+    destination_label,
+)
+from .limiters import Limits, DEFAULT_RETRY_AFTER, parse_retry_after
+from .schedulers import LaneScheduler, DEFAULT_CONCURRENCY, MAX_PENDING
+from .stages import SEGMENT_SIZE
+from .utils import (
+    LogRecord,
+    FtpUrl,
+    StatusEnum,
+    Message,
+    ChecksumEnum,
+    CompressionEnum,
+)
+
+if TYPE_CHECKING:
+    from aiohttp_retry import RetryClient
+
+# The protocol clients (aiohttp, aioftp) are imported by the workers of their
+# protocol on their first transfer, the startup doesn't pay for the unused ones.
+
+# Responses asking to slow down, the transfer is tried again after the
+# Retry-After delay, at most MAX_THROTTLED times.
+THROTTLING_STATUSES = {429, 503}
+MAX_THROTTLED = 5
+
+# The throttling statuses are not retried right away by the client.
+RETRY_OPTIONS = dict(
+    attempts=3, statuses={500, 502, 504}, retry_all_server_errors=False
+)
 
 copyfile = aiofiles_os.wrap(shutil.copyfile)
+copyfile_with_digest = aiofiles_os.wrap(copy_with_digest)
 unlink = aiofiles_os.wrap(os.unlink)
 
 
 def is_processable(message: Message):
-    filename = message.body.get("filename")
-    destination = message.body.get("destination")
+    filename = message.filename
+    destination = message.destination
     return filename and destination
 
 
+def get_folder_option(message: Message, name, default=None):
+    folder = message.folder
+    return getattr(folder, name, default)
+
+
+def checksum_mismatch(digest, remote_digest):
+    return f"Checksum mismatch, sent {digest} but the destination computed {remote_digest}."
+
+
 class BaseWorker(mode.Service):
     abstract = True
 
     fancy_name: str = "Base Processor"
+    # Label of the metrics of the worker.
+    protocol: str = ""
 
-    def __init__(self, notifier=None, **kwargs):
+    def __init__(
+        self,
+        notifier=None,
+        journal=None,
+        dedup=None,
+        stages=None,
+        limits=None,
+        breakers=None,
+        retries=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        **kwargs,
+    ):
         self._notifier = notifier
-        self.unprocessed: Queue[Message] = Queue()
+        self.journal = journal
+        self.dedup = dedup
+        # Process pool for the CPU bound stages, the thread pool if None.
+        self.stages = stages
+        # Rate limits shared by the workers, no limits if None.
+        self.limits = limits
+        # Circuit breakers of the endpoints, shared by the workers.
+        self.breakers = breakers
+        # Delay queue of the failed transfers, they are not retried if None.
+        self.retries = retries
+        # Exporter of the spans of the transfers, no tracing if None.
+        self.tracer = None
+        self.concurrency = concurrency
+        self.unprocessed = LaneScheduler(maxsize=MAX_PENDING)
+        # The event loop keeps weak references to the tasks only.
+        self._transfers: set[asyncio.Task] = set()
+        self._in_flight = IN_FLIGHT.labels(self.protocol)
         self._delete = kwargs.get("delete", False)
         super().__init__(**kwargs)
 
-    async def on_start(self) -> None:
-        self.add_dependency(self.notifier)
-        await super().on_start()
-
     async def _notify(
         self,
         message,
         status,
         reason=None,
         delete=False,
+        checksum=None,
         **kwargs,
     ):
-        if not self.notifier:
-            return
+        filename = message.filename
+        destination = message.destination
+
+        message.mark("finished")
+        durations = message.durations()
+        if self.tracer is not None:
+            self.tracer.export(message, status)
+
+        TRANSFERS.labels(self.protocol, status.value).inc()
+        if status == StatusEnum.SUCCEEDED:
+            label = destination_label(destination)
+            size = message.size or 0
+            TRANSFERRED_BYTES.labels(self.protocol, label).inc(size)
+
+        if self.dedup is not None and status == StatusEnum.SUCCEEDED:
+            # Reuse the digest computed during the transfer when it is the same.
+            algorithm = get_folder_option(message, "checksum")
+            digest = checksum if algorithm == ChecksumEnum.blake2b else None
+            if not self._hashes_original(message):
+                # The checksum covers the compressed bytes, not the file.
+                digest = None
+            await self.dedup.record(filename, destination, digest=digest)
+
+        attempt = message.attempt
+        retried = given_up = False
+        if status == StatusEnum.FAILED and self.retries is not None:
+            retried = self.retries.retry(message, self.acquire)
+            given_up = not retried
+
+        if self.journal is not None and not retried:
+            # A message to retry stays in flight, it is resumed on restart.
+            self.journal.finished(message, status, removed=delete)
+
+        if self.notifier:
+            await self._log(
+                message, status, reason, delete, checksum, attempt, durations
+            )
 
-        filename = message.body.get("filename")
-        destination = message.body.get("destination")
+        if given_up:
+            # After the log, which names the file where it was found.
+            await self.retries.bury(message)
 
-        try:
-            payload = await get_payload(
-                filename, destination, status, self.fancy_name, reason
-            )
-        except error_wrappers.ValidationError as exp:
-            self.logger.debug(exp)
-            return
+    async def _log(
+        self,
+        message,
+        status,
+        reason=None,
+        delete=False,
+        checksum=None,
+        attempt=1,
+        durations=None,
+    ):
+        payload = LogRecord.of(
+            message.filename,
+            message.destination,
+            status,
+            self.fancy_name,
+            self.protocol,
+            # measured when the message was queued.
+            byte_size=message.size,
+            durations=durations,
+            reason=reason,
+            checksum=checksum,
+            attempt=attempt,
+        ).as_dict()
 
         await self.notifier.maybe_start()
-        self.notifier.acquire(payload)
+        self.notifier.acquire(payload, message=message)
 
         if delete and status != StatusEnum.FAILED:
             try:
-                filename = message.body.get("filename") or ""
+                filename = message.filename or ""
                 await unlink(filename)
             except OSError as exp:
                 self.logger.debug(exp)
@@ -80,17 +210,146 @@ class BaseWorker(mode.Service):
     def notifier(self, notifier):
         self._notifier = notifier
 
+    def _hashes_original(self, message: Message) -> bool:
+        """Whether the checksum of a transfer is the one of the file content."""
+        return True
+
     @abc.abstractmethod
     async def process(self, message: Message, delete=False, **kwargs):
         pass
 
+    async def handle(self, message: Message, delete=False, **kwargs):
+        if self.dedup is not None and is_processable(message):
+            filename = message.filename
+            delivered = await self.dedup.lookup(filename, message.destination)
+            if delivered:
+                # Record a no-op delivery instead of sending the same bytes again.
+                reason = f"The same content was already delivered as « {delivered} »."
+                self.logger.info(f"File {filename} skipped. {reason}")
+                await self._notify(message, StatusEnum.SKIPPED, reason, delete=delete)
+                return
+
+        if self._paced(message):
+            return
+
+        if self.breakers is None or not is_processable(message):
+            await self._process(message, delete=delete, **kwargs)
+            return
+
+        if not self.breakers.allow(message):
+            # Parked until the endpoint is back, the breakers queue it again.
+            self.breakers.defer(message, self.acquire)
+            return
+        try:
+            await self._process(message, delete=delete, **kwargs)
+        finally:
+            self.breakers.done(message)
+
+    async def _process(self, message: Message, **kwargs):
+        label = destination_label(message.destination)
+        start = time.perf_counter()
+        message.mark("started")
+        self._in_flight.inc()
+        try:
+            await self.process(message, **kwargs)
+        finally:
+            self._in_flight.dec()
+            TRANSFER_SECONDS.labels(self.protocol, label).observe(
+                time.perf_counter() - start
+            )
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, concurrency: int):
+        self._concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+
     async def consume(self, **kwargs):
+        # The messages are taken from the scheduler only when a transfer slot
+        # is free, so that the order they are sent in is the scheduler one.
+        await self._slots.acquire()
         message = await self.unprocessed.get()
-        asyncio.create_task(self.process(message, delete=self._delete, **kwargs))
-        await self.sleep(1.0)
+        if self.journal is not None:
+            self.journal.in_flight(message)
+        task = asyncio.create_task(self.handle(message, delete=self._delete, **kwargs))
+        self._transfers.add(task)
+        task.add_done_callback(self._transfer_done)
+
+    def _transfer_done(self, task: asyncio.Task) -> None:
+        self._transfers.discard(task)
+        self._slots.release()
+
+    async def put(self, message: Message) -> None:
+        """Queue a new message, wait while the worker has too many queued."""
+        await self.unprocessed.put(message)
 
     def acquire(self, message: Message, **kwargs) -> None:
-        asyncio.create_task(self.unprocessed.put(message))
+        # Queued again (retried, throttled or released by its breaker), the
+        # message was let in already, the queue bound doesn't apply.
+        asyncio.create_task(self.unprocessed.put(message, wait=False))
+
+    def _record(self, message: Message, up: bool) -> None:
+        """Tell the circuit breaker of the destination whether it answered."""
+        if self.breakers is None:
+            return
+        destination = message.destination
+        if up:
+            self.breakers.record_success(destination)
+        else:
+            self.breakers.record_failure(destination)
+
+    def _get_limits(self, message: Message) -> Limits | None:
+        if self.limits is None:
+            return
+        destination = message.destination
+        return self.limits.get(destination, message.folder)
+
+    def _paced(self, message: Message) -> bool:
+        """
+        Take the request token of the destination before the transfer: when
+        it must be waited for, the message is queued again once it's there
+        and its transfer slot is left to the other destinations meanwhile.
+        """
+        limits = self._get_limits(message)
+        if limits is None or not is_processable(message):
+            return False
+        # Queued again with its token, only a later Retry-After delays it.
+        delay = limits.paused() if message.paced else limits.reserve()
+        message.paced = delay > 0
+        if message.paced:
+            asyncio.get_running_loop().call_later(delay, self.acquire, message)
+        return message.paced
+
+    def _throttled(self, message: Message, retry_after: float | None) -> bool:
+        """
+        The destination asked to slow down: pause it and queue the message
+        again, return False when it was throttled too many times already.
+        """
+        limits = self._get_limits(message)
+        attempts = message.throttled
+        if limits is None or attempts >= MAX_THROTTLED:
+            return False
+        retry_after = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+        limits.pause(retry_after)
+        message.throttled = attempts + 1
+        self.logger.info(
+            f"{message.destination} is throttling, "
+            f"{message.filename} is sent again in {retry_after}s."
+        )
+        self.acquire(message)
+        return True
+
+    async def _compress(self, filename, file, compression, level):
+        """Compressed chunks of the opened file."""
+        if self.stages is not None:
+            size = (await aiofiles_os.stat(filename)).st_size
+            if size > SEGMENT_SIZE:
+                # Big files are compressed by segments in the process pool.
+                return self.stages.compress(filename, compression, level)
+        return CompressingReader(file, compression, level)
 
     def add_dependency(self, service):
         if not service:
@@ -100,20 +359,35 @@ class BaseWorker(mode.Service):
 
 class FileWorker(BaseWorker):
     fancy_name = "File worker"
+    protocol = "file"
 
     async def process(self, message, delete=False, **kwargs):
         if not is_processable(message):
             return
 
-        filename = message.body.get("filename")
-        destination = message.body.get("destination")
+        filename = message.filename
+        destination = message.destination
+
+        algorithm = get_folder_option(message, "checksum")
 
         try:
             basename = os.path.basename(filename)
-            await copyfile(filename, os.path.join(destination, basename))
+            target = os.path.join(destination, basename)
+            digest = None
+            if algorithm and self.stages is not None:
+                digest = await self.stages.run(
+                    copy_with_digest, filename, target, algorithm
+                )
+            elif algorithm:
+                # The file is hashed while it is copied.
+                digest = await copyfile_with_digest(filename, target, algorithm)
+            else:
+                await copyfile(filename, target)
             self.logger.info(f"File {filename} sent to {destination}")
             asyncio.create_task(
-                self._notify(message, StatusEnum.SUCCEEDED, delete=delete)
+                self._notify(
+                    message, StatusEnum.SUCCEEDED, delete=delete, checksum=digest
+                )
             )
         except OSError as exp:
             self.logger.exception(exp)
@@ -128,34 +402,129 @@ class FileWorker(BaseWorker):
 
 class HttpWorker(BaseWorker):
     fancy_name = "HTTP worker"
+    protocol = "http"
+
+    def __init__(self, *args, **kwargs):
+        self._client = None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def client(self) -> RetryClient:
+        # One session (hence one connection pool) is shared by all the uploads
+        # of the worker, whatever the source directory the files come from.
+        if self._client is None:
+            from aiohttp_retry import RetryClient, ExponentialRetry
+
+            self._client = RetryClient(retry_options=ExponentialRetry(**RETRY_OPTIONS))
+        return self._client
+
+    async def on_stop(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        await super().on_stop()
+
+    def _hashes_original(self, message: Message) -> bool:
+        # gzip is applied by aiohttp after the chunks are hashed.
+        basename = os.path.basename(message.filename)
+        compression = get_compression(basename, message.folder)
+        return compression in (None, CompressionEnum.gzip)
 
     async def process(self, message, delete=False, **kwargs):
+        import aiohttp
+        from aiohttp import hdrs
+
         if not is_processable(message):
             return
 
-        filename = message.body.get("filename")
-        destination = message.body.get("destination")
+        filename = message.filename
+        destination = message.destination
+        algorithm = get_folder_option(message, "checksum")
+        limits = self._get_limits(message)
 
         with aiohttp.MultipartWriter() as writer:
             try:
                 # FIXME: The content getter must depend on the file size,
                 #  we  must use _send_chunk for big files (State the definition of big)
-                writer.append(await aiofiles.open(filename, "rb"))
+                content = await aiofiles.open(filename, "rb")
             except OSError as exp:
                 self.logger.exception(exp)
                 reason = " ".join([str(arg) for arg in exp.args])
                 await self._notify(message, StatusEnum.FAILED, reason)
                 return
 
-            async with RetryClient() as client:
-                async with client.post(destination, data=writer) as response:
-                    if response.ok:
-                        await self._notify(message, StatusEnum.SUCCEEDED)
-                    else:
-                        reason = await response.text()
-                        reason = f"{response.status} {response.reason}\n\n{reason}"
-                        self.logger.debug(reason)
-                        await self._notify(message, StatusEnum.FAILED, reason)
+            basename = os.path.basename(filename)
+            compression = get_compression(basename, message.folder)
+            headers, reader = {}, None
+            if compression == CompressionEnum.gzip:
+                # aiohttp compresses the part on the fly and the destination
+                # decodes it, the digest is the one of the original content.
+                headers[hdrs.CONTENT_ENCODING] = compression.value
+            elif compression:
+                # No Content-Encoding for zstd, the compressed file is sent as it is.
+                content = await self._compress(
+                    filename,
+                    content,
+                    compression,
+                    get_folder_option(message, "compression_level"),
+                )
+                basename += SUFFIXES[compression]
+            if algorithm:
+                # The chunks are hashed as they are streamed to the destination.
+                content = reader = HashingReader(content, algorithm)
+            throttled = limits is not None and limits.throttled
+            if throttled:
+                content = limits.reader(content)
+
+            if headers or reader or compression or throttled:
+                part = writer.append(content, headers or None)
+                part.set_content_disposition("attachment", filename=basename)
+            else:
+                writer.append(content)
+
+            try:
+                await self._post(message, destination, writer, reader)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exp:
+                self.logger.warning(
+                    f"File {filename} not sent to {destination}: {exp!r}"
+                )
+                self._record(message, False)
+                await self._notify(message, StatusEnum.FAILED, repr(exp))
+
+    async def _post(self, message, destination, writer, reader):
+        from aiohttp import hdrs
+
+        filename = message.filename
+        async with self.client.post(destination, data=writer) as response:
+            if self.breakers is not None:
+                # The destination is up as long as it answers, even to slow down.
+                up = response.status < 500 or response.status in THROTTLING_STATUSES
+                self._record(message, up)
+            digest = reader and reader.hexdigest()
+            remote_digest = self._get_remote_digest(message, response)
+            if response.ok and remote_digest and remote_digest != digest:
+                reason = checksum_mismatch(digest, remote_digest)
+                self.logger.warning(f"File {filename}: {reason}")
+                await self._notify(message, StatusEnum.FAILED, reason)
+            elif response.ok:
+                await self._notify(message, StatusEnum.SUCCEEDED, checksum=digest)
+            elif response.status in THROTTLING_STATUSES and self._throttled(
+                message, parse_retry_after(response.headers.get(hdrs.RETRY_AFTER))
+            ):
+                return
+            else:
+                reason = await response.text()
+                reason = f"{response.status} {response.reason}\n\n{reason}"
+                self.logger.debug(reason)
+                await self._notify(message, StatusEnum.FAILED, reason)
+
+    @staticmethod
+    def _get_remote_digest(message, response):
+        if not get_folder_option(message, "verify"):
+            return
+        header = get_folder_option(message, "checksum_header")
+        remote_digest = response.headers.get(header) if header else None
+        return remote_digest and remote_digest.strip().lower()
 
     async def _send_chunk(self, filename):  # useful for big files
         async with aiofiles.open(filename, "rb") as f:
@@ -172,13 +541,20 @@ class HttpWorker(BaseWorker):
 
 class FtpWorker(BaseWorker):
     fancy_name = "FTP worker"
+    protocol = "ftp"
+
+    def _hashes_original(self, message: Message) -> bool:
+        basename = os.path.basename(message.filename)
+        return get_compression(basename, message.folder) is None
 
     async def process(self, message, delete=False, **kwargs):
+        import aioftp
+
         if not is_processable(message):
             return
 
-        filename = message.body.get("filename")
-        destination = message.body.get("destination")
+        filename = message.filename
+        destination = message.destination
 
         try:
             scheme = parse_obj_as(FtpUrl, destination)
@@ -186,25 +562,114 @@ class FtpWorker(BaseWorker):
             self.logger.warning(exp)
             self.logger.debug(exp, stack_info=True)
             reason = f"The destination path « {destination} » is not valid ftp url."
-            await self._notify(filename, destination, StatusEnum.FAILED, reason)
+            await self._notify(message, StatusEnum.FAILED, reason)
             return
 
-        async with aioftp.Client.context(
-            scheme.host, port=scheme.port, user=scheme.user, password=scheme.password
-        ) as client:
-            try:
-                await client.upload(filename, destination)
-                await self._notify(message, StatusEnum.SUCCEEDED)
-            except aioftp.StatusCodeError as exp:
-                self.logger.warning(exp)
-                self.logger.debug(exp, stack_info=True)
-                reason = f"Received {exp.received_codes}\n\nExpected{exp.expected_codes}\n\n{exp.info}"
-                await self._notify(message, StatusEnum.FAILED, reason)
-            except aioftp.AIOFTPException as exp:
-                self.logger.warning(exp)
-                self.logger.debug(exp, stack_info=True)
-                reason = f"{exp}"
+        algorithm = get_folder_option(message, "checksum")
+        basename = os.path.basename(filename)
+        compression = get_compression(basename, message.folder)
+        limits = self._get_limits(message)
+
+        connected = False
+        try:
+            async with aioftp.Client.context(
+                scheme.host,
+                port=scheme.port,
+                user=scheme.user,
+                password=scheme.password,
+            ) as client:
+                connected = True
+                self._record(message, True)
+                await self._send(
+                    message, client, scheme, algorithm, compression, limits
+                )
+        except (ConnectionError, asyncio.TimeoutError) as exp:
+            if connected:
+                raise
+            self.logger.warning(f"File {filename} not sent to {destination}: {exp!r}")
+            self._record(message, False)
+            await self._notify(message, StatusEnum.FAILED, repr(exp))
+
+    async def _send(self, message, client, scheme, algorithm, compression, limits):
+        import aioftp
+
+        filename = message.filename
+        basename = os.path.basename(filename)
+        throttled = limits is not None and limits.throttled
+        directory = PurePosixPath(scheme.path or "/")
+        try:
+            if not algorithm and not compression and not throttled:
+                # The remote directory, not the URL (made a directory otherwise).
+                await client.upload(filename, directory)
+                await self._notify(message, StatusEnum.SUCCEEDED, checksum=None)
+                return
+
+            path = directory / basename
+            level = get_folder_option(message, "compression_level")
+            path, digest = await self._upload_stream(
+                client, filename, path, algorithm, compression, level, limits
+            )
+            remote_digest = None
+            if get_folder_option(message, "verify"):
+                remote_digest = await self._get_remote_digest(client, path, algorithm)
+            if remote_digest and remote_digest != digest:
+                reason = checksum_mismatch(digest, remote_digest)
+                self.logger.warning(f"File {filename}: {reason}")
                 await self._notify(message, StatusEnum.FAILED, reason)
+            else:
+                await self._notify(message, StatusEnum.SUCCEEDED, checksum=digest)
+        except OSError as exp:
+            self.logger.exception(exp)
+            reason = " ".join([str(arg) for arg in exp.args])
+            await self._notify(message, StatusEnum.FAILED, reason)
+        except aioftp.StatusCodeError as exp:
+            self.logger.warning(exp)
+            self.logger.debug(exp, stack_info=True)
+            reason = f"Received {exp.received_codes}\n\nExpected{exp.expected_codes}\n\n{exp.info}"
+            await self._notify(message, StatusEnum.FAILED, reason)
+        except aioftp.AIOFTPException as exp:
+            self.logger.warning(exp)
+            self.logger.debug(exp, stack_info=True)
+            reason = f"{exp}"
+            await self._notify(message, StatusEnum.FAILED, reason)
+
+    async def _upload_stream(
+        self, client, filename, path, algorithm, compression, level, limits=None
+    ):
+        # The chunks are compressed then hashed as they are streamed to the
+        # destination, the digest is the one of the file stored there.
+        async with aiofiles.open(filename, "rb") as f:
+            reader = f
+            if compression:
+                reader = await self._compress(filename, f, compression, level)
+                path = path.with_name(path.name + SUFFIXES[compression])
+            if algorithm:
+                reader = hashing = HashingReader(reader, algorithm)
+            if limits is not None and limits.throttled:
+                reader = limits.reader(reader)
+            async with client.upload_stream(path) as stream:
+                async for chunk in iter_chunks(reader):
+                    await stream.write(chunk)
+        return path, hashing.hexdigest() if algorithm else None
+
+    async def _get_remote_digest(self, client, path, algorithm):
+        import aioftp
+
+        # https://datatracker.ietf.org/doc/html/draft-bryan-ftpext-hash-02
+        name = FTP_HASH_NAMES.get(algorithm)
+        if not name:
+            self.logger.debug(f"The FTP HASH command doesn't support {algorithm}.")
+            return
+        try:
+            await client.command(f"OPTS HASH {name}", "200")
+            _, info = await client.command(f"HASH {path}", "213")
+        except aioftp.StatusCodeError as exp:
+            self.logger.debug(f"The FTP server can't compute the file digest: {exp}")
+            return
+        # 213 SHA-256 0-49 169cd22282da7f147cb491e559e9dd filename.mp4
+        for token in " ".join(info).split():
+            if len(token) == len(new_hasher(algorithm).hexdigest()):
+                return token.lower()
 
     @mode.Service.task
     async def _consume(self):
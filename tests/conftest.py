@@ -95,7 +95,7 @@ def mock_awatch(mocker):
     mock_awatch = mocker.patch("src.exchange.awatch")
     _changes: Set[Tuple[Change, str]] = set()  # changes must be set
 
-    async def _mock(conf):
+    async def _mock(*paths, **kwargs):
         yield _changes
 
     # mock awatch to avoid the infinite define inside it.
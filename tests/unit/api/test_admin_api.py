@@ -0,0 +1,35 @@
+import pytest
+
+from src.api.server import make_app
+
+pytestmark = pytest.mark.api
+
+
+@pytest.mark.asyncio
+async def test_get_profile(aiohttp_client, tmp_path):
+    client = await aiohttp_client(make_app(db=tmp_path / "db.sqlite3"))
+    url = client.app.router["admin_profile"].url_for()
+
+    rs = await client.get(url.with_query(seconds="0.1"))
+    assert rs.status == 200
+    assert "attachment" in rs.headers["Content-Disposition"]
+    for line in (await rs.text()).splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+    rs = await client.get(url.with_query(seconds="soon"))
+    assert rs.status == 400
+
+
+@pytest.mark.asyncio
+async def test_get_tasks_and_loop_lag(aiohttp_client, tmp_path):
+    client = await aiohttp_client(make_app(db=tmp_path / "db.sqlite3"))
+
+    rs = await client.get(client.app.router["admin_tasks"].url_for())
+    assert rs.status == 200
+    tasks = await rs.json()
+    assert all(task["count"] >= 1 for task in tasks)
+
+    rs = await client.get(client.app.router["admin_loop"].url_for())
+    assert rs.status == 200
+    assert set((await rs.json())["lag"]) == {"samples", "mean", "max"}
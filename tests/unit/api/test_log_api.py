@@ -394,3 +394,55 @@ async def test_delete_log_entry(client):
     # Make sure the log-entry is successfully deleted.
     rs = await client.get(client.app.router["logs_detail"].url_for(id=data["id"]))
     assert rs.status == 404
+
+
+@pytest.mark.asyncio
+async def test_create_log_entry_with_checksum(client):
+    payload = json.loads(LogEntryFactory.build(checksum="9f86d081884c7d65").json())
+    rs = await client.post(client.app.router["logs_list"].url_for(), json=payload)
+    assert rs.status == 201
+    data = await rs.json()
+
+    rs = await client.get(client.app.router["logs_detail"].url_for(id=data["id"]))
+    assert rs.status == 200
+    assert (await rs.json())["checksum"] == "9f86d081884c7d65"
+
+
+@pytest.mark.asyncio
+async def test_create_log_entry_with_quotes(client):
+    payload = json.loads(
+        LogEntryFactory.build(filename="/data/O'Brien.pdf", reason="can't").json()
+    )
+    rs = await client.post(client.app.router["logs_list"].url_for(), json=payload)
+    assert rs.status == 201
+    data = await rs.json()
+    assert (data["filename"], data["reason"]) == ("/data/O'Brien.pdf", "can't")
+
+
+@pytest.mark.asyncio
+async def test_create_log_entry_with_attempt(client):
+    payload = json.loads(LogEntryFactory.build(attempt=2).json())
+    rs = await client.post(client.app.router["logs_list"].url_for(), json=payload)
+    assert rs.status == 201
+    data = await rs.json()
+
+    rs = await client.get(client.app.router["logs_detail"].url_for(id=data["id"]))
+    assert (await rs.json())["attempt"] == 2
+
+
+@pytest.mark.asyncio
+async def test_create_table_adds_missing_columns(tmp_path):
+    db = tmp_path / "test-db.sqlite3"
+    db.touch()
+    dao = make_app(db=db)["dao"]
+    async with dao.connector() as conn:
+        # A table created by a former version, without the checksum column.
+        await conn.execute("CREATE TABLE log_entries (id BLOB PRIMARY KEY)")
+        await conn.commit()
+
+    await dao.create_table()
+
+    async with dao.connector() as conn:
+        async with conn.execute("PRAGMA table_info(log_entries)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+    assert {"checksum", "attempt", "queue_time", "notify_time"} <= columns
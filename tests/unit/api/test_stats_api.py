@@ -0,0 +1,29 @@
+import pytest
+
+from src.api.server import make_app
+
+pytestmark = pytest.mark.api
+
+
+@pytest.mark.asyncio
+async def test_get_registered_stats(aiohttp_client, tmp_path):
+    app = make_app(
+        db=tmp_path / "db.sqlite3", stats={"scheduler": lambda: {"depth": 3}}
+    )
+    client = await aiohttp_client(app)
+
+    rs = await client.get(client.app.router["stats_detail"].url_for(name="scheduler"))
+    assert rs.status == 200
+    assert await rs.json() == {"depth": 3}
+
+    rs = await client.get(client.app.router["stats_detail"].url_for(name="unknown"))
+    assert rs.status == 404
+
+
+@pytest.mark.asyncio
+async def test_get_metrics(aiohttp_client, tmp_path):
+    client = await aiohttp_client(make_app(db=tmp_path / "db.sqlite3"))
+
+    rs = await client.get(client.app.router["metrics"].url_for())
+    assert rs.status == 200
+    assert "# TYPE filedispatch_transfers_total counter" in await rs.text()
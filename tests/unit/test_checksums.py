@@ -0,0 +1,34 @@
+import hashlib
+import io
+
+import pytest
+
+from src.checksums import HashingReader, copy_with_digest, file_digest
+from src.utils import ChecksumEnum
+
+
+pytestmark = pytest.mark.process
+
+
+class AsyncBytesIO(io.BytesIO):
+    async def read(self, size=-1):
+        return super().read(size)
+
+
+def test_should_hash_the_copied_content(tmp_path):
+    source, destination = tmp_path / "source.mp4", tmp_path / "destination.mp4"
+    source.write_bytes(b"content" * 1000)
+    digest = copy_with_digest(source, destination, ChecksumEnum.sha256, chunk_size=64)
+    assert destination.read_bytes() == source.read_bytes()
+    assert digest == hashlib.sha256(source.read_bytes()).hexdigest()
+    assert digest == file_digest(source, ChecksumEnum.sha256)
+
+
+@pytest.mark.asyncio
+async def test_should_hash_the_streamed_chunks():
+    data = b"content" * 1000
+    reader = HashingReader(AsyncBytesIO(data), ChecksumEnum.blake2b, chunk_size=64)
+    chunks = [chunk async for chunk in reader]
+    assert b"".join(chunks) == data
+    assert reader.size == len(data)
+    assert reader.hexdigest() == hashlib.blake2b(data).hexdigest()
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.startup
+
+# Cold start budget of `import src.cli` in microseconds, about 3 times what it
+# takes on a laptop: the daemons are restarted and health checked through it.
+IMPORT_BUDGET = 500_000
+
+# Only imported once a flag or a configured destination needs them.
+LAZY_MODULES = [
+    "aiohttp",
+    "aioftp",
+    "aiohttp_retry",
+    "aiosqlite",
+    "pypika",
+    "aiohttp_pydantic",
+    "src.api",
+    "src.exchange",
+    "src.workers",
+]
+
+
+def import_cli(*options):
+    return subprocess.run(
+        [sys.executable, *options, "-c", "import sys, src.cli; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def cumulative_time(stderr: str, module: str) -> int:
+    # import time: self [us] | cumulative | imported package
+    for line in stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    raise AssertionError(f"{module} is not imported.")
+
+
+def test_cli_should_not_import_the_dispatcher():
+    imported = set(import_cli().stdout.split())
+
+    assert [module for module in LAZY_MODULES if module in imported] == []
+
+
+def test_cli_should_be_imported_within_budget():
+    stderr = import_cli("-X", "importtime").stderr
+
+    assert cumulative_time(stderr, "src.cli") < IMPORT_BUDGET
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from watchfiles import Change
+
+from src.coalescers import Coalescer
+from src.metrics import WATCHER_EVENTS
+
+pytestmark = pytest.mark.watcher
+
+
+@pytest.fixture
+def emitted():
+    class _Collector(list):
+        async def __call__(self, change, filename):
+            self.append((change, filename))
+
+    return _Collector()
+
+
+@pytest.mark.asyncio
+async def test_should_merge_events_of_a_batch(emitted):
+    sut = Coalescer(emitted)
+    await sut.feed(
+        {
+            (Change.added, "/source/video.mp4"),
+            (Change.modified, "/source/video.mp4"),
+            (Change.modified, "/source/audio.mp3"),
+        }
+    )
+    assert sorted(emitted) == [
+        (Change.added, "/source/video.mp4"),
+        (Change.modified, "/source/audio.mp3"),
+    ]
+    assert sut.stats["received"] == 3
+    assert sut.stats["collapsed"] == 1
+    assert sut.stats["emitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_should_drop_temporary_files(emitted):
+    ignored = WATCHER_EVENTS.labels("ignored").get()
+    sut = Coalescer(emitted)
+    await sut.feed(
+        {
+            (Change.added, "/source/video.mp4.part"),
+            (Change.added, "/source/.notes.txt.swp"),
+            (Change.added, "/source/notes.txt~"),
+        }
+    )
+    assert emitted == []
+    assert sut.stats["ignored"] == 3
+    assert WATCHER_EVENTS.labels("ignored").get() == ignored + 3
+
+
+@pytest.mark.asyncio
+async def test_should_merge_events_of_adjacent_batches(emitted):
+    async with Coalescer(emitted, window=0.1, tick=0.02) as sut:
+        await sut.feed({(Change.added, "/source/video.mp4")})
+        await sut.feed({(Change.deleted, "/source/video.mp4")})
+        await sut.feed({(Change.added, "/source/video.mp4")})
+        assert emitted == []
+        await asyncio.sleep(0.3)
+
+    assert emitted == [(Change.added, "/source/video.mp4")]
+    assert sut.stats["collapsed"] == 2
+    assert len(sut) == 0
+
+
+@pytest.mark.asyncio
+async def test_should_pass_deletions_on(emitted):
+    sut = Coalescer(emitted)
+    await sut.feed({(Change.deleted, "/source/video.mp4")})
+    assert emitted == [(Change.deleted, "/source/video.mp4")]
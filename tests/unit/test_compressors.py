@@ -0,0 +1,49 @@
+import gzip
+import io
+
+import pytest
+
+from src.compressors import CompressingReader, get_compression
+from src.config import FolderModel
+from src.utils import CompressionEnum
+
+
+pytestmark = pytest.mark.process
+
+
+class AsyncBytesIO(io.BytesIO):
+    async def read(self, size=-1):
+        return super().read(size)
+
+
+def test_should_skip_already_compressed_formats():
+    folder = FolderModel(
+        path="https://server/logs", extensions=["log", "mp4"], compression="gzip"
+    )
+    assert get_compression("server.log", folder) == CompressionEnum.gzip
+    assert get_compression("video.MP4", folder) is None
+    assert (
+        get_compression("server.log", FolderModel(path="/tmp", extensions=[])) is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_compress_chunks_as_they_are_read():
+    data = b"2022-10-19 12:00:00 INFO the same log line\n" * 10_000
+    reader = CompressingReader(
+        AsyncBytesIO(data), CompressionEnum.gzip, chunk_size=4096
+    )
+    compressed = b"".join([chunk async for chunk in reader])
+    assert gzip.decompress(compressed) == data
+    assert reader.size == len(data)
+    assert reader.compressed_size == len(compressed) < len(data) / 10
+    assert reader.suffix == ".gz"
+
+
+@pytest.mark.asyncio
+async def test_should_compress_with_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    data = b"the same log line\n" * 10_000
+    reader = CompressingReader(AsyncBytesIO(data), CompressionEnum.zstd)
+    compressed = b"".join([chunk async for chunk in reader])
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == data
@@ -44,3 +44,38 @@ def test_config_generation_failure(mocker, bad_configfile, filesystem):
     assert conf is None
     debug.assert_called_once()
     error.assert_called_once()
+
+
+@pytest.mark.config
+def test_config_with_many_sources(filesystem, tmp_path):
+    data = """sources:
+  - path: mnt/audio
+    folders:
+      - path: mnt/video
+        extensions: [mp4]
+  - path: mnt/document
+    folders:
+      - path: http://localhost/documents/audio
+        extensions: [mp3]
+    """
+    configfile = tmp_path / "config.yml"
+    configfile.write_text(data)
+    conf = Config(config=configfile)()
+    assert conf is not None
+    assert [str(s.path) for s in conf.sources] == ["mnt/audio", "mnt/document"]
+
+
+@pytest.mark.config
+def test_legacy_source_is_folded_into_sources(config):
+    assert len(config.sources) == 1
+    assert config.sources[0].path == config.source
+    assert config.sources[0].folders == config.folders
+
+
+@pytest.mark.config
+def test_config_without_source_is_rejected(mocker, filesystem, tmp_path):
+    error = mocker.patch("src.config.logger.error")
+    configfile = tmp_path / "config.yml"
+    configfile.write_text("folders: []\n")
+    assert Config(config=configfile)() is None
+    error.assert_called_once()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from src.deduplicators import Deduplicator
+
+pytestmark = pytest.mark.dedup
+
+
+@pytest.fixture
+def index(tmp_path):
+    return tmp_path / "dedup.sqlite3"
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    def _make_file(name, content):
+        filename = tmp_path / name
+        filename.write_bytes(content)
+        return str(filename)
+
+    return _make_file
+
+
+@pytest.mark.asyncio
+async def test_should_find_delivered_content(index, make_file):
+    delivered = make_file("delivered.mp4", b"content" * 10_000)
+    async with Deduplicator(index) as sut:
+        await sut.record(delivered, "/tmp/destination")
+
+    # The index survives a restart.
+    async with Deduplicator(index) as sut:
+        copy = make_file("copy.mp4", b"content" * 10_000)
+        assert await sut.lookup(copy, "/tmp/destination") == delivered
+        assert await sut.lookup(copy, "/tmp/elsewhere") is None
+
+
+@pytest.mark.asyncio
+async def test_should_compare_the_whole_content(index, make_file):
+    async with Deduplicator(index) as sut:
+        await sut.record(make_file("delivered.mp4", b"a" * 100_000), "/tmp/dest")
+        other = make_file("other.mp4", b"a" * 99_999 + b"b")
+        assert await sut.lookup(other, "/tmp/dest") is None
+
+
+@pytest.mark.asyncio
+async def test_should_not_hash_files_of_unknown_size(index, make_file, mocker):
+    head_digest = mocker.patch("src.deduplicators.head_digest")
+    file_digest = mocker.patch("src.deduplicators.file_digest")
+    async with Deduplicator(index) as sut:
+        assert await sut.lookup(make_file("new.mp4", b"new"), "/tmp/dest") is None
+    head_digest.assert_not_called()
+    file_digest.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_should_compare_with_the_content_delivered(index, make_file):
+    async with Deduplicator(index) as sut:
+        delivered = make_file("report.csv", b"a" * 100_000)
+        await sut.record(delivered, "/tmp/dest")
+        copy = make_file("copy.csv", b"a" * 100_000)
+
+        # Dropped again with the same size and head, but another content.
+        make_file("report.csv", b"a" * 99_999 + b"b")
+        assert await sut.lookup(delivered, "/tmp/dest") is None
+
+        # Moved once delivered, its content is still known.
+        os.remove(delivered)
+        assert await sut.lookup(copy, "/tmp/dest") == delivered
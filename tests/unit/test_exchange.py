@@ -1,8 +1,15 @@
 import asyncio
+import os
+
 from watchfiles import Change
 
 import pytest
+from src.config import Settings
 from src.exchange import FileWatcher
+from src.journals import Journal
+from src.metrics import QUEUE_DEPTH
+from src.routers import ShardedRouter
+from src.utils import StatusEnum, create_message
 
 pytestmark = pytest.mark.watcher
 
@@ -21,8 +28,100 @@ class TestWatch:
         sut = FileWatcher(config=config)
         sut._collect_unprocessed = mocker.AsyncMock()
         async with sut:
+            await asyncio.sleep(0)
             sut._collect_unprocessed.assert_awaited_once_with(config=config)
 
+    @pytest.mark.asyncio
+    async def test_should_dispatch_while_collecting_unprocessed_files(
+        self, mocker, config, mock_awatch
+    ):
+        sut = FileWatcher(config=config)
+        scanning = asyncio.Event()
+        sut._collect_unprocessed = mocker.AsyncMock(side_effect=scanning.wait)
+        processor = sut.PROCESSORS_REGISTRY["file"]
+        processor.put = mocker.AsyncMock()
+        mocker.patch("src.exchange.aiofiles.os.path.isfile", side_effect=[True])
+        filename = f"{str(config.source).removesuffix('/')}/filename.mp4"
+        mock_awatch({(Change.added, filename)})
+
+        async with sut:
+            await asyncio.sleep(0.1)
+            assert not scanning.is_set()
+            processor.put.assert_awaited_once()
+            scanning.set()
+
+    @pytest.mark.asyncio
+    async def test_should_not_enqueue_twice_files_seen_while_collecting(
+        self, config, mocker
+    ):
+        mocker.patch("src.exchange.WATCH_DEBOUNCE", 50)
+        source = os.path.abspath(config.source)
+        for name in ["first.mp4", "second.mp4"]:
+            open(os.path.join(source, name), "w").close()
+
+        sut = FileWatcher(config=config)
+        collect_directory = sut._collect_directory
+
+        async def _collect_directory(directory, mapping):
+            # The watcher reports the file while the directory is scanned.
+            filename = os.path.join(directory, "first.mp4")
+            await sut._enqueue(filename, sut._search_folder(filename))
+            await collect_directory(directory, mapping)
+
+        sut._collect_directory = _collect_directory
+        await sut._collect_unprocessed(config=config)
+
+        assert sut.unprocessed.qsize() == 2
+
+        # Reported by the watcher once the scan is over.
+        filename = os.path.join(source, "second.mp4")
+        assert not await sut._enqueue(filename, sut._search_folder(filename))
+        await asyncio.sleep(0.15)
+        assert sut._seen is None
+        assert await sut._enqueue(filename, sut._search_folder(filename))
+
+    @pytest.mark.asyncio
+    async def test_should_journal_the_absolute_path_of_the_files(
+        self, config, tmp_path
+    ):
+        filename = os.path.join(str(config.source), "first.mp4")
+        open(filename, "w").close()
+
+        async with Journal(tmp_path / "journal.sqlite3") as journal:
+            sut = FileWatcher(config=config)
+            sut._journal = journal
+            collect_directory = sut._collect_directory
+
+            async def _collect_directory(directory, mapping):
+                # Reported by the watcher with a relative path while scanned.
+                await sut._on_change(Change.added, os.path.relpath(filename))
+                await collect_directory(directory, mapping)
+
+            sut._collect_directory = _collect_directory
+            await sut._collect_unprocessed(config=config)
+            messages, _ = await journal.load()
+
+        assert sut.unprocessed.qsize() == 1
+        assert [m[0] for m in messages] == [os.path.abspath(filename)]
+
+    @pytest.mark.asyncio
+    async def test_should_collect_supported_files_only(self, config):
+        source = str(config.source)
+        for name in ["first.mp4", "second.MP4", "notes.txt"]:
+            open(os.path.join(source, name), "w").close()
+        os.mkdir(os.path.join(source, "directory.mp4"))
+        os.symlink(os.path.join(source, "first.mp4"), os.path.join(source, "link.mp4"))
+
+        sut = FileWatcher(config=config)
+        await sut._collect_unprocessed(config=config)
+
+        collected = set()
+        while not sut.unprocessed.empty():
+            msg = sut.unprocessed.get_nowait()
+            assert msg.body.get("destination") == "mnt/video"
+            collected.add(os.path.basename(msg.body.get("filename")))
+        assert collected == {"first.mp4", "second.MP4"}
+
     @pytest.mark.asyncio
     async def test_should_process_new_added_files(self, mocker, config, mock_awatch):
         sut = FileWatcher(config=config)
@@ -36,7 +135,7 @@ class TestWatch:
             await asyncio.sleep(0)
             queue_put.asset_awaited_once()
             message = queue_put.await_args.args[0]
-            assert message.body.get("filename") == filename
+            assert message.body.get("filename") == os.path.abspath(filename)
 
     @pytest.mark.asyncio
     async def test_should_ignore_directories_and_symlinks(
@@ -75,9 +174,9 @@ class TestWatch:
         processor1 = sut.PROCESSORS_REGISTRY["file"]
         processor2 = sut.PROCESSORS_REGISTRY["http"]
         processor3 = sut.PROCESSORS_REGISTRY["ftp"]
-        processor1.acquire = mocker.MagicMock()
-        processor2.acquire = mocker.MagicMock()
-        processor3.acquire = mocker.MagicMock()
+        processor1.put = mocker.AsyncMock()
+        processor2.put = mocker.AsyncMock()
+        processor3.put = mocker.AsyncMock()
 
         mocker.patch("src.exchange.aiofiles.os.path.isfile", side_effect=[True])
         filename = f"{str(config.source).removesuffix('/')}/filename.mp4"
@@ -86,11 +185,11 @@ class TestWatch:
         mock_awatch(changes)
         async with sut:
             await asyncio.sleep(0.1)
-            processor1.acquire.assert_called_once()
-            message = processor1.acquire.call_args.args[0]
-            assert message.body.get("filename") == filename
-            processor2.acquire.assert_not_called()
-            processor3.acquire.assert_not_called()
+            processor1.put.assert_awaited_once()
+            message = processor1.put.call_args.args[0]
+            assert message.body.get("filename") == os.path.abspath(filename)
+            processor2.put.assert_not_awaited()
+            processor3.put.assert_not_awaited()
 
     @pytest.mark.asyncio
     async def test_should_not_crash_when_no_webapp(self, config):
@@ -103,3 +202,139 @@ class TestWatch:
         async with sut:
             for p in sut.PROCESSORS_REGISTRY.values():
                 assert p.notifier is None
+
+    def test_should_share_a_single_notifier_between_the_workers(self, config):
+        sut = FileWatcher(config, server_url="http://127.0.0.1:8000", endpoint="logs")
+
+        assert {id(p.notifier) for p in sut.PROCESSORS_REGISTRY.values()} == {
+            id(sut._notifier)
+        }
+        assert sut._notifier.url == "http://127.0.0.1:8000/logs"
+
+    def test_should_insert_the_logs_without_http_with_the_webapp(
+        self, config, tmp_path
+    ):
+        sut = FileWatcher(
+            config,
+            server_url="http://127.0.0.1:3001",
+            with_webapp=True,
+            db=tmp_path / "db.sqlite3",
+        )
+
+        assert sut._notifier.dao is sut.server.dao
+
+    @pytest.mark.asyncio
+    async def test_should_route_files_of_many_sources(
+        self, config, mocker, mock_awatch
+    ):
+        config = Settings(
+            sources=[
+                dict(
+                    path="mnt/audio",
+                    folders=[dict(path="mnt/video", extensions=["mp4"])],
+                ),
+                dict(
+                    path="mnt/document",
+                    folders=[dict(path="mnt/image", extensions=["MP4"])],
+                ),
+            ]
+        )
+        sut = FileWatcher(config=config)
+        queue_put = mocker.patch("src.exchange.Queue.put")
+        mocker.patch("src.exchange.aiofiles.os.path.isfile", return_value=True)
+        changes = {
+            (Change.added, "mnt/audio/filename.mp4"),
+            (Change.added, "mnt/document/filename.MP4"),
+        }
+        mock_awatch(changes)
+
+        async with sut:
+            await asyncio.sleep(0)
+            routed = {
+                call.args[0].body.get("filename"): call.args[0].body.get("destination")
+                for call in queue_put.await_args_list
+            }
+            assert routed == {
+                os.path.abspath("mnt/audio/filename.mp4"): "mnt/video",
+                os.path.abspath("mnt/document/filename.MP4"): "mnt/image",
+            }
+
+    @pytest.mark.asyncio
+    async def test_should_hold_new_files_until_they_are_stable(
+        self, config, mocker, mock_awatch
+    ):
+        config.quiet_period = 60
+        sut = FileWatcher(config=config)
+        queue_put = mocker.patch("src.exchange.Queue.put")
+        mocker.patch("src.exchange.aiofiles.os.path.isfile", side_effect=[True])
+        filename = f"{str(config.source).removesuffix('/')}/filename.mp4"
+        mock_awatch({(Change.added, filename)})
+
+        async with sut:
+            await asyncio.sleep(0)
+            queue_put.assert_not_awaited()
+            assert os.path.abspath(filename) in sut._stabilizer
+
+    @pytest.mark.asyncio
+    async def test_should_dispatch_once_files_reported_many_times(
+        self, config, mocker, mock_awatch
+    ):
+        sut = FileWatcher(config=config)
+        queue_put = mocker.patch("src.exchange.Queue.put")
+        mocker.patch("src.exchange.aiofiles.os.path.isfile", return_value=True)
+        filename = f"{str(config.source).removesuffix('/')}/filename.mp4"
+        changes = {
+            (Change.added, filename),
+            (Change.modified, filename),
+            (Change.added, f"{filename}.part"),
+        }
+        mock_awatch(changes)
+
+        async with sut:
+            await asyncio.sleep(0)
+            queue_put.assert_awaited_once()
+            assert sut._coalescer.stats["collapsed"] == 1
+            assert sut._coalescer.stats["ignored"] == 1
+            assert sut.stats["watcher"]() == dict(
+                received=3, ignored=1, collapsed=1, emitted=1
+            )
+
+    @pytest.mark.asyncio
+    async def test_should_resume_the_journaled_work(self, config, tmp_path):
+        source = os.path.abspath(config.source)
+        delivered, pending = [
+            os.path.join(source, name) for name in ["delivered.mp4", "pending.mp4"]
+        ]
+        for filename in [delivered, pending]:
+            open(filename, "w").close()
+
+        journal = tmp_path / "journal.sqlite3"
+        async with Journal(journal) as previous:
+            previous.finished(
+                create_message(delivered, "mnt/video"), StatusEnum.SUCCEEDED
+            )
+            previous.in_flight(create_message(pending, "mnt/video"))
+
+        sut = FileWatcher(config=config, journal=journal)
+        await sut._collect_unprocessed(config=config)
+
+        assert sut.unprocessed.qsize() == 1
+        assert sut.unprocessed.get_nowait().body.get("filename") == pending
+
+    def test_should_not_report_the_idle_local_workers_of_the_shards(self, config):
+        FileWatcher(config=config)
+        sut = FileWatcher(config=config, workers=2)
+
+        exposed = QUEUE_DEPTH.expose()
+        assert 'queue="watcher"' in exposed
+        for name in sut.PROCESSORS_REGISTRY:
+            assert f'queue="{name}"' not in exposed
+        assert sut.stats["scheduler"]() == {}
+
+    def test_should_route_to_shards_with_many_workers(self, config):
+        sut = FileWatcher(config=config, workers=2)
+        assert isinstance(sut._router, ShardedRouter)
+        assert sut._shards in sut._children
+        assert not set(sut.PROCESSORS_REGISTRY.values()) & set(
+            sut.on_init_dependencies()
+        )
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from src.journals import Journal
+from src.utils import StatusEnum, create_message
+
+pytestmark = pytest.mark.journal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return tmp_path / "journal.sqlite3"
+
+
+@pytest.fixture
+def file(tmp_path):
+    filename = tmp_path / "filename.mp4"
+    filename.write_bytes(b"content")
+    return str(filename)
+
+
+@pytest.mark.asyncio
+async def test_should_resume_unfinished_messages(journal_path, file):
+    async with Journal(journal_path) as sut:
+        sut.enqueued(create_message(file, "/tmp/queued"))
+        sut.in_flight(create_message(file, "/tmp/in-flight"))
+        sut.finished(create_message(file, "/tmp/failed"), StatusEnum.FAILED)
+        sut.finished(create_message(file, "/tmp/done"), StatusEnum.SUCCEEDED)
+
+    async with Journal(journal_path) as sut:
+        messages, notifications = await sut.load()
+
+    assert sorted(messages) == [
+        (file, "/tmp/failed"),
+        (file, "/tmp/in-flight"),
+        (file, "/tmp/queued"),
+    ]
+    assert notifications == []
+    assert list(sut.completed) == [(file, "/tmp/done")]
+
+
+@pytest.mark.asyncio
+async def test_should_tell_delivered_files(journal_path, file):
+    async with Journal(journal_path) as sut:
+        sut.finished(create_message(file, "/tmp/done"), StatusEnum.SUCCEEDED)
+
+    async with Journal(journal_path) as sut:
+        await sut.load()
+
+    def entry():
+        with os.scandir(os.path.dirname(file)) as entries:
+            return next(e for e in entries if e.path == file)
+
+    assert sut.is_delivered(entry(), "/tmp/done")
+    assert not sut.is_delivered(entry(), "/tmp/elsewhere")
+
+    with open(file, "ab") as f:
+        f.write(b"more content")
+    assert not sut.is_delivered(entry(), "/tmp/done")
+
+
+@pytest.mark.asyncio
+async def test_should_forget_moved_files(journal_path, file):
+    async with Journal(journal_path) as sut:
+        msg = create_message(file, "/tmp/done")
+        sut.enqueued(msg)
+        sut.finished(msg, StatusEnum.SUCCEEDED, removed=True)
+
+    async with Journal(journal_path) as sut:
+        messages, _ = await sut.load()
+
+    assert messages == []
+    assert sut.completed == {}
+
+
+@pytest.mark.asyncio
+async def test_should_resume_pending_notifications(journal_path):
+    async with Journal(journal_path) as sut:
+        first = sut.notification({"filename": "first.mp4"})
+        sut.notification({"filename": "second.mp4"})
+        sut.notified(first)
+
+    async with Journal(journal_path) as sut:
+        _, notifications = await sut.load()
+        assert sut.notification({"filename": "third.mp4"}) > first + 1
+
+    assert [payload for _, payload in notifications] == [{"filename": "second.mp4"}]
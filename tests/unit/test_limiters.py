@@ -0,0 +1,85 @@
+import email.utils
+import time
+
+import pytest
+
+from src.config import FolderModel
+from src.limiters import RateLimits, ThrottledReader, TokenBucket, parse_retry_after
+
+
+pytestmark = pytest.mark.limits
+
+
+class TestTokenBucket:
+    def test_should_not_wait_within_the_capacity(self):
+        sut = TokenBucket(10)
+        assert [sut.delay() for _ in range(10)] == [0.0] * 10
+        assert sut.delay() == pytest.approx(0.1, abs=0.01)
+
+    def test_should_wait_for_the_debt_of_big_requests(self):
+        sut = TokenBucket(100)
+        assert sut.delay(300) == pytest.approx(2.0, abs=0.01)
+
+    def test_should_never_wait_when_unlimited(self):
+        sut = TokenBucket(None)
+        assert sut.delay(10**9) == 0.0
+
+    def test_should_wait_until_the_end_of_the_pause(self):
+        sut = TokenBucket(None)
+        sut.pause(3)
+        assert sut.delay() == pytest.approx(3.0, abs=0.01)
+
+    @pytest.mark.asyncio
+    async def test_should_respect_the_rate(self):
+        sut = TokenBucket(50, capacity=1)
+        start = time.monotonic()
+        for _ in range(11):
+            await sut.acquire()
+        assert time.monotonic() - start >= 0.18
+
+
+class TestParseRetryAfter:
+    def test_should_parse_seconds(self):
+        assert parse_retry_after("120") == 120.0
+
+    def test_should_parse_http_date(self):
+        value = email.utils.formatdate(time.time() + 30, usegmt=True)
+        assert parse_retry_after(value) == pytest.approx(30, abs=2)
+
+    def test_should_ignore_past_dates_and_garbage(self):
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+
+class TestRateLimits:
+    def test_should_share_the_limits_of_a_destination(self):
+        folder = FolderModel(
+            path="/tmp", extensions=["pdf"], rate_limit=2, bandwidth="1MB"
+        )
+        sut = RateLimits(bandwidth=10_000_000)
+
+        limits = sut.get("https://server/documents", folder)
+        other = sut.get("https://server/documents", folder)
+
+        assert limits.requests is other.requests
+        assert [b.rate for b in limits.buckets] == [1_000_000, 10_000_000]
+        assert limits.buckets[1] is sut.get("/tmp/images").buckets[0]
+
+    def test_should_not_be_throttled_without_bandwidth(self):
+        limits = RateLimits().get("https://server/documents")
+        assert limits.requests.rate is None
+        assert not limits.throttled
+
+    @pytest.mark.asyncio
+    async def test_should_shape_the_bandwidth(self, tmp_path):
+        chunks = [b"x" * 1000] * 5
+
+        async def source():
+            for chunk in chunks:
+                yield chunk
+
+        reader = ThrottledReader(source(), [TokenBucket(10_000, capacity=1000)])
+        start = time.monotonic()
+        assert [chunk async for chunk in reader] == chunks
+        assert time.monotonic() - start >= 0.35
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from src.metrics import LOOP_LAG
+from src.monitors import LoopMonitor
+
+pytestmark = pytest.mark.monitoring
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_should_log_the_stack_of_a_blocking_callback(caplog):
+    monitor = LoopMonitor(interval=0.02, threshold=0.05)
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        with caplog.at_level(logging.WARNING, logger="src.monitors"):
+            block_the_loop(0.3)
+            await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    assert monitor.slow_callbacks == 1
+    assert monitor.max_lag >= 0.25
+    stacks = [r.getMessage() for r in caplog.records if "is blocked" in r.getMessage()]
+    assert len(stacks) == 1
+    assert "block_the_loop" in stacks[0]
+
+
+@pytest.mark.asyncio
+async def test_should_not_report_an_idle_loop():
+    count = LOOP_LAG._children[()].counts[:]
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+    await monitor.start()
+    try:
+        await asyncio.sleep(0.2)
+    finally:
+        await monitor.stop()
+
+    assert monitor.slow_callbacks == 0
+    assert monitor.max_lag < 0.05
+    # The lag is observed at each sample.
+    assert sum(LOOP_LAG._children[()].counts) > sum(count)
+    assert set(monitor.metrics()) == {"lag", "max_lag", "slow_callbacks"}
@@ -1,6 +1,10 @@
+import asyncio
+
 import pytest
 
-from src.notifiers import Notifier
+from src.api.server import make_app
+from src.notifiers import FairQueue, Notifier
+from src.utils import LogRecord, StatusEnum
 
 pytestmark = pytest.mark.notif
 
@@ -49,3 +53,78 @@ async def test_should_handle_webapp_failures(mocker):
     send.return_value.__aenter__.return_value.ok = False
     await sut.notify(payload)
     sut._handle_failure.assert_called_once()
+
+
+def log(worker, filename="scan.pdf", **kwargs):
+    return LogRecord.of(
+        f"/data/{filename}", "/backup", StatusEnum.SUCCEEDED, worker, "file", **kwargs
+    ).as_dict()
+
+
+@pytest.mark.asyncio
+async def test_queue_should_take_the_logs_of_each_worker_in_turn():
+    sut = FairQueue()
+    for i in range(4):
+        sut.put_nowait((log("file", f"{i}.mp4"), None, None, None))
+    sut.put_nowait((log("http"), None, None, None))
+    sut.put_nowait((log("ftp"), None, None, None))
+
+    batch = await sut.get_batch(5)
+
+    assert [payload["worker"] for payload, *_ in batch] == [
+        "file",
+        "http",
+        "ftp",
+        "file",
+        "file",
+    ]
+    assert sut.qsize() == 1
+    # in order, for a given worker.
+    files = [
+        payload["filename"] for payload, *_ in batch if payload["worker"] == "file"
+    ]
+    assert files == ["0.mp4", "1.mp4", "2.mp4"]
+
+
+@pytest.mark.asyncio
+async def test_should_insert_the_logs_in_the_webapp_of_the_process(mocker, tmp_path):
+    db = tmp_path / "db.sqlite3"
+    dao = make_app(db=db)["dao"]
+    await dao.create_table()
+    journal = mocker.MagicMock(notification=mocker.MagicMock(side_effect=[1, 2, 3, 4]))
+    sut = Notifier(dao=dao, journal=journal)
+    post = mocker.patch("src.notifiers.RetryClient.post")
+
+    async with sut:
+        sut.acquire(log("file"))
+        sut.acquire(log("http", byte_size=2048))
+        sut.acquire(dict(log("ftp"), extension="x" * 30))  # rejected
+        sut.acquire(log("file", filename="O'Brien.pdf", reason="can't connect"))
+        await asyncio.sleep(0.2)
+
+    post.assert_not_called()
+    async with dao.connector() as conn:
+        async with conn.execute("SELECT worker, size FROM log_entries") as cursor:
+            rows = sorted(await cursor.fetchall())
+    assert rows == [("file", None), ("file", None), ("http", "2.00 KB")]
+    assert [c.args for c in journal.notified.call_args_list] == [(1,), (2,), (4,)]
+
+
+@pytest.mark.asyncio
+async def test_should_keep_notifying_after_a_failed_post(mocker):
+    journal = mocker.MagicMock(notification=mocker.MagicMock(side_effect=[1, 2]))
+    sut = Notifier(url="http://127.0.0.1:8000/api/v1/logs/", journal=journal)
+    send = mocker.patch("src.notifiers.RetryClient.post")
+    response = mocker.MagicMock(ok=True)
+    send.return_value.__aenter__.side_effect = [asyncio.TimeoutError(), response]
+
+    async with sut:
+        sut.acquire(log("file", "first.pdf"))
+        await asyncio.sleep(0.05)
+        sut.acquire(log("file", "second.pdf"))
+        await asyncio.sleep(0.05)
+
+    sent = [c.kwargs["json"]["filename"] for c in send.call_args_list]
+    assert sent == ["first.pdf", "second.pdf"]
+    # the first one stays journaled, to be sent again on restart.
+    journal.notified.assert_called_once_with(2)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+from src.profilers import (
+    ProfilerBusyError,
+    SamplingProfiler,
+    dump_tasks,
+    format_collapsed,
+    loop_lag,
+)
+
+pytestmark = pytest.mark.profiling
+
+
+def busy_wait(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_should_sample_the_stacks_of_the_loop():
+    profiler = SamplingProfiler(interval=0.001)
+
+    async def blocking():
+        await asyncio.sleep(0.01)
+        busy_wait(0.2)
+
+    task = asyncio.create_task(blocking())
+    stacks = await profiler.profile(0.4)
+    await task
+
+    assert stacks
+    assert any("busy_wait" in stack.split(";")[-1] for stack in stacks)
+    assert not profiler.running
+    line = format_collapsed(stacks).splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert stacks[stack] == int(count)
+
+
+@pytest.mark.asyncio
+async def test_should_run_a_single_profile_at_a_time():
+    profiler = SamplingProfiler()
+    first = asyncio.create_task(profiler.profile(0.1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ProfilerBusyError):
+        await profiler.profile(0.1)
+
+    await first
+    assert await profiler.profile(0.01) is not None
+
+
+@pytest.mark.asyncio
+async def test_should_stop_sampling_when_cancelled():
+    profiler = SamplingProfiler()
+    task = asyncio.create_task(profiler.profile(30))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    await asyncio.sleep(0.05)
+    assert not profiler.running
+
+
+@pytest.mark.asyncio
+async def test_should_group_the_tasks_by_coroutine():
+    async def idle():
+        await asyncio.sleep(10)
+
+    tasks = [asyncio.create_task(idle()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    groups = {g["coroutine"]: g for g in dump_tasks()}
+    group = groups[idle.__qualname__]
+    assert group["count"] == 3
+    assert sum(group["awaiting"].values()) == 3
+    for task in tasks:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_should_measure_the_loop_lag():
+    lag = await loop_lag(samples=3, interval=0.001)
+    assert lag["samples"] == 3
+    assert 0 <= lag["mean"] <= lag["max"]
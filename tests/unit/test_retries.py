@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from src.config import FolderModel
+from src.retries import RetryScheduler, backoff
+from src.utils import StatusEnum, create_message
+from src.workers import FileWorker
+
+
+pytestmark = pytest.mark.retries
+
+
+def message(filename, max_attempts=3):
+    folder = FolderModel(path="/tmp", extensions=["pdf"], max_attempts=max_attempts)
+    return create_message(str(filename), "/tmp", folder=folder)
+
+
+def test_backoff_should_grow_exponentially_up_to_the_cap():
+    for attempt, delay in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 10)]:
+        values = [backoff(attempt, base=1, cap=10) for _ in range(100)]
+        assert all(delay / 2 <= value <= delay for value in values)
+        assert len(set(values)) > 1  # jittered
+
+
+def test_should_retry_until_the_max_attempts():
+    sut = RetryScheduler(base=1)
+    msg = message("invoice.pdf", max_attempts=3)
+
+    assert sut.retry(msg, print)
+    assert msg.attempt == 2
+    assert sut.retry(msg, print)
+    assert msg.attempt == 3
+    assert not sut.retry(msg, print)
+    assert len(sut) == 1  # rescheduled, not duplicated.
+
+
+@pytest.mark.asyncio
+async def test_should_queue_the_messages_again_after_the_delay():
+    sut = RetryScheduler(base=0.1, tick=0.02)
+    requeued = asyncio.Queue()
+    messages = [message(f"{i}.pdf") for i in range(1000)]
+    for msg in messages:
+        sut.retry(msg, requeued.put_nowait)
+
+    await sut.start()
+    try:
+        await asyncio.sleep(0.2)
+    finally:
+        await sut.stop()
+
+    assert requeued.qsize() == 1000
+    assert sut.metrics() == dict(pending=0, dead_letters=0)
+
+
+@pytest.mark.asyncio
+async def test_should_move_the_files_given_up_to_the_dead_letters(tmp_path):
+    dead_letter = tmp_path / "dead"
+    sut = RetryScheduler(dead_letter=dead_letter)
+    first, second = tmp_path / "a" / "scan.pdf", tmp_path / "b" / "scan.pdf"
+    for filename in (first, second):
+        filename.parent.mkdir()
+        filename.write_bytes(b"%PDF")
+
+    assert await sut.bury(message(first)) == dead_letter / "scan.pdf"
+    target = await sut.bury(message(second))
+
+    assert target.parent == dead_letter and target.name.startswith("scan-")
+    assert not first.exists() and not second.exists()
+    assert sut.buried == 2
+
+
+@pytest.mark.asyncio
+async def test_worker_should_retry_the_failed_transfers(mocker, tmp_path):
+    journal, retries = mocker.MagicMock(), RetryScheduler(dead_letter=tmp_path / "dead")
+    sut = FileWorker(journal=journal, retries=retries)
+    sut.notifier = mocker.MagicMock(maybe_start=mocker.AsyncMock())
+    filename = tmp_path / "scan.pdf"
+    filename.write_bytes(b"%PDF")
+    msg = create_message(
+        str(filename),
+        str(tmp_path / "missing"),
+        folder=FolderModel(path="/tmp", extensions=["pdf"], max_attempts=2),
+    )
+
+    await sut._notify(msg, StatusEnum.FAILED, "No such file or directory")
+    journal.finished.assert_not_called()
+    await sut._notify(msg, StatusEnum.FAILED, "No such file or directory")
+
+    journal.finished.assert_called_once_with(msg, StatusEnum.FAILED, removed=False)
+    attempts = [c.args[0]["attempt"] for c in sut.notifier.acquire.call_args_list]
+    assert attempts == [1, 2]
+    assert (tmp_path / "dead" / "scan.pdf").exists()
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from src.config import FolderModel
+from src.schedulers import LaneScheduler, MiB
+from src.utils import create_message
+
+
+pytestmark = pytest.mark.scheduling
+
+
+def message(name, priority=0):
+    folder = FolderModel(path="/tmp", extensions=["mp4"], priority=priority)
+    return create_message(name, "/tmp", folder=folder)
+
+
+def drain(sut):
+    names = []
+    while not sut.empty():
+        names.append(sut.get_nowait().body["filename"])
+    return names
+
+
+def test_should_send_small_files_first():
+    sut = LaneScheduler()
+    sut.put_nowait(message("big.mp4"), size=50 * 1024 * MiB)
+    sut.put_nowait(message("medium.mp4"), size=10 * MiB)
+    sut.put_nowait(message("small-1.pdf"), size=10)
+    sut.put_nowait(message("small-2.pdf"), size=10)
+    assert drain(sut) == ["small-1.pdf", "small-2.pdf", "medium.mp4", "big.mp4"]
+
+
+def test_should_send_high_priority_folders_first():
+    sut = LaneScheduler()
+    sut.put_nowait(message("low.pdf"), size=10)
+    sut.put_nowait(message("high.pdf", priority=1), size=10)
+    sut.put_nowait(message("urgent.mp4", priority=5), size=10 * MiB)
+    assert drain(sut) == ["urgent.mp4", "high.pdf", "low.pdf"]
+
+
+def test_should_not_starve_big_files(mocker):
+    now = mocker.patch("src.schedulers.time.monotonic", return_value=0)
+    sut = LaneScheduler(aging=10)
+    sut.put_nowait(message("big.mp4"), size=100 * MiB)
+    now.return_value = 25  # waited more than two lanes worth.
+    sut.put_nowait(message("small.pdf"), size=10)
+    assert drain(sut) == ["big.mp4", "small.pdf"]
+
+
+def test_should_not_starve_low_priority_folders(mocker):
+    now = mocker.patch("src.schedulers.time.monotonic", return_value=0)
+    sut = LaneScheduler(aging=1)
+    sut.put_nowait(message("low.pdf"), size=10)
+    now.return_value = 50
+    served = []
+    for i in range(20):
+        sut.put_nowait(message(f"high-{i}.pdf", priority=5), size=10)
+        served.append(sut.get_nowait().body["filename"])
+    # Waited more than five priority levels worth.
+    assert served[0] == "low.pdf"
+
+
+@pytest.mark.asyncio
+async def test_should_wait_for_messages():
+    sut = LaneScheduler()
+    getter = asyncio.create_task(sut.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+    await sut.put(message("missing.pdf"))  # size 0 when it can't be read.
+    assert (await getter).body["filename"] == "missing.pdf"
+
+
+@pytest.mark.asyncio
+async def test_should_wait_for_room_when_full():
+    sut = LaneScheduler(maxsize=1)
+    await sut.put(message("first.pdf"))
+    putter = asyncio.create_task(sut.put(message("second.pdf")))
+    await asyncio.sleep(0)
+    assert not putter.done()
+    await sut.put(message("requeued.pdf"), wait=False)
+    assert sut.get_nowait().body["filename"] == "first.pdf"
+    await asyncio.sleep(0)
+    assert not putter.done()  # The requeued message took the room.
+    assert sut.get_nowait().body["filename"] == "requeued.pdf"
+    await asyncio.wait_for(putter, 1)
+    assert drain(sut) == ["second.pdf"]
+
+
+def test_should_report_lanes_metrics():
+    sut = LaneScheduler()
+    sut.put_nowait(message("small.pdf"), size=10)
+    sut.put_nowait(message("big.mp4"), size=100 * MiB)
+    sut.get_nowait()
+    metrics = sut.metrics()
+    assert metrics["small"]["served"] == 1
+    assert metrics["small"]["depth"] == 0
+    assert metrics["small"]["wait_p50"] >= 0
+    assert metrics["large"]["depth"] == 1
+    assert metrics["large"]["wait_p50"] is None
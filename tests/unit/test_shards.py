@@ -0,0 +1,89 @@
+import os
+import pickle
+
+import mode
+import pytest
+
+from src.config import FolderModel
+from src.shards import FolderTable, ShardPool, shard_of
+from src.utils import StatusEnum, create_message
+
+
+pytestmark = pytest.mark.shards
+
+
+class Collector(mode.Service):
+    def __init__(self, **kwargs):
+        self.payloads = []
+        super().__init__(**kwargs)
+
+    def acquire(self, payload, **kwargs):
+        self.payloads.append(payload)
+
+
+def test_should_always_send_a_destination_to_the_same_shard():
+    destinations = [f"/tmp/destination-{i}" for i in range(100)]
+    shards = [shard_of(d, 4) for d in destinations]
+    assert shards == [shard_of(d, 4) for d in destinations]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_should_send_the_number_of_the_folder_of_the_messages():
+    folders = [
+        FolderModel(path="/tmp/videos", extensions=["mp4"]),
+        FolderModel(path="/tmp/documents", extensions=["pdf"]),
+    ]
+    sut = FolderTable(folders)
+    message = create_message(
+        "/tmp/source/file.pdf", "/tmp/documents", folder=folders[1]
+    )
+
+    sent = pickle.dumps(sut.pack(message))
+    assert len(sent) < len(pickle.dumps(message)) / 2
+    assert message.folder is folders[1]
+
+    # Handed once to the shard, its messages share its copy of the folders.
+    shard = pickle.loads(pickle.dumps(sut))
+    received = [shard.unpack(pickle.loads(sent)) for _ in range(2)]
+    assert received[0].folder == folders[1]
+    assert received[0].folder is received[1].folder is shard.folders[1]
+    assert received[0].id == message.id
+
+
+@pytest.mark.asyncio
+async def test_should_send_files_from_shard_processes(tmp_path, mocker):
+    # The children are spawned in the working directory, a former test may
+    # have removed it.
+    os.chdir(tmp_path)
+    source = tmp_path / "source"
+    source.mkdir()
+    destinations = [tmp_path / f"destination-{i}" for i in range(4)]
+    messages, folders = [], []
+    for i, destination in enumerate(destinations):
+        destination.mkdir()
+        filename = source / f"file-{i}.txt"
+        filename.write_text(f"content {i}")
+        folders.append(FolderModel(path=str(destination), extensions=["txt"]))
+        messages.append(
+            create_message(str(filename), str(destination), folder=folders[i])
+        )
+
+    journal = mocker.MagicMock()
+    sut = ShardPool(2, journal=journal, notifier=Collector(), folders=folders)
+    await sut.start()
+    for message in messages:
+        await sut.send(message)
+    await sut.stop()
+
+    for i, destination in enumerate(destinations):
+        assert (destination / f"file-{i}.txt").read_text() == f"content {i}"
+    assert sorted(p["filename"] for p in sut.notifier.payloads) == sorted(
+        f"file-{i}.txt" for i in range(4)
+    )
+    assert {p["status"] for p in sut.notifier.payloads} == {StatusEnum.SUCCEEDED}
+    assert journal.in_flight.call_count == 4
+    assert journal.finished.call_count == 4
+    # Sent back with their folder, as the supervisor knows it.
+    finished = [c.args[0] for c in journal.finished.call_args_list]
+    assert {id(m.folder) for m in finished} == {id(f) for f in folders}
+    assert sum(sut.stats.values()) == 4
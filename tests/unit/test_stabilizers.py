@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+import pytest
+
+from src.stabilizers import Stabilizer
+
+pytestmark = pytest.mark.stability
+
+
+@pytest.fixture
+def stable():
+    class _Collector(list):
+        async def __call__(self, filename, destination):
+            self.append((filename, destination))
+
+    return _Collector()
+
+
+@pytest.mark.asyncio
+async def test_should_dispatch_stable_files_once(tmp_path, stable):
+    filename = tmp_path / "filename.mp4"
+    filename.write_bytes(b"content")
+    os.utime(filename, (0, 0))
+
+    async with Stabilizer(0.1, stable, tick=0.02) as sut:
+        sut.observe(str(filename), "/tmp/destination")
+        sut.observe(str(filename), "/tmp/destination")
+        await asyncio.sleep(0.3)
+
+    assert stable == [(str(filename), "/tmp/destination")]
+    assert len(sut) == 0
+
+
+@pytest.mark.asyncio
+async def test_should_wait_for_files_being_written(tmp_path, stable):
+    filename = tmp_path / "filename.mp4"
+    filename.write_bytes(b"")
+
+    async with Stabilizer(0.2, stable, tick=0.02) as sut:
+        sut.observe(str(filename), "/tmp/destination")
+        for _ in range(5):
+            await asyncio.sleep(0.1)
+            with open(filename, "ab") as f:
+                f.write(b"chunk")
+            sut.touch(str(filename))
+        assert stable == []
+        await asyncio.sleep(0.5)
+
+    assert stable == [(str(filename), "/tmp/destination")]
+
+
+@pytest.mark.asyncio
+async def test_should_forget_deleted_files(tmp_path, stable):
+    filename = tmp_path / "filename.mp4"
+    filename.write_bytes(b"content")
+
+    async with Stabilizer(0.1, stable, tick=0.02) as sut:
+        sut.observe(str(filename), "/tmp/destination")
+        filename.unlink()
+        await asyncio.sleep(0.3)
+
+    assert stable == []
+    assert len(sut) == 0
@@ -0,0 +1,48 @@
+import gzip
+
+import pytest
+
+from src.checksums import file_digest
+from src.stages import StageRunner, digest_file, segments
+from src.utils import ChecksumEnum, CompressionEnum
+
+
+pytestmark = pytest.mark.process
+
+
+def test_should_split_file_in_segments():
+    assert segments(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert segments(8, 4) == [(0, 4), (4, 4)]
+    assert segments(0, 4) == [(0, 0)]
+
+
+@pytest.mark.parametrize("size", [0, 10, 3 * 4096 + 1])
+def test_should_hash_mapped_segments(tmp_path, size):
+    filename = tmp_path / "filename.mp4"
+    filename.write_bytes(bytes(range(256)) * (size // 256) + b"x" * (size % 256))
+    assert digest_file(filename, ChecksumEnum.sha256, 4096) == file_digest(
+        filename, ChecksumEnum.sha256
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_run_stages_in_processes(tmp_path):
+    filename = tmp_path / "server.log"
+    filename.write_bytes(b"INFO the same log line\n" * 100_000)
+    sut = StageRunner(2)
+    assert sut.executor._mp_context.get_start_method() == "spawn"
+    try:
+        digest = await sut.digest(filename, ChecksumEnum.blake2b)
+        chunks = [
+            chunk
+            async for chunk in sut.compress(
+                filename, CompressionEnum.gzip, segment_size=64 * 1024
+            )
+        ]
+    finally:
+        await sut.stop()
+
+    assert digest == file_digest(filename)
+    # One gzip member per segment, the whole is a valid gzip file.
+    assert len(chunks) == len(segments(filename.stat().st_size, 64 * 1024))
+    assert gzip.decompress(b"".join(chunks)) == filename.read_bytes()
@@ -0,0 +1,46 @@
+import pytest
+
+from src.timers import TimerWheel
+
+pytestmark = pytest.mark.timers
+
+
+def advance(wheel, ticks):
+    expired = []
+    for _ in range(ticks):
+        expired += wheel.advance()
+    return expired
+
+
+def test_timer_fires_after_its_delay():
+    sut = TimerWheel(tick=1, slots=8)
+    sut.schedule("key", 3, "value")
+    assert advance(sut, 2) == []
+    assert advance(sut, 1) == [("key", "value")]
+    assert len(sut) == 0
+
+
+def test_timer_longer_than_a_round():
+    sut = TimerWheel(tick=1, slots=4)
+    sut.schedule("long", 9)
+    sut.schedule("round", 8)
+    assert advance(sut, 7) == []
+    assert advance(sut, 1) == [("round", None)]
+    assert advance(sut, 1) == [("long", None)]
+
+
+def test_rescheduling_replaces_the_timer():
+    sut = TimerWheel(tick=1, slots=8)
+    sut.schedule("key", 2, "first")
+    sut.schedule("key", 5, "second")
+    assert len(sut) == 1
+    assert advance(sut, 4) == []
+    assert advance(sut, 1) == [("key", "second")]
+
+
+def test_cancelled_timer_never_fires():
+    sut = TimerWheel(tick=1, slots=8)
+    sut.schedule("key", 2, "value")
+    assert sut.cancel("key") == "value"
+    assert "key" not in sut
+    assert advance(sut, 16) == []